@@ -0,0 +1,72 @@
+"""
+Import time benchmark for the plugin modules.
+
+Every measurement runs in a fresh interpreter so module caches do not hide the cost
+of importing. The first use of the runtime (reading the config and building the
+geoserver http session) is measured separately, it is the work that used to happen
+at import time.
+
+    python benchmarks/import_time.py
+    # compare with another checkout, e.g. one made with `git worktree add /tmp/old <rev>`
+    python benchmarks/import_time.py --path /tmp/old
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    'ckanext.geoserver_webservice.helpers',
+    'ckanext.geoserver_webservice.logic',
+]
+
+IMPORT_SNIPPET = '''
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+FIRST_USE_SNIPPET = '''
+import time
+import ckanext.geoserver_webservice.helpers
+from ckanext.geoserver_webservice.runtime import get_runtime
+start = time.perf_counter()
+get_runtime().session
+print(time.perf_counter() - start)
+'''
+
+
+def measure(snippet, path, repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [path, env.get('PYTHONPATH')]))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', snippet], env=env, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='checkout of ckanext-geoserver_webservice to benchmark')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"measurement":<50} {"median ms":>10} {"min ms":>10}')
+    for module in MODULES:
+        median, minimum = measure(IMPORT_SNIPPET.format(module=module), args.path, args.repeat)
+        print(f'{"import " + module:<50} {median:>10.1f} {minimum:>10.1f}')
+    try:
+        median, minimum = measure(FIRST_USE_SNIPPET, args.path, args.repeat)
+        print(f'{"first use of runtime session":<50} {median:>10.1f} {minimum:>10.1f}')
+    except subprocess.CalledProcessError:
+        print(f'{"first use of runtime session":<50} {"n/a":>10} {"n/a":>10}')
+
+
+if __name__ == '__main__':
+    main()
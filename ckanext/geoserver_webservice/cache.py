@@ -0,0 +1,495 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ckanext.geoserver_webservice import metrics
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache():
+    """
+    A thread safe, size bounded least recently used cache whose entries expire
+    after a fixed time to live. Entries can be tagged so that every entry
+    related to a user or organization can be invalidated in one call.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, name=None):
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self.name = name
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        """
+        The get function returns the cached value for key, or default when the key
+        is missing or has expired.
+
+        Args:
+            key: Key of the cached value
+            default: Value returned on a cache miss
+
+        Returns:
+            The cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires, tags = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        """
+        The set function stores value under key, evicting the least recently used
+        entries when the cache is full.
+
+        Args:
+            key: Key of the cached value
+            value: Value to cache
+            tags: Tags used to invalidate the entry later on
+            ttl: Time to live of this entry when shorter than the cache ttl
+        """
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, time.monotonic() + ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                if self.name:
+                    metrics.increment(f'cache.{self.name}.eviction')
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag):
+        """
+        The invalidate_tag function removes every entry stored with the given tag.
+
+        Args:
+            tag: Tag of the entries to remove
+        """
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+_MISSING = object()
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def organization_tag(organization_id):
+    return f'organization:{organization_id}'
+
+
+def api_token_tag(jti):
+    return f'api_token:{jti}'
+
+
+def membership_tag(user_id):
+    return f'membership:{user_id}'
+
+
+class RateLimiter():
+    """
+    Counts events per key in fixed windows of ``window`` seconds. The number of
+    tracked keys is bounded so a flood of distinct keys can not exhaust memory.
+    """
+
+    def __init__(self, limit, window=60, max_size=10000):
+        self.limit = int(limit)
+        self._windows = LRUCache(max_size=max_size, ttl=window)
+
+    def hit(self, key):
+        """
+        The hit function records an event for key.
+
+        Args:
+            key: Key the event is counted against
+
+        Returns:
+            The number of events recorded for key in the current window
+        """
+        with self._windows._lock:
+            counter = self._windows.get(key)
+            if counter is None:
+                counter = [0]
+                self._windows.set(key, counter)
+            counter[0] += 1
+            return counter[0]
+
+    def exceeded(self, key):
+        if self.limit <= 0:
+            return False
+        counter = self._windows.get(key)
+        return counter is not None and counter[0] >= self.limit
+
+
+class TwoTierCache():
+    """
+    Layers a short lived in process LRUCache (L1) over a redis cache (L2) shared by every
+    worker. L2 entries are stored as compact json under a digest of the key together with
+    their tags and expiry time, along with redis sets per tag so tag invalidation works
+    across workers. Values must therefore be
+    json serialisable. Without a redis connection or with a ttl of 0 only L1 is used.
+    Hits, misses and evictions are counted per tier.
+    """
+
+    def __init__(self, l1, connect=None, ttl=300, prefix='ckanext.geoserver_webservice:cache:'):
+        self.l1 = l1
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._connect = connect
+        self._redis = None
+
+    @property
+    def shared(self):
+        return self.ttl > 0 and self._connect is not None
+
+    @property
+    def redis(self):
+        # The connection is only made on first use.
+        if self._redis is None:
+            self._redis = self._connect()
+        return self._redis
+
+    def get(self, key, default=None):
+        """
+        The get function returns the value cached for key from L1, or from L2 on an L1 miss
+        in which case the value is copied into L1.
+
+        Args:
+            key: Key of the cached value
+            default: Value returned on a cache miss
+
+        Returns:
+            The cached value or default
+        """
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            metrics.increment('cache.l1.hit')
+            return value
+        metrics.increment('cache.l1.miss')
+        if not self.shared:
+            return default
+        try:
+            data = self.redis.get(self._key(key))
+        except Exception as e:
+            metrics.increment('cache.l2.error')
+            log.error(e, exc_info=True)
+            return default
+        if data is None:
+            metrics.increment('cache.l2.miss')
+            return default
+        entry = json.loads(data)
+        # The copy in L1 must not outlive the entry, e.g. the expiry of an api token. Entries
+        # written without their expiry are not used.
+        remaining = entry[2] - time.time() if len(entry) == 3 else 0
+        if remaining <= 0:
+            metrics.increment('cache.l2.miss')
+            return default
+        metrics.increment('cache.l2.hit')
+        tags, value = entry[0], entry[1]
+        self.l1.set(key, value, tags=tags, ttl=remaining)
+        return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        """
+        The set function stores value under key in both tiers.
+
+        Args:
+            key: Key of the cached value
+            value: Value to cache
+            tags: Tags used to invalidate the entry later on
+            ttl: Time to live of this entry when shorter than the ttl of a tier
+        """
+        tags = list(tags)
+        self.l1.set(key, value, tags=tags, ttl=ttl)
+        if not self.shared:
+            return
+        l2_ttl = self.ttl if ttl is None else min(int(ttl), self.ttl)
+        if l2_ttl <= 0:
+            return
+        redis_key = self._key(key)
+        expires = time.time() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        data = json.dumps([tags, value, expires], separators=(',', ':'))
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.setex(redis_key, l2_ttl, data)
+            for tag in tags:
+                pipeline.sadd(self._tag_key(tag), redis_key)
+                pipeline.expire(self._tag_key(tag), self.ttl)
+            pipeline.execute()
+        except Exception as e:
+            metrics.increment('cache.l2.error')
+            log.error(e, exc_info=True)
+
+    def acquire(self, key, timeout):
+        """
+        The acquire function takes the L2 lock of key so that only one worker fills the entry.
+
+        Args:
+            key: Key of the cached value
+            timeout: Seconds after which the lock expires should its holder never release it
+
+        Returns:
+            A token to release the lock with, True when there is no L2 to coordinate through,
+            or None when another worker holds the lock
+        """
+        if not self.shared:
+            return True
+        token = uuid.uuid4().hex
+        try:
+            if self.redis.set(self._lock_key(key), token, nx=True, px=max(int(timeout * 1000), 1)):
+                return token
+            return None
+        except Exception as e:
+            metrics.increment('cache.l2.error')
+            log.error(e, exc_info=True)
+            return True
+
+    def release(self, key, token):
+        """
+        The release function drops the L2 lock of key unless it expired and was taken by another worker since.
+
+        Args:
+            key: Key of the cached value
+            token: Token returned by acquire
+        """
+        if token is True or token is None:
+            return
+        try:
+            self.redis.eval(_RELEASE_LOCK, 1, self._lock_key(key), token)
+        except Exception as e:
+            metrics.increment('cache.l2.error')
+            log.error(e, exc_info=True)
+
+    def wait(self, key, timeout, interval=0.02):
+        """
+        The wait function polls L2 until the worker holding the lock of key stored the entry.
+
+        Args:
+            key: Key of the cached value
+            timeout: Maximum number of seconds to wait
+            interval: Seconds between polls
+
+        Returns:
+            True once the entry is in L2, False when the lock was released without storing it
+            or the wait timed out
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                pipeline = self.redis.pipeline()
+                pipeline.exists(self._key(key))
+                pipeline.exists(self._lock_key(key))
+                stored, locked = pipeline.execute()
+            except Exception as e:
+                metrics.increment('cache.l2.error')
+                log.error(e, exc_info=True)
+                return False
+            if stored:
+                return True
+            if not locked or time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def invalidate(self, key):
+        self.l1.invalidate(key)
+        if self.shared:
+            try:
+                self.redis.delete(self._key(key))
+            except Exception as e:
+                metrics.increment('cache.l2.error')
+                log.error(e, exc_info=True)
+
+    def invalidate_tag(self, tag):
+        """
+        The invalidate_tag function removes every entry stored with tag from L1 of this worker only,
+        use invalidate_shared_tags to remove them from L2.
+
+        Args:
+            tag: Tag of the entries to remove
+        """
+        self.l1.invalidate_tag(tag)
+
+    def invalidate_shared_tags(self, tags):
+        """
+        The invalidate_shared_tags function removes every L2 entry stored with any of the tags.
+
+        Args:
+            tags: Tags of the entries to remove
+        """
+        if not self.shared:
+            return
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        if not tag_keys:
+            return
+        try:
+            pipeline = self.redis.pipeline()
+            for tag_key in tag_keys:
+                pipeline.smembers(tag_key)
+            keys = set()
+            for members in pipeline.execute():
+                keys.update(members)
+            self.redis.delete(*keys, *tag_keys)
+            metrics.increment('cache.l2.invalidation', len(keys))
+        except Exception as e:
+            metrics.increment('cache.l2.error')
+            log.error(e, exc_info=True)
+
+    def clear(self):
+        """
+        The clear function empties L1 of this worker, L2 is left untouched.
+        """
+        self.l1.clear()
+
+    def __len__(self):
+        return len(self.l1)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _key(self, key):
+        return self.prefix + hashlib.sha256(str(key).encode('utf-8')).hexdigest()
+
+    def _tag_key(self, tag):
+        return f'{self.prefix}tag:{tag}'
+
+    def _lock_key(self, key):
+        return self._key(key) + ':lock'
+
+
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight():
+    """
+    Coalesces concurrent calls for the same key so only one of them does the work and the
+    others wait for and share its result. With a shared TwoTierCache the calling threads of
+    different workers are coalesced as well: one worker takes the L2 lock of the key and the
+    others poll L2 for its entry, falling back to doing the work themselves after wait_timeout.
+    """
+
+    def __init__(self, timeout=30, cache=None, lock_timeout=5, wait_timeout=1):
+        self.timeout = float(timeout)
+        self.cache = cache
+        self.lock_timeout = float(lock_timeout)
+        self.wait_timeout = float(wait_timeout)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, cached=None):
+        """
+        The do function calls fn unless a call for key is already running in another thread,
+        in which case it waits for that call and returns its result. When another worker is
+        already filling the cache for key, cached is used to read its result from the cache.
+
+        Args:
+            key: Key identifying the work
+            fn: Function doing the work and caching its result under key
+            cached: Function returning the cached result of fn, or None when it is not cached
+
+        Returns:
+            The result of fn
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.increment('cache.coalesced')
+            if call.done.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn()
+        try:
+            call.result = self._fill(key, fn, cached)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _fill(self, key, fn, cached):
+        if self.cache is None or cached is None:
+            return fn()
+        token = self.cache.acquire(key, self.lock_timeout)
+        if token is None:
+            metrics.increment('cache.coalesced.shared')
+            if self.cache.wait(key, self.wait_timeout):
+                result = cached()
+                if result is not None:
+                    return result
+            metrics.increment('cache.coalesced.fallback')
+            return fn()
+        try:
+            return fn()
+        finally:
+            self.cache.release(key, token)
+
+
+class _Call():
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
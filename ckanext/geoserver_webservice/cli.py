@@ -1,14 +1,161 @@
+import datetime
 import logging
 import click
 from ckanext.geoserver_webservice.dbutil import init_tables
-from ckan.lib.cli import CkanCommand
 
 log = logging.getLogger(__name__)
 
-class InitDB(CkanCommand):
-    """Initialise database tables"""
+try:
+    from ckan.lib.cli import CkanCommand
+except ImportError:
+    # paster support is gone from ckan, only the click commands below are available
+    CkanCommand = None
 
-    def command(self):
-        self._load_config()
-        init_tables()
-        log.info("Set up statistics tables in main database")
+if CkanCommand is not None:
+    class InitDB(CkanCommand):
+        """Initialise database tables"""
+
+        def command(self):
+            self._load_config()
+            init_tables()
+            log.info("Set up statistics tables in main database")
+
+
+@click.group(name='geoserver-webservice', short_help='Geoserver webservice commands')
+def geoserver_webservice():
+    pass
+
+@geoserver_webservice.command('rebuild-effective-roles')
+def rebuild_effective_roles():
+    """
+    Rebuild the materialised geoserver_effective_role table from the role and member tables.
+    """
+    from ckanext.geoserver_webservice.model import GeoserverEffectiveRole
+    init_tables()
+    count = GeoserverEffectiveRole.rebuild()
+    click.secho(f'Rebuilt geoserver_effective_role with {count} rows', fg='green')
+
+@geoserver_webservice.command('check-effective-roles')
+def check_effective_roles():
+    """
+    Compare the materialised geoserver_effective_role table with the live role computation.
+    """
+    from ckanext.geoserver_webservice.model import GeoserverEffectiveRole
+    missing, unexpected = GeoserverEffectiveRole.check()
+    for user_id, role, source in sorted(missing):
+        click.echo(f'missing: user={user_id} role={role} source={source}')
+    for user_id, role, source in sorted(unexpected):
+        click.echo(f'unexpected: user={user_id} role={role} source={source}')
+    if missing or unexpected:
+        click.secho(f'{len(missing)} missing and {len(unexpected)} unexpected rows', fg='red')
+        raise click.Abort()
+    click.secho('geoserver_effective_role is up to date', fg='green')
+
+@geoserver_webservice.command('purge-deleted')
+@click.option('--table', 'tables', multiple=True,
+              type=click.Choice(['user_role', 'organization_role', 'authkey']),
+              help='Table to purge, can be repeated. Defaults to all tables.')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1),
+              help='Number of rows deleted per statement.')
+@click.option('--older-than-days', default=None, type=click.IntRange(min=0),
+              help='Only purge rows that were closed more than this many days ago.')
+def purge_deleted(tables, batch_size, older_than_days):
+    """
+    Permanently remove soft deleted roles and authkeys in batches.
+    """
+    from ckanext.geoserver_webservice.model import (
+        GeoserverUserRoleModel, GeoserverOrganizationRoleModel, GeoserverUserAuthkey)
+    models = {
+        'user_role': GeoserverUserRoleModel,
+        'organization_role': GeoserverOrganizationRoleModel,
+        'authkey': GeoserverUserAuthkey,
+    }
+    older_than = None
+    if older_than_days is not None:
+        older_than = datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+    for name in tables or models.keys():
+        model = models[name]
+
+        def progress(total):
+            click.echo(f'{model.__tablename__}: purged {total} rows')
+
+        total = model.purge_deleted(batch_size=batch_size, older_than=older_than, progress=progress)
+        click.secho(f'{model.__tablename__}: done, {total} rows purged', fg='green')
+
+@geoserver_webservice.command('provision-authkeys')
+@click.option('--batch-size', default=5000, show_default=True, type=click.IntRange(min=1),
+              help='Number of users provisioned per statement.')
+@click.option('--dry-run', is_flag=True, help='Only count the users without an authkey.')
+def provision_authkeys(batch_size, dry_run):
+    """
+    Create a geoserver authkey for every active user that does not have one.
+    """
+    from ckanext.geoserver_webservice.export import enqueue_export
+    from ckanext.geoserver_webservice.model import GeoserverUserAuthkey
+    missing = GeoserverUserAuthkey.count_users_without_authkey()
+    click.echo(f'{missing} active users without an authkey')
+    if dry_run or not missing:
+        return
+
+    def progress(total):
+        click.echo(f'created {total} authkeys')
+
+    total = GeoserverUserAuthkey.add_for_all_users(batch_size=batch_size, progress=progress)
+    if total:
+        # One export for the whole run rather than one per batch.
+        enqueue_export()
+    click.secho(f'done, {total} authkeys created', fg='green')
+
+@geoserver_webservice.command('reconcile-geoserver-roles')
+@click.option('--batch-size', default=500, show_default=True, type=click.IntRange(min=1),
+              help='Number of users compared per batch.')
+@click.option('--include-deleted', is_flag=True, help='Also remove the roles of deleted users.')
+@click.option('--dry-run', is_flag=True, help='Only print the changes that would be made.')
+def reconcile_geoserver_roles(batch_size, include_deleted, dry_run):
+    """
+    Make the role assignments held by geoserver's role service match the roles in ckan.
+    """
+    import ckan.model as model
+    from ckan.model import core
+    from ckanext.geoserver_webservice.push import get_role_sync, desired_roles
+    role_sync = get_role_sync()
+    query = model.Session.query(model.User.id).order_by(model.User.id)
+    if not include_deleted:
+        query = query.filter(model.User.state == core.State.ACTIVE)
+    user_ids = [user_id for (user_id,) in query]
+    totals = {'users': 0, 'created': 0, 'added': 0, 'removed': 0}
+    for start in range(0, len(user_ids), batch_size):
+        desired = desired_roles(user_ids[start:start + batch_size])
+        if dry_run:
+            for user, (to_add, to_remove) in sorted(role_sync.diff(desired).items()):
+                click.echo(f'{user}: add {sorted(to_add)} remove {sorted(to_remove)}')
+            continue
+        for key, value in role_sync.push(desired).items():
+            totals[key] += value
+        click.echo(f"reconciled {totals['users']} users")
+    if not dry_run:
+        click.secho(
+            f"done, {totals['added']} roles added, {totals['removed']} removed, {totals['created']} created",
+            fg='green')
+
+@geoserver_webservice.command('export-authkeys')
+@click.option('--path', default=None, help='Properties file to write, defaults to ckanext.geoserver_webservice.export.path.')
+@click.option('--batch-size', default=5000, show_default=True, type=click.IntRange(min=1),
+              help='Number of rows fetched from the database at a time.')
+def export_authkeys(path, batch_size):
+    """
+    Write the active authkeys to an authkey=username properties file for geoserver.
+    """
+    from ckanext.geoserver_webservice.export import export_authkeys as export
+    try:
+        count, changed = export(path=path, batch_size=batch_size)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if changed:
+        click.secho(f'exported {count} authkeys', fg='green')
+    else:
+        click.echo(f'{count} authkeys, file unchanged')
+
+
+def get_commands():
+    return [geoserver_webservice]
@@ -1,6 +1,7 @@
 from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel
 from ckanext.geoserver_webservice.model import GeoserverUserRoleModel
 from ckanext.geoserver_webservice.model import GeoserverUserAuthkey
+from ckanext.geoserver_webservice.model import GeoserverEffectiveRole
 
 import logging
 
@@ -19,6 +20,8 @@ def init_tables():
         GeoserverUserRoleModel.__table__.create()
     if not GeoserverUserAuthkey.__table__.exists():
         GeoserverUserAuthkey.__table__.create()
+    if not GeoserverEffectiveRole.__table__.exists():
+        GeoserverEffectiveRole.__table__.create()
 
 def drop_tables():
     """
@@ -33,3 +36,5 @@ def drop_tables():
         GeoserverUserRoleModel.__table__.drop()
     if not GeoserverUserAuthkey.__table__.exists():
         GeoserverUserAuthkey.__table__.drop()
+    if GeoserverEffectiveRole.__table__.exists():
+        GeoserverEffectiveRole.__table__.drop()
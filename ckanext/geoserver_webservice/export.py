@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from ckanext.geoserver_webservice import metrics
+
+log = logging.getLogger(__name__)
+
+HEADER = '# authkey=username, generated by ckanext-geoserver_webservice, do not edit\n'
+
+
+def write_properties(rows, path, mode=0o600):
+    """
+    The write_properties function writes (authkey, user_name) rows as an authkey=username properties
+    file for geoserver's property authentication key mapper. Rows are streamed into a temporary file
+    next to path which then atomically replaces it, so geoserver never reads a partial file. When the
+    content did not change the existing file is left untouched and geoserver does not reload it.
+
+    Args:
+        rows: An iterable of (authkey, user_name) tuples
+        path: Path of the properties file
+        mode: Permissions of the file, it holds credentials
+
+    Returns:
+        A tuple of the number of keys written and whether the file changed
+    """
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    digest = hashlib.sha256(HEADER.encode('utf-8'))
+    count = 0
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(HEADER)
+            for authkey, user_name in rows:
+                line = f'{_escape(authkey)}={_escape(user_name)}\n'
+                digest.update(line.encode('utf-8'))
+                f.write(line)
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        if _file_digest(path) == digest.hexdigest():
+            os.unlink(temp_path)
+            return count, False
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return count, True
+
+
+def _escape(value):
+    # Keys and values of java properties files treat these characters specially.
+    value = str(value).replace('\\', '\\\\')
+    for char in ('=', ':', ' ', '#', '!'):
+        value = value.replace(char, '\\' + char)
+    return value.replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def export_authkeys(path=None, batch_size=5000):
+    """
+    The export_authkeys function exports the active authkeys of active users to the properties file
+    configured by export.path, it is also run as a background job after authkeys changed.
+
+    Args:
+        path: Path of the properties file, defaults to export.path
+        batch_size: Number of rows fetched from the database at a time
+
+    Returns:
+        A tuple of the number of keys written and whether the file changed
+    """
+    from ckanext.geoserver_webservice.model import GeoserverUserAuthkey
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    path = path or get_runtime().get('export.path')
+    if not path:
+        raise ValueError('No properties file configured, set ckanext.geoserver_webservice.export.path')
+    count, changed = write_properties(GeoserverUserAuthkey.iter_active_usernames(batch_size=batch_size), path)
+    metrics.increment('export.written' if changed else 'export.unchanged')
+    log.info(f'Exported {count} geoserver authkeys to {path}' if changed else f'{path} is up to date')
+    return count, changed
+
+
+def enqueue_export():
+    """
+    The enqueue_export function queues an export of the authkeys when export.path is set.
+    """
+    import ckan.plugins.toolkit as tk
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    if not get_runtime().get('export.path'):
+        return
+    try:
+        tk.enqueue_job(export_authkeys, title='geoserver authkey export')
+    except Exception as e:
+        log.error(e, exc_info=True)
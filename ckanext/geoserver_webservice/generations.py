@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from ckanext.geoserver_webservice import metrics
+
+log = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'ckanext.geoserver_webservice:generation:'
+CHANNEL = 'ckanext.geoserver_webservice:invalidate'
+
+
+class GenerationCounters():
+    """
+    Redis backed generation counters per cache tag (user, organization, api token, ...)
+    used to keep the in process caches of every worker on every node coherent. Bumping a
+    tag increments its counter and publishes the tag, workers subscribed to the channel
+    drop their local entries for it right away. While a worker is not subscribed, e.g.
+    because redis restarted, cached values are checked against the counters they were
+    stored with instead.
+    """
+
+    def __init__(self, redis, on_invalidate, on_resubscribe=None, retry_interval=5):
+        self._redis = redis
+        self._on_invalidate = on_invalidate
+        self._on_resubscribe = on_resubscribe
+        self.retry_interval = float(retry_interval)
+        self.listening = False
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def bump(self, tags):
+        """
+        The bump function increments the counters of tags and notifies every subscribed worker.
+
+        Args:
+            tags: The tags to invalidate
+        """
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return
+        try:
+            pipeline = self._redis.pipeline()
+            # Counters start from the current time rather than 0, so a counter recreated after
+            # redis lost its data never repeats a value handed out before, e.g. in an ETag.
+            start = int(time.time() * 1000)
+            for tag in tags:
+                pipeline.set(REDIS_PREFIX + tag, start, nx=True)
+                pipeline.incr(REDIS_PREFIX + tag)
+            pipeline.publish(CHANNEL, json.dumps(tags))
+            pipeline.execute()
+            metrics.increment('generations.bump', len(tags))
+        except Exception as e:
+            metrics.increment('generations.error')
+            log.error(e, exc_info=True)
+
+    def current(self, tags):
+        """
+        The current function returns the counters of tags in one round trip.
+
+        Args:
+            tags: The tags to read
+
+        Returns:
+            A tuple with the counter of each tag, or None when redis can not be reached
+        """
+        tags = list(tags)
+        if not tags:
+            return ()
+        try:
+            values = self._redis.mget([REDIS_PREFIX + tag for tag in tags])
+        except Exception as e:
+            metrics.increment('generations.error')
+            log.error(e, exc_info=True)
+            return None
+        return tuple(int(value or 0) for value in values)
+
+    def is_current(self, tags, generations):
+        """
+        The is_current function tells whether a value cached with generations can still be used.
+        No round trip is made while the worker is subscribed to the invalidation channel.
+
+        Args:
+            tags: Tags the value was cached with
+            generations: Counters of the tags when the value was resolved
+
+        Returns:
+            True when none of the tags was bumped since
+        """
+        self.ensure_listening()
+        if self.listening:
+            return True
+        return generations is not None and self.current(tags) == generations
+
+    def ensure_listening(self):
+        # Worker processes forked after the first request need their own thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self.listening = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen, name='geoserver-generations', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                # Bumps published while not subscribed were missed.
+                if self._on_resubscribe is not None:
+                    self._on_resubscribe()
+                self.listening = True
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    for tag in json.loads(data):
+                        self._on_invalidate(tag)
+            except Exception as e:
+                log.error(e, exc_info=True)
+            self.listening = False
+            time.sleep(self.retry_interval)
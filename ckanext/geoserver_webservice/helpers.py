@@ -1,46 +1,310 @@
+import os
+import re
+import threading
+import time
 import uuid 
-import requests
 
 import logging
-from requests.auth import HTTPBasicAuth
-from requests_cache import CachedSession, RedisCache
-from ckan.common import config
-
-GEOSERVER_URL = config.get('ckanext.geoserver_webservice.url')
-GEOSERVER_USERNAME = config.get('ckanext.geoserver_webservice.username')
-GEOSERVER_PASSWORD = config.get('ckanext.geoserver_webservice.password')
-DEFAULT_ROLES = config.get('ckanext.geoserver_webservice.default_roles').split()
-REDIS_CONNECTION = config.get('ckan.redis.url', 'redis://localhost:6379/0')
+from ckanext.geoserver_webservice.runtime import get_runtime
+from ckanext.geoserver_webservice import metrics
 
 log = logging.getLogger(__name__)
 
-redis_host, redis_port = REDIS_CONNECTION.split('/')[2].split(':')
-backend = RedisCache(host=redis_host, port=redis_port)
-session = CachedSession('http_cache', backend=backend)
-session.settings.expire_after = 300
-session.settings.stale_if_error = True
+API_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*$')
+API_TOKEN_MAX_LENGTH = 4096
 
-def get_geoserver_roles():
+class GeoserverUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker():
+    """
+    Stops calls to geoserver after ``failure_threshold`` consecutive failures. Once
+    ``reset_timeout`` seconds have passed a single trial call is let through, closing
+    the breaker again when it succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60, name='geoserver'):
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def allow(self):
+        """
+        The allow function decides whether a call may go through.
+
+        Returns:
+            True when the call may be made
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        if getattr(self, 'state', None) != state:
+            log.info(f'{self.name} circuit breaker {state}')
+            metrics.increment(f'{self.name}.breaker.{state}')
+        self.state = state
+        metrics.set_gauge(f'{self.name}.breaker.state', state)
+
+
+def geoserver_request(method, path, **kwargs):
+    """
+    The geoserver_request function calls the geoserver rest api with the configured credentials,
+    timeouts and retries, guarded by the geoserver circuit breaker.
+
+    Args:
+        method: Http method
+        path: Path below the geoserver url, e.g. /rest/security/roles.json
+        kwargs: Passed on to requests
+
+    Returns:
+        The response
+
+    Raises:
+        GeoserverUnavailable: When the circuit breaker is open or the call failed
+    """
+    from requests.auth import HTTPBasicAuth
+    runtime = get_runtime()
+    breaker = runtime.geoserver_breaker
+    if not breaker.allow():
+        metrics.increment('geoserver.breaker.rejected')
+        raise GeoserverUnavailable(f'geoserver circuit breaker is {breaker.state}')
+    kwargs.setdefault('auth', HTTPBasicAuth(runtime.geoserver_username, runtime.geoserver_password))
+    kwargs.setdefault('timeout', runtime.geoserver_timeout)
+    try:
+        response = runtime.session.request(method, f"{runtime.geoserver_url}{path}", **kwargs)
+    except Exception as e:
+        breaker.record_failure()
+        raise GeoserverUnavailable(str(e)) from e
+    if response.status_code >= 500:
+        breaker.record_failure()
+        raise GeoserverUnavailable(f'geoserver responded with {response.status_code}')
+    breaker.record_success()
+    return response
+
+
+class RoleCatalogue():
+    """
+    Per process copy of the geoserver role options, kept up to date by a single background
+    thread. get never waits for geoserver: until the first load finished it returns the
+    configured fallback roles, afterwards the last roles that were fetched. Callers validating
+    roles use ensure_loaded first, which loads the roles synchronously for at most
+    ``load_timeout`` seconds when no load finished yet. A failed refresh
+    keeps the previous roles and is retried with exponential backoff starting at
+    ``RETRY_INTERVAL`` seconds, up to ``refresh_interval``.
+    """
+
+    RETRY_INTERVAL = 10
+
+    def __init__(self, fetch, refresh_interval=300, fallback=(), load_timeout=10):
+        self._fetch = fetch
+        self.refresh_interval = float(refresh_interval)
+        self.load_timeout = float(load_timeout)
+        self.roles = tuple(fallback)
+        self.role_set = frozenset(self.roles)
+        self.loaded_at = None
+        self.healthy = False
+        self.failures = 0
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def get(self):
+        """
+        The get function returns the role options, the fallback roles until the first load finished.
+
+        Returns:
+            A tuple of role names
+        """
+        self._ensure_thread()
+        return self.roles
+
+    def contains(self, role):
+        self.get()
+        return role in self.role_set
+
+    def ensure_loaded(self):
+        """
+        The ensure_loaded function loads the roles synchronously when no load has finished yet.
+        A load already running in the background is waited for, both for at most load_timeout
+        seconds, after which the fallback roles remain in use.
+
+        Returns:
+            True when roles fetched from geoserver are in use
+        """
+        self._ensure_thread()
+        if self.loaded_at is not None:
+            return True
+        if not self._refresh_lock.acquire(timeout=self.load_timeout):
+            return False
+        try:
+            if self.loaded_at is None:
+                self._load()
+        finally:
+            self._refresh_lock.release()
+        return self.loaded_at is not None
+
+    def refresh(self):
+        """
+        The refresh function fetches the roles from geoserver unless another refresh is running.
+
+        Returns:
+            True when this call fetched new roles
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            return self._load()
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self):
+        roles = self._fetch()
+        self.healthy = roles is not None
+        if roles is None:
+            self.failures += 1
+            return False
+        self.failures = 0
+        self.roles = tuple(roles)
+        self.role_set = frozenset(roles)
+        self.loaded_at = time.monotonic()
+        return True
+
+    def next_delay(self):
+        """
+        The next_delay function returns the seconds the background thread waits before the next refresh.
+
+        Returns:
+            refresh_interval after a successful refresh, the backoff delay after failures
+        """
+        if not self.failures:
+            return self.refresh_interval
+        return min(self.RETRY_INTERVAL * 2 ** min(self.failures - 1, 16), self.refresh_interval)
+
+    def _ensure_thread(self):
+        # Worker processes forked after the first request need their own thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='geoserver-roles', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.next_delay())
+
+def fetch_geoserver_roles():
+    """
+    The fetch_geoserver_roles function requests the role list from the geoserver rest api.
+
+    Returns:
+        A list of role options without the ROLE_ prefix and the default roles, or None on failure
+    """
+    runtime = get_runtime()
     try:
-        basic = HTTPBasicAuth(GEOSERVER_USERNAME, GEOSERVER_PASSWORD)
-        roles_url = f"{GEOSERVER_URL}/rest/security/roles.json"
-        response = session.get(roles_url, auth=basic)
+        response = geoserver_request('GET', '/rest/security/roles.json')
         if response.status_code != 200:
             log.error('Failed to fetch local geoserver role options')
-            return []
+            return None
         else:
             all_roles = response.json().get('roles', [])
             options_roles = [x[5:] for x in all_roles if x.startswith('ROLE_')]
-            options_roles = [x for x in options_roles if x not in DEFAULT_ROLES]
+            options_roles = [x for x in options_roles if x not in runtime.default_roles]
             return options_roles
     except Exception as e:
         log.error(e)
         log.error('Failed to fetch local geoserver role options')
-    return []
+    return None
+
+def get_geoserver_roles():
+    """
+    The get_geoserver_roles function returns the geoserver role options from the in process catalogue,
+    loading them first when no load has finished yet.
+
+    Returns:
+        A list of role names
+    """
+    catalogue = get_runtime().role_catalogue
+    catalogue.ensure_loaded()
+    return list(catalogue.get())
+
+def get_geoserver_role_set():
+    """
+    The get_geoserver_role_set function returns the geoserver role options as a frozenset for
+    validating many roles at once.
+
+    Returns:
+        A frozenset of role names
+    """
+    catalogue = get_runtime().role_catalogue
+    catalogue.ensure_loaded()
+    return catalogue.role_set
+
+def is_geoserver_role(role):
+    """
+    The is_geoserver_role function checks a role against the in process catalogue.
+
+    Args:
+        role: Name of the role
+
+    Returns:
+        True when the role is a geoserver role option
+    """
+    catalogue = get_runtime().role_catalogue
+    catalogue.ensure_loaded()
+    return catalogue.contains(role)
     
 def is_valid_uuid(val):
     try:
         uuid.UUID(str(val))
         return True
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+def is_valid_token_format(val):
+    """
+    The is_valid_token_format function checks whether a value is shaped like a ckan api token (a JWT)
+    so malformed keys can be rejected before decoding them.
+
+    Args:
+        val: Value to check
+
+    Returns:
+        True when the value looks like an api token
+    """
+    return isinstance(val, str) and len(val) <= API_TOKEN_MAX_LENGTH and API_TOKEN_PATTERN.match(val) is not None
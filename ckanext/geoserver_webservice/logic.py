@@ -1,15 +1,203 @@
-from ckan.common import config, request
+from ckan.common import request
 from ckanext.geoserver_webservice.model import GeoserverUserRoleModel
 from ckanext.geoserver_webservice.model import GeoserverUserAuthkey
 from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel
-from ckanext.geoserver_webservice.helpers import is_valid_uuid, get_geoserver_roles
+from ckanext.geoserver_webservice.model import GeoserverEffectiveRole
+from ckanext.geoserver_webservice.model import get_effective_roles, get_effective_roles_for_users
+from ckanext.geoserver_webservice.helpers import is_valid_uuid, is_valid_token_format, get_geoserver_roles, is_geoserver_role
+from ckanext.geoserver_webservice.helpers import get_geoserver_role_set
+from ckanext.geoserver_webservice.cache import user_tag, organization_tag, api_token_tag, membership_tag
+from ckanext.geoserver_webservice.runtime import get_runtime
+from ckanext.geoserver_webservice import metrics
+from ckanext.geoserver_webservice.push import enqueue_push
+from ckanext.geoserver_webservice.export import enqueue_export
 from ckan.model import core
 import ckan.plugins.toolkit as tk
 import ckan.model as model
 import ckan.lib.api_token as api_token
+import hashlib
+import json
+import time
+import sqlalchemy as sa
 
-USER_VIEW_ROLES = config.get('ckanext.geoserver_webservice.user_view_roles')
-DEFAULT_ROLES = config.get('ckanext.geoserver_webservice.default_roles').split()
+## CACHE INVALIDATION
+
+def invalidate_tags(tags):
+    """
+    The invalidate_tags function drops the cached entries stored with any of the tags in this
+    worker and, when generations are enabled, bumps their generation counters so every other
+    worker drops them too.
+
+    Args:
+        tags: User, organization, api token or membership tags
+    """
+    runtime = get_runtime()
+    tags = list(dict.fromkeys(tags))
+    runtime.authkey_cache.invalidate_shared_tags(tags)
+    for tag in tags:
+        runtime.invalidate_local(tag)
+    generations = runtime.generations
+    if generations is not None:
+        generations.bump(tags)
+
+def invalidate_user_cache(user_id):
+    """
+    The invalidate_user_cache function drops every cached authkey response that belongs to a user.
+
+    Args:
+        user_id: ID or name of the user
+    """
+    user = model.User.get(user_id)
+    invalidate_tags([user_tag(user.id if user else user_id)])
+
+def invalidate_user_roles(user_id):
+    """
+    The invalidate_user_roles function drops every cached authkey response of a user after their
+    roles or memberships changed and queues a push of their roles to geoserver.
+
+    Args:
+        user_id: ID or name of the user
+    """
+    user = model.User.get(user_id)
+    user_id = user.id if user else user_id
+    invalidate_tags([user_tag(user_id)])
+    enqueue_push([user_id])
+
+def _invalidate_memberships(user_ids):
+    user_ids = list(user_ids)
+    get_runtime().membership_index.invalidate(*user_ids)
+    invalidate_tags([membership_tag(user_id) for user_id in user_ids])
+
+def invalidate_organization_cache(organization_id):
+    """
+    The invalidate_organization_cache function drops every cached authkey response that was
+    resolved using the roles of an organization or belongs to one of its members.
+
+    Args:
+        organization_id: ID of the organization
+    """
+    _invalidate_organizations([organization_id])
+
+def invalidate_api_token_cache(jti):
+    """
+    The invalidate_api_token_cache function drops the decoded api token and every cached
+    authkey response resolved with it.
+
+    Args:
+        jti: ID of the api token
+    """
+    invalidate_tags([api_token_tag(jti)])
+
+def _get_user_from_token(token, cache_key):
+    """
+    The _get_user_from_token function resolves a ckan api token to its owner, caching the result
+    by token digest until the token expires or is revoked.
+
+    Args:
+        token: The api token
+        cache_key: Digest based cache key of the token
+
+    Returns:
+        A (user_id, user_name, jti, ttl) tuple or None, ttl is None for tokens without expiry
+    """
+    cached = get_runtime().api_token_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    user = api_token.get_user_from_token(token)
+    if user is None or user.state != core.State.ACTIVE:
+        return None
+    data = api_token.decode(token) or {}
+    jti = data.get('jti')
+    ttl = data['exp'] - time.time() if data.get('exp') else None
+    result = (user.id, user.name, jti, ttl)
+    tags = [user_tag(user.id), api_token_tag(jti)] if jti else [user_tag(user.id)]
+    get_runtime().api_token_cache.set(cache_key, result, tags=tags, ttl=ttl)
+    return result
+
+def _get_users_from_tokens(tokens):
+    """
+    The _get_users_from_tokens function resolves several ckan api tokens to their owners with a
+    single query for the tokens that are not cached yet.
+
+    Args:
+        tokens: A dictionary of api token to its cache key
+
+    Returns:
+        A dictionary of api token to (user_id, user_name, tags, ttl) for the tokens of active users
+    """
+    runtime = get_runtime()
+    users = {}
+    decoded = {}
+    for token, cache_key in tokens.items():
+        cached = runtime.api_token_cache.get(cache_key)
+        if cached is None:
+            data = api_token.decode(token) or {}
+            if data.get('jti'):
+                decoded[token] = data
+            continue
+        user_id, user_name, jti, ttl = cached
+        users[token] = (user_id, user_name, [api_token_tag(jti)] if jti else [], ttl)
+    if not decoded:
+        return users
+    query = model.Session.query(model.ApiToken.id, model.User.id, model.User.name).join(
+        model.User, model.User.id == model.ApiToken.user_id
+    ).filter(
+        model.ApiToken.id.in_([data['jti'] for data in decoded.values()]),
+        model.User.state == core.State.ACTIVE)
+    owners = {jti: (user_id, user_name) for jti, user_id, user_name in query}
+    for token, data in decoded.items():
+        owner = owners.get(data['jti'])
+        if owner is None:
+            continue
+        jti = data['jti']
+        ttl = data['exp'] - time.time() if data.get('exp') else None
+        runtime.api_token_cache.set(
+            tokens[token], (*owner, jti, ttl), tags=[user_tag(owner[0]), api_token_tag(jti)], ttl=ttl)
+        users[token] = (*owner, [api_token_tag(jti)], ttl)
+    return users
+
+def _invalidate_organizations(organization_ids):
+    """
+    The _invalidate_organizations function drops the cached authkey responses of several organizations
+    and of all their members with a single membership query.
+
+    Args:
+        organization_ids: IDs of the organizations
+    """
+    organization_ids = list(organization_ids)
+    if not organization_ids:
+        return
+    member_ids = _member_user_ids(organization_ids)
+    invalidate_tags([
+        *[organization_tag(organization_id) for organization_id in organization_ids],
+        *[user_tag(member_id) for member_id in member_ids]
+    ])
+    enqueue_push(member_ids)
+
+def _member_user_ids(organization_ids):
+    query = model.Session.query(model.Member.table_id).filter(
+        model.Member.group_id.in_(list(organization_ids)),
+        model.Member.table_name == 'user',
+        model.Member.state == core.State.ACTIVE).distinct()
+    return [member_id for (member_id,) in query]
+
+def get_user_organization_ids(user_id):
+    """
+    The get_user_organization_ids function returns the ids of the organizations a user is a member
+    of from the cached membership index.
+
+    Args:
+        user_id: ID of the user
+
+    Returns:
+        A list of organization ids
+    """
+    return get_runtime().membership_index.get(user_id)
+
+def _authkey_cache_key(authkey):
+    if is_valid_uuid(authkey):
+        return f'authkey:{authkey}'
+    return 'token:' + hashlib.sha256(str(authkey).encode('utf-8')).hexdigest()
 
 ## API ACTIONS
 
@@ -27,7 +215,6 @@ def geoserver_webservice_create_user_role_api_action(context, data_dict=None):
         A dictionary with the following keys:
     """
     if tk.c.userobj and tk.check_access('geoserver_user_role_modify', {'user':tk.c.userobj.name}):
-        ROLE_OPTIONS = get_geoserver_roles()
         for attr in ['user_id', 'role']:
             if attr not in data_dict.keys():
                 raise tk.ValidationError(f"Bad request: Invalid request. Missing {attr} parameter")
@@ -36,11 +223,12 @@ def geoserver_webservice_create_user_role_api_action(context, data_dict=None):
         user = model.User.get(user_id)
         if user is None:
             raise tk.ValidationError(f"Bad request: Invalid request. User: {id} does not exist")
-        if role not in ROLE_OPTIONS:
-            raise tk.ValidationError(f"Bad request: Invalid request. Role: {role} is not an allowed role, Allowed roles: {ROLE_OPTIONS}")
+        if not is_geoserver_role(role):
+            raise tk.ValidationError(f"Bad request: Invalid request. Role: {role} is not an allowed role, Allowed roles: {get_geoserver_roles()}")
         try:
             GeoserverUserRoleModel(user_id=user.id, role=role).save()
-            user_roles = [x.role for x in GeoserverUserRoleModel.get_user_roles(user.id) if x.state == core.State.ACTIVE]
+            invalidate_user_roles(user.id)
+            user_roles = GeoserverUserRoleModel.get_active_roles(user.id)
             return {
                 'user': user.name,
                 'user_roles': user_roles
@@ -72,23 +260,201 @@ def geoserver_webservice_delete_user_role_api_action(context, data_dict=None):
         user = model.User.get(user_id)
         if user is None:
             raise tk.ValidationError(f"Bad request: Invalid request. User: {id} does not exist")
-        user_roles = [x for x in GeoserverUserRoleModel.get_user_roles(user.id) if x.state == core.State.ACTIVE]
-        if role in [x.role for x in user_roles]:
-            for geoserver_role in user_roles:
-                if geoserver_role.role == role:
-                    try:
-                        geoserver_role.make_deleted()
-                        user_roles = [x.role for x in GeoserverUserRoleModel.get_user_roles(user.id) if x.state == core.State.ACTIVE]
-                        return {
-                            'user': user.name,
-                            'user_roles': user_roles
-                        }
-                    except Exception as e:
-                        raise tk.ValidationError(f"Bad request: Invalid request. {e}")
+        geoserver_role = GeoserverUserRoleModel.get_active_role(user.id, role)
+        if geoserver_role is not None:
+            try:
+                geoserver_role.make_deleted()
+                invalidate_user_roles(user.id)
+                user_roles = GeoserverUserRoleModel.get_active_roles(user.id)
+                return {
+                    'user': user.name,
+                    'user_roles': user_roles
+                }
+            except Exception as e:
+                raise tk.ValidationError(f"Bad request: Invalid request. {e}")
         else:
             raise tk.ValidationError(f"Bad request: Invalid request. No role: {role} attached to user.")
     raise tk.NotAuthorized()
 
+def _user_role_items(data_dict):
+    """
+    The _user_role_items function reads the list of user/role pairs of the bulk user role actions,
+    checks every item and looks up every referenced user with one query.
+
+    Args:
+        data_dict: Pass parameters to the function
+
+    Returns:
+        A tuple of the (user_id, role, error) items as given, error being None for well formed items,
+        and a dictionary of user id or name to user id
+    """
+    items = data_dict.get('roles') if data_dict else None
+    if not isinstance(items, list):
+        raise tk.ValidationError("Bad request: Invalid request. Missing roles parameter, expected a list of {user_id, role} objects")
+    parsed = []
+    for item in items:
+        if isinstance(item, dict):
+            user_id, role = item.get('user_id'), item.get('role')
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            user_id, role = item
+        else:
+            user_id, role = None, None
+        if not user_id or not role:
+            error = 'Missing user_id or role'
+        elif not isinstance(user_id, str) or not isinstance(role, str):
+            error = 'Expected user_id and role to be strings'
+        else:
+            error = None
+        parsed.append((user_id, role, error))
+    keys = list({user_id for user_id, role, error in parsed if error is None})
+    users = {}
+    if keys:
+        query = model.Session.query(model.User.id, model.User.name).filter(
+            sa.or_(model.User.id.in_(keys), model.User.name.in_(keys)))
+        for user_id, user_name in query:
+            users[user_id] = user_id
+            users[user_name] = user_id
+    return parsed, users
+
+def _invalidate_users(user_ids):
+    invalidate_tags([user_tag(user_id) for user_id in user_ids])
+    enqueue_push(user_ids)
+
+def geoserver_webservice_create_user_roles_api_action(context, data_dict=None):
+    """
+    The geoserver_webservice_create_user_roles_api_action function assigns many roles to many users at once.
+    It takes a roles parameter holding a list of {user_id, role} objects, validates every role against the
+    geoserver role options once and adds the missing assignments in one transaction.
+
+    Args:
+        context: Provide the authorization context for the action
+        data_dict: Pass data to the function
+
+    Returns:
+        A dictionary with a results list holding the user_id, role, success and message of every item
+    """
+    if tk.c.userobj and tk.check_access('geoserver_user_role_modify', {'user':tk.c.userobj.name}):
+        items, users = _user_role_items(data_dict)
+        allowed_roles = get_geoserver_role_set()
+        pairs = set()
+        for user_id, role, error in items:
+            if error is None and user_id in users and role in allowed_roles:
+                pairs.add((users[user_id], role))
+        try:
+            added = GeoserverUserRoleModel.bulk_add(pairs)
+        except Exception as e:
+            model.Session.rollback()
+            raise tk.ValidationError(f"Bad request: Invalid request. {e}")
+        _invalidate_users({user_id for user_id, role in added})
+        results = []
+        for user_id, role, error in items:
+            result = {'user_id': user_id, 'role': role, 'success': False}
+            if error:
+                result['message'] = error
+            elif user_id not in users:
+                result['message'] = f'User: {user_id} does not exist'
+            elif role not in allowed_roles:
+                result['message'] = f'Role: {role} is not an allowed role'
+            else:
+                result['success'] = True
+                result['message'] = 'created' if (users[user_id], role) in added else 'already assigned'
+            results.append(result)
+        return {'results': results}
+    raise tk.NotAuthorized()
+
+def geoserver_webservice_delete_user_roles_api_action(context, data_dict=None):
+    """
+    The geoserver_webservice_delete_user_roles_api_action function removes many roles from many users at once.
+    It takes a roles parameter holding a list of {user_id, role} objects and marks every matching active
+    assignment as deleted with one UPDATE.
+
+    Args:
+        context: Provide the authorization context for the action
+        data_dict: Pass data to the function
+
+    Returns:
+        A dictionary with a results list holding the user_id, role, success and message of every item
+    """
+    if tk.c.userobj and tk.check_access('geoserver_user_role_modify', {'user':tk.c.userobj.name}):
+        items, users = _user_role_items(data_dict)
+        pairs = {(users[user_id], role) for user_id, role, error in items if error is None and user_id in users}
+        try:
+            deleted = GeoserverUserRoleModel.bulk_delete(pairs)
+        except Exception as e:
+            model.Session.rollback()
+            raise tk.ValidationError(f"Bad request: Invalid request. {e}")
+        _invalidate_users({user_id for user_id, role in deleted})
+        results = []
+        for user_id, role, error in items:
+            result = {'user_id': user_id, 'role': role, 'success': False}
+            if error:
+                result['message'] = error
+            elif user_id not in users:
+                result['message'] = f'User: {user_id} does not exist'
+            elif (users[user_id], role) not in deleted:
+                result['message'] = f'No role: {role} attached to user.'
+            else:
+                result['success'] = True
+                result['message'] = 'deleted'
+            results.append(result)
+        return {'results': results}
+    raise tk.NotAuthorized()
+
+def geoserver_webservice_sync_organization_roles_api_action(context, data_dict=None):
+    """
+    The geoserver_webservice_sync_organization_roles_api_action function reconciles the roles of many
+    organizations with a desired state in one transaction. It takes an organizations parameter mapping
+    organization ids or names to the list of roles each organization should have; roles not listed are
+    removed and missing roles are added. Organizations that are not listed are left untouched.
+
+    Args:
+        context: Provide the authorization context for the action
+        data_dict: Pass data to the function
+
+    Returns:
+        A dictionary with the added and deleted roles per organization and the invalid entries
+    """
+    if tk.c.userobj and tk.check_access('geoserver_organization_role_modify', {'user':tk.c.userobj.name}):
+        mapping = data_dict.get('organizations') if data_dict else None
+        if not isinstance(mapping, dict):
+            raise tk.ValidationError("Bad request: Invalid request. Missing organizations parameter, expected an object of organization to roles")
+        keys = list(mapping.keys())
+        organizations = {}
+        query = model.Session.query(model.Group.id, model.Group.name).filter(
+            sa.or_(model.Group.id.in_(keys), model.Group.name.in_(keys)),
+            model.Group.is_organization == True,
+            model.Group.state == core.State.ACTIVE)
+        for organization_id, organization_name in query:
+            organizations[organization_id] = organization_id
+            organizations[organization_name] = organization_id
+        allowed_roles = get_geoserver_role_set()
+        errors = {}
+        desired = {}
+        for key, roles in mapping.items():
+            if key not in organizations:
+                errors[key] = f'Organization: {key} does not exist'
+                continue
+            if not isinstance(roles, list):
+                errors[key] = 'Expected a list of roles'
+                continue
+            invalid = [role for role in roles if not isinstance(role, str) or role not in allowed_roles]
+            if invalid:
+                errors[key] = f'Roles: {invalid} are not allowed roles'
+                continue
+            desired.setdefault(organizations[key], set()).update(roles)
+        try:
+            added, deleted = GeoserverOrganizationRoleModel.sync(desired)
+        except Exception as e:
+            raise tk.ValidationError(f"Bad request: Invalid request. {e}")
+        _invalidate_organizations({x[0] for x in added | deleted})
+        result = {'added': {}, 'deleted': {}, 'errors': errors}
+        for organization_id, role in sorted(added):
+            result['added'].setdefault(organization_id, []).append(role)
+        for organization_id, role in sorted(deleted):
+            result['deleted'].setdefault(organization_id, []).append(role)
+        return result
+    raise tk.NotAuthorized()
+
 @tk.side_effect_free
 def geoserver_webservice_user_roles_api_action(context, data_dict=None):
     """
@@ -105,21 +471,40 @@ def geoserver_webservice_user_roles_api_action(context, data_dict=None):
 
     if 'user_id' not in data_dict.keys():
         raise tk.ValidationError(f"Bad request: Invalid request. Missing user_id parameter")
-    user_id = data_dict.get('user_id')
-    user = tk.get_action('user_show')(context, data_dict={'id':user_id})
+    result, organization_ids = _get_user_roles(context, data_dict.get('user_id'))
+    return result
+
+def _get_user_roles(context, user_id):
+    """
+    The _get_user_roles function resolves the roles of a user along with the ids of the
+    organizations the organization roles were taken from.
+
+    Args:
+        context: Provide contextual information to the function
+        user_id: ID or name of the user
+
+    Returns:
+        A tuple of the roles dictionary and the list of organization ids
+    """
+    user = model.User.get(user_id)
     if user is not None:
-        user_roles = [x.role for x in GeoserverUserRoleModel.get_user_roles(user['id']) if x.state == core.State.ACTIVE]
-        user_organization_ids = [x['id'] for x in tk.get_action('organization_list_for_user')({}, data_dict={'id':user_id})]
+        user_roles = []
         organization_roles = []
-        for org_role in GeoserverOrganizationRoleModel.get_organizations_roles(user_organization_ids):
-            if org_role.state == core.State.ACTIVE and org_role.role not in organization_roles:
-                organization_roles.append(org_role.role)
+        user_organization_ids = []
+        for role, organization_id in get_effective_roles(user.id):
+            if organization_id is None:
+                user_roles.append(role)
+            else:
+                if role not in organization_roles:
+                    organization_roles.append(role)
+                if organization_id not in user_organization_ids:
+                    user_organization_ids.append(organization_id)
         result = {
-                'user': user['name'],
+                'user': user.name,
                 'user_roles': user_roles,
                 'organization_roles': organization_roles,
-                'default_roles': DEFAULT_ROLES}
-        return result
+                'default_roles': get_runtime().default_roles}
+        return result, user_organization_ids
     else:
         raise tk.ObjectNotFound('user does not exist')
 
@@ -137,23 +522,345 @@ def geoserver_webservice_api_action(context, data_dict=None):
     Returns:
         A dictionary with the user and roles
     """
-    authkey = data_dict.get('authkey')
-    if is_valid_uuid(authkey):
-        user = GeoserverUserAuthkey.get_user_from_authkey(authkey)
+    result = resolve_authkey(data_dict.get('authkey'), source=request_source())
+    if result is None:
+        raise tk.ObjectNotFound()
+    return dict(result)
+
+@tk.side_effect_free
+def geoserver_webservice_batch_api_action(context, data_dict=None):
+    """
+    The geoserver_webservice_batch_api_action function resolves a list of authkeys and/or api tokens
+    to their users and roles in one call, e.g. for a proxy that pre-warms its own authentication cache.
+
+    Args:
+        context: Pass information about the user and the context of the request
+        data_dict: Pass in the authkeys parameter, a list of authkeys and/or api tokens
+
+    Returns:
+        A dictionary with a result per key, user and roles are None for keys that did not resolve
+    """
+    tk.check_access('geoserver_webservice_batch', context, data_dict)
+    authkeys = (data_dict or {}).get('authkeys')
+    if not isinstance(authkeys, list) or not all(isinstance(x, str) for x in authkeys):
+        raise tk.ValidationError("Bad request: Invalid request. Missing authkeys parameter, expected a list of authkeys")
+    max_size = int(get_runtime().get('batch.max_size', 1000))
+    if len(authkeys) > max_size:
+        raise tk.ValidationError(f"Bad request: Invalid request. At most {max_size} authkeys can be resolved at once")
+    resolved = resolve_authkeys(authkeys)
+    results = []
+    for authkey in authkeys:
+        result = resolved.get(authkey) or {'user': None, 'roles': None}
+        results.append({'authkey': authkey, **result})
+    return {'results': results}
+
+def request_source():
+    """
+    The request_source function returns the client a request is throttled as. Requests to this
+    endpoint come from geoserver itself, so the end client is only known when a trusted proxy
+    header is configured with throttle.source_header; without it per source throttling is skipped.
+
+    Returns:
+        The client address or None
+    """
+    header = get_runtime().get('throttle.source_header')
+    if not header:
+        return None
+    try:
+        value = request.headers.get(header)
+    except (RuntimeError, AttributeError, TypeError):
+        return None
+    if not value:
+        return None
+    return value.split(',')[0].strip() or None
+
+def _reject(reason, cache_key=None, source=None):
+    if reason == 'unknown':
+        runtime = get_runtime()
+        runtime.failed_authkey_cache.set(cache_key, True)
+        runtime.key_failure_limiter.hit(cache_key)
+        if source:
+            runtime.source_failure_limiter.hit(source)
+    metrics.increment(f'authkey.rejected.{reason}')
+    return None
+
+def resolve_authkey(authkey, source=None):
+    """
+    The resolve_authkey function resolves an authkey or api token to the user name and the
+    comma separated roles of that user. It works directly against the model and the authkey
+    cache so it can be used outside of the ckan action pipeline. Malformed keys, keys that
+    recently failed and keys that failed too often are rejected without touching the database.
+    A source past its failure limit is only answered from the cache.
+
+    Args:
+        authkey: A geoserver authkey or a ckan api token
+        source: Address of the client, used to throttle failing sources
+
+    Returns:
+        A dictionary with the user and roles, or None when the key does not belong to an active user
+    """
+    runtime = get_runtime()
+    is_authkey = is_valid_uuid(authkey)
+    if not is_authkey and not is_valid_token_format(authkey):
+        return _reject('malformed')
+    cache_key = _authkey_cache_key(authkey)
+    cached = _get_cached_result(runtime, cache_key, authkey if is_authkey else None)
+    if cached is not None:
+        return cached
+    rejected = _check_rejected(runtime, cache_key)
+    if rejected:
+        return _reject(rejected)
+    # A source spraying unknown keys must not be able to force a lookup for each of them.
+    if source and runtime.source_failure_limiter.exceeded(source):
+        return _reject('throttled_source')
+    return runtime.authkey_flight.do(
+        cache_key,
+        lambda: _resolve_uncached(authkey, is_authkey, cache_key, source),
+        lambda: _get_cached_result(runtime, cache_key, authkey if is_authkey else None))
+
+def resolve_authkeys(authkeys):
+    """
+    The resolve_authkeys function resolves many authkeys and api tokens at once. Cached keys are
+    answered from the cache, the others are looked up with one query for the authkeys, one for the
+    api tokens and one for the roles of all their users. Callers are authorized services, so keys
+    that do not resolve are not counted against any source.
+
+    Args:
+        authkeys: Geoserver authkeys and/or ckan api tokens
+
+    Returns:
+        A dictionary of each key to its user and roles, or to None when the key does not belong to an active user
+    """
+    runtime = get_runtime()
+    results = {}
+    pending_authkeys = {}
+    pending_tokens = {}
+    for authkey in dict.fromkeys(authkeys):
+        is_authkey = is_valid_uuid(authkey)
+        if not is_authkey and not is_valid_token_format(authkey):
+            results[authkey] = _reject('malformed')
+            continue
+        cache_key = _authkey_cache_key(authkey)
+        results[authkey] = _get_cached_result(runtime, cache_key, authkey if is_authkey else None)
+        if results[authkey] is not None:
+            continue
+        rejected = _check_rejected(runtime, cache_key)
+        if rejected:
+            _reject(rejected)
+        elif is_authkey:
+            pending_authkeys[authkey] = cache_key
+        else:
+            pending_tokens[authkey] = cache_key
+    users = {
+        authkey: (user_id, user_name, [], None)
+        for authkey, (user_id, user_name) in GeoserverUserAuthkey.get_active_users(pending_authkeys).items()
+    }
+    users.update(_get_users_from_tokens(pending_tokens))
+    cache_keys = {**pending_authkeys, **pending_tokens}
+    for authkey in cache_keys.keys() - users.keys():
+        results[authkey] = _reject('unknown', cache_keys[authkey])
+    if not users:
+        return results
+    key_tags = {
+        authkey: [*extra_tags, user_tag(user_id)]
+        for authkey, (user_id, user_name, extra_tags, ttl) in users.items()
+    }
+    snapshot = _generation_snapshot(runtime, [tag for tags in key_tags.values() for tag in tags])
+    effective_roles = get_effective_roles_for_users({user[0] for user in users.values()})
+    current = _generation_snapshot(runtime, snapshot.keys()) if snapshot else snapshot
+    for authkey, (user_id, user_name, extra_tags, ttl) in users.items():
+        result, organization_ids = _roles_result(runtime, user_name, effective_roles[user_id])
+        results[authkey] = result
+        tags = key_tags[authkey]
+        key_generations = tuple(snapshot[tag] for tag in tags) if snapshot else None
+        if snapshot is None or (current is not None and all(current.get(tag) == snapshot[tag] for tag in tags)):
+            _cache_result(runtime, cache_keys[authkey], result, tags, key_generations, organization_ids, ttl)
+    return results
+
+def authkey_etag(authkey, response_format):
+    """
+    The authkey_etag function returns the ETag of the authkey response without resolving any role.
+    It is derived from the user name and the generation counters of the user and api token tags,
+    which every role or membership change of the user bumps, so the endpoint can compare it with
+    If-None-Match before the roles are read. The user is taken from the cached response when there
+    is one, otherwise from the authkey or api token alone.
+
+    Args:
+        authkey: A geoserver authkey or a ckan api token
+        response_format: Format of the response
+
+    Returns:
+        The ETag, or None when generations are disabled or the key does not belong to an active user
+    """
+    runtime = get_runtime()
+    generations = runtime.generations
+    if generations is None:
+        return None
+    is_authkey = is_valid_uuid(authkey)
+    if not is_authkey and not is_valid_token_format(authkey):
+        return None
+    cache_key = _authkey_cache_key(authkey)
+    if _check_rejected(runtime, cache_key):
+        return None
+    cached = runtime.authkey_cache.get(cache_key)
+    if cached is not None:
+        result, key_tags, key_generations = cached
+        user_name = result['user']
+        if is_authkey:
+            GeoserverUserAuthkey.touch(authkey)
+    elif is_authkey:
+        user = GeoserverUserAuthkey.get_active_user(authkey)
+        if user is None:
+            return None
+        user_name, key_tags = user[1], [user_tag(user[0])]
     else:
-        user = api_token.get_user_from_token(authkey)
-    if user is not None:
-        context['ignore_auth'] = True
-        roles = tk.get_action('get_geoserver_user_roles')(context, data_dict={"user_id":user.id})
-        
-        all_roles = [*set([*roles['user_roles'], *roles['organization_roles'], *roles['default_roles']])]
-        role_str = ', '.join(all_roles)
-        return {
-                'user': roles.get('user'),
-                'roles': role_str
-                }
+        user = _get_user_from_token(authkey, cache_key)
+        if user is None:
+            return None
+        user_id, user_name, jti, ttl = user
+        key_tags = [api_token_tag(jti), user_tag(user_id)] if jti else [user_tag(user_id)]
+    values = generations.current(key_tags)
+    if values is None:
+        return None
+    payload = json.dumps([response_format, user_name, list(key_tags), list(values), runtime.default_roles])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def _get_cached_result(runtime, cache_key, authkey=None):
+    """
+    The _get_cached_result function returns the cached response for a key unless one of the
+    generations it was cached with has been bumped since.
+
+    Args:
+        runtime: The plugin runtime
+        cache_key: Cache key of the authkey or api token
+        authkey: The authkey to record an access for on a hit, None for api tokens
+
+    Returns:
+        The cached response or None
+    """
+    generations = runtime.generations
+    cached = runtime.authkey_cache.get(cache_key)
+    if cached is not None:
+        result, key_tags, key_generations = cached
+        key_generations = tuple(key_generations) if key_generations is not None else None
+        if generations is None or generations.is_current(key_tags, key_generations):
+            metrics.increment('authkey.cache.hit')
+            if authkey is not None:
+                GeoserverUserAuthkey.touch(authkey)
+            return result
+        metrics.increment('authkey.cache.stale')
+        runtime.authkey_cache.invalidate(cache_key)
+    metrics.increment('authkey.cache.miss')
+    return None
+
+def _check_rejected(runtime, cache_key):
+    if cache_key in runtime.failed_authkey_cache:
+        return 'negative_cache'
+    if runtime.key_failure_limiter.exceeded(cache_key):
+        return 'throttled'
+    return None
+
+def _generation_snapshot(runtime, tags):
+    """
+    The _generation_snapshot function reads the generations of tags in one round trip.
+
+    Returns:
+        A dictionary of tag to generation, None when generations are disabled or unavailable
+    """
+    generations = runtime.generations
+    if generations is None:
+        return None
+    tags = list(dict.fromkeys(tags))
+    values = generations.current(tags)
+    return dict(zip(tags, values)) if values is not None else None
+
+def _roles_result(runtime, user_name, effective_roles):
+    """
+    The _roles_result function builds the response for a user from their effective roles.
+
+    Args:
+        runtime: The plugin runtime
+        user_name: Name of the user
+        effective_roles: List of (role, organization_id) tuples of the user
+
+    Returns:
+        A tuple of the response and the ids of the organizations roles were taken from
+    """
+    user_roles = []
+    organization_ids = []
+    for role, organization_id in effective_roles:
+        user_roles.append(role)
+        if organization_id is not None and organization_id not in organization_ids:
+            organization_ids.append(organization_id)
+    all_roles = list(dict.fromkeys([*user_roles, *runtime.default_roles]))
+    result = {
+            'user': user_name,
+            'roles': ', '.join(all_roles)
+            }
+    return result, organization_ids
+
+def _cache_result(runtime, cache_key, result, key_tags, key_generations, organization_ids, ttl):
+    if runtime.generations is not None and key_generations is None:
+        return
+    tags = [*key_tags, *[organization_tag(x) for x in organization_ids]]
+    runtime.authkey_cache.set(cache_key, (result, key_tags, key_generations), tags=tags, ttl=ttl)
+
+def _resolve_uncached(authkey, is_authkey, cache_key, source):
+    """
+    The _resolve_uncached function looks an authkey or api token up in the database and caches
+    the response. Concurrent calls for the same key are coalesced by resolve_authkey so only one
+    of them runs, in one worker when the responses are shared through redis.
+
+    Args:
+        authkey: A geoserver authkey or a ckan api token
+        is_authkey: Whether authkey is a geoserver authkey rather than an api token
+        cache_key: Cache key of authkey
+        source: Address of the client, used to throttle failing sources
+
+    Returns:
+        A dictionary with the user and roles, or None when the key does not belong to an active user
+    """
+    runtime = get_runtime()
+    tags = []
+    ttl = None
+    if is_authkey:
+        user = GeoserverUserAuthkey.get_active_user(authkey)
     else:
-        raise tk.ObjectNotFound()
+        user = _get_user_from_token(authkey, cache_key)
+        if user is not None:
+            user_id, user_name, jti, ttl = user
+            user = (user_id, user_name)
+            if jti:
+                tags.append(api_token_tag(jti))
+    if user is None:
+        return _reject('unknown', cache_key, source)
+    user_id, user_name = user
+    # Every role or membership change of the user, or of one of their organizations,
+    # bumps the user tag so its counter alone tells whether the result went stale.
+    key_tags = [*tags, user_tag(user_id)]
+    snapshot = _generation_snapshot(runtime, key_tags)
+    result, organization_ids = _roles_result(runtime, user_name, get_effective_roles(user_id))
+    # A bump between reading the roles and caching them would otherwise be lost.
+    if snapshot is None or _generation_snapshot(runtime, key_tags) == snapshot:
+        key_generations = tuple(snapshot.values()) if snapshot is not None else None
+        _cache_result(runtime, cache_key, result, key_tags, key_generations, organization_ids, ttl)
+    return result
+
+@tk.side_effect_free
+def geoserver_webservice_metrics_api_action(context, data_dict=None):
+    """
+    The geoserver_webservice_metrics_api_action function returns the counters and gauges
+    collected by the worker process that handled the request.
+
+    Args:
+        context: Provide contextual information to the function
+        data_dict: Unused
+
+    Returns:
+        A dictionary with counters and gauges
+    """
+    tk.check_access('geoserver_webservice_metrics', context, data_dict)
+    return metrics.get_metrics()
 
 @tk.side_effect_free
 def geoserver_webservice_get_user_authkey_api_action(context, data_dict={}):
@@ -210,6 +917,8 @@ def geoserver_webservice_generate_new_user_authkey_api_action(context, data_dict
             user = requesting_user.as_dict()
         if user:
             geoserver_authkey_obj = GeoserverUserAuthkey.generate_new_user_authkey(user_id=user['id'])
+            invalidate_user_cache(user['id'])
+            enqueue_export()
             if geoserver_authkey_obj:
                 return {
                     'username': user['name'],
@@ -238,7 +947,7 @@ def geoserver_webservice_organization_roles_api_action(context, data_dict=None):
     organization_id = data_dict.get('organization_id')
     org = tk.get_action('organization_show')(context, data_dict={'id':organization_id})
     if org is not None:
-        organization_roles = [x.role for x in GeoserverOrganizationRoleModel.get_organization_roles(org['id']) if x.state == core.State.ACTIVE]
+        organization_roles = GeoserverOrganizationRoleModel.get_active_roles(org['id'])
         result = {
                 'organization': org['name'],
                 'organization_roles': organization_roles}
@@ -258,7 +967,6 @@ def geoserver_webservice_create_organization_role_api_action(context, data_dict=
         A dictionary with the keys 'organization_id' and 'role'
     """
     if tk.c.userobj and tk.check_access('geoserver_organization_role_modify', {'user':tk.c.userobj.name}):
-        ROLE_OPTIONS = get_geoserver_roles()
         for attr in ['organization_id', 'role']:
             if attr not in data_dict.keys():
                 raise tk.ValidationError(f"Bad request: Invalid request. Missing {attr} parameter")
@@ -267,11 +975,12 @@ def geoserver_webservice_create_organization_role_api_action(context, data_dict=
         org = tk.get_action('organization_show')(context, data_dict={'id':organization_id})
         if org is None:
             raise tk.ValidationError(f"Bad request: Invalid request. Organization: {id} does not exist")
-        if role not in ROLE_OPTIONS:
-            raise tk.ValidationError(f"Bad request: Invalid request. Role: {role} is not an allowed role, Allowed roles: {ROLE_OPTIONS}")
+        if not is_geoserver_role(role):
+            raise tk.ValidationError(f"Bad request: Invalid request. Role: {role} is not an allowed role, Allowed roles: {get_geoserver_roles()}")
         try:
             GeoserverOrganizationRoleModel(organization_id=organization_id, role=role).save()
-            organization_roles = [x.role for x in GeoserverOrganizationRoleModel.get_organization_roles(org['id']) if x.state == core.State.ACTIVE]
+            invalidate_organization_cache(org['id'])
+            organization_roles = GeoserverOrganizationRoleModel.get_active_roles(org['id'])
             return {
                 'user': org['name'],
                 'organization_roles': organization_roles
@@ -300,19 +1009,18 @@ def geoserver_webservice_delete_organization_role_api_action(context, data_dict=
         org = tk.get_action('organization_show')(context, data_dict={'id':organization_id})
         if org is None:
             raise tk.ValidationError(f"Bad request: Invalid request. organization: {organization_id} does not exist")
-        organization_roles = [x for x in GeoserverOrganizationRoleModel.get_organization_roles(org['id']) if x.state == core.State.ACTIVE]
-        if role in [x.role for x in organization_roles]:
-            for geoserver_role in organization_roles:
-                if geoserver_role.role == role:
-                    try:
-                        geoserver_role.make_deleted()
-                        organization_roles = [x.role for x in GeoserverOrganizationRoleModel.get_organization_roles(org['id']) if x.state == core.State.ACTIVE]
-                        return {
-                            'organization': org['name'],
-                            'roles': organization_roles
-                        }
-                    except Exception as e:
-                        raise tk.ValidationError(f"Bad request: Invalid request. {e}")
+        geoserver_role = GeoserverOrganizationRoleModel.get_active_role(org['id'], role)
+        if geoserver_role is not None:
+            try:
+                geoserver_role.make_deleted()
+                invalidate_organization_cache(org['id'])
+                organization_roles = GeoserverOrganizationRoleModel.get_active_roles(org['id'])
+                return {
+                    'organization': org['name'],
+                    'roles': organization_roles
+                }
+            except Exception as e:
+                raise tk.ValidationError(f"Bad request: Invalid request. {e}")
         else:
             raise tk.ValidationError(f"Bad request: Invalid request. No role: {role} attached to organization.")
     raise tk.NotAuthorized()
@@ -336,7 +1044,246 @@ def user_delete(up_func, context, data_dict):
         geoserver_user_authkey = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user_id)
         if geoserver_user_authkey:
             geoserver_user_authkey.make_deleted()
-    return up_func(context, data_dict)
+    result = up_func(context, data_dict)
+    if user_id:
+        user = model.User.get(user_id)
+        user_id = user.id if user else user_id
+        # user_delete also deletes the memberships of the user.
+        GeoserverEffectiveRole.sync_user(user_id)
+        _invalidate_memberships([user_id])
+        invalidate_user_roles(user_id)
+        enqueue_export()
+    return result
+
+def _on_member_change(data_dict, user_key):
+    """
+    The _on_member_change function refreshes everything derived from a user's organization
+    membership after a member action ran.
+
+    Args:
+        data_dict: Parameters of the member action
+        user_key: Key of data_dict holding the user id or name
+    """
+    if data_dict.get('object_type', 'user') != 'user' or not data_dict.get(user_key):
+        return
+    user = model.User.get(data_dict.get(user_key))
+    group = model.Group.get(data_dict.get('id'))
+    if user is None:
+        return
+    if group is not None:
+        GeoserverEffectiveRole.sync_membership(user.id, group.id)
+    _invalidate_memberships([user.id])
+    invalidate_user_roles(user.id)
+
+def _on_group_delete(up_func, context, data_dict):
+    """
+    The _on_group_delete function runs a group or organization delete action and refreshes
+    everything derived from the memberships the deleted group had.
+
+    Args:
+        up_func: The original delete action
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        The result of the original delete action
+    """
+    group = model.Group.get(data_dict.get('id'))
+    member_ids = _member_user_ids([group.id]) if group is not None else []
+    result = up_func(context, data_dict)
+    if group is not None:
+        GeoserverEffectiveRole.sync_organization(group.id)
+        _invalidate_memberships(member_ids)
+        invalidate_tags([organization_tag(group.id), *[user_tag(member_id) for member_id in member_ids]])
+        enqueue_push(member_ids)
+    return result
+
+def _on_group_update(up_func, context, data_dict):
+    """
+    The _on_group_update function runs a group or organization create or update action, which saves
+    the members listed in data_dict without going through the member actions, and refreshes everything
+    derived from the memberships of the users it added or removed.
+
+    Args:
+        up_func: The original create or update action
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        The result of the original action
+    """
+    group = model.Group.get(data_dict.get('id')) if data_dict.get('id') else None
+    before = set(_member_user_ids([group.id])) if group is not None else set()
+    result = up_func(context, data_dict)
+    if group is None:
+        group_id = result if isinstance(result, str) else (result or {}).get('id')
+        group = model.Group.get(group_id) if group_id else None
+    if group is not None:
+        after = set(_member_user_ids([group.id]))
+        changed = before ^ after
+        GeoserverEffectiveRole.sync_organization(group.id)
+        _invalidate_memberships(changed)
+        invalidate_tags([organization_tag(group.id), *[user_tag(member_id) for member_id in before | after]])
+        enqueue_push(changed)
+    return result
+
+@tk.chained_action
+def member_create(up_func, context, data_dict):
+    """
+    The member_create function drops the cached authkey responses of a user whose
+    organization membership changed.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal member_create function
+    """
+    result = up_func(context, data_dict)
+    _on_member_change(data_dict, 'object')
+    return result
+
+@tk.chained_action
+def member_delete(up_func, context, data_dict):
+    """
+    The member_delete function drops the cached authkey responses of a user whose
+    organization membership changed.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal member_delete function
+    """
+    result = up_func(context, data_dict)
+    _on_member_change(data_dict, 'object')
+    return result
+
+@tk.chained_action
+def organization_member_create(up_func, context, data_dict):
+    """
+    The organization_member_create function drops the cached authkey responses of a user
+    added to an organization.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal organization_member_create function
+    """
+    result = up_func(context, data_dict)
+    _on_member_change(data_dict, 'username')
+    return result
+
+@tk.chained_action
+def organization_member_delete(up_func, context, data_dict):
+    """
+    The organization_member_delete function drops the cached authkey responses of a user
+    removed from an organization.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal organization_member_delete function
+    """
+    result = up_func(context, data_dict)
+    _on_member_change(data_dict, 'user_id' if data_dict.get('user_id') else 'username')
+    return result
+
+@tk.chained_action
+def organization_create(up_func, context, data_dict):
+    """
+    The organization_create function drops the cached memberships of the users a new organization
+    was created with.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal organization_create function
+    """
+    return _on_group_update(up_func, context, data_dict)
+
+@tk.chained_action
+def organization_update(up_func, context, data_dict):
+    """
+    The organization_update function refreshes the effective roles, cached memberships and authkey
+    responses of the users an organization update added or removed. organization_patch goes
+    through this action as well.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal organization_update function
+    """
+    return _on_group_update(up_func, context, data_dict)
+
+@tk.chained_action
+def group_delete(up_func, context, data_dict):
+    """
+    The group_delete function drops the cached memberships and authkey responses of the
+    members of a deleted group.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal group_delete function
+    """
+    return _on_group_delete(up_func, context, data_dict)
+
+@tk.chained_action
+def organization_delete(up_func, context, data_dict):
+    """
+    The organization_delete function drops the effective roles, cached memberships and authkey
+    responses of the members of a deleted organization.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal organization_delete function
+    """
+    return _on_group_delete(up_func, context, data_dict)
+
+@tk.chained_action
+def api_token_revoke(up_func, context, data_dict):
+    """
+    The api_token_revoke function drops the cached owner and authkey responses of a revoked api token.
+
+    Args:
+        up_func: Call the original function that was decorated
+        context: Provide contextual information to the function
+        data_dict: Pass parameters to the function
+
+    Returns:
+        orginal api_token_revoke function
+    """
+    jti = data_dict.get('jti')
+    if not jti and data_dict.get('token'):
+        jti = (api_token.decode(data_dict['token']) or {}).get('jti')
+    result = up_func(context, data_dict)
+    if jti:
+        invalidate_api_token_cache(jti)
+    return result
 
 @tk.chained_action
 @tk.side_effect_free
@@ -345,15 +1292,29 @@ def organization_show(up_func, context, data_dict):
 
 api_actions = {
     'geoserver_webservice': geoserver_webservice_api_action,
+    'geoserver_webservice_batch': geoserver_webservice_batch_api_action,
     'get_geoserver_user_roles': geoserver_webservice_user_roles_api_action,
     'create_geoserver_user_role': geoserver_webservice_create_user_role_api_action,
     'delete_geoserver_user_role': geoserver_webservice_delete_user_role_api_action,
+    'create_geoserver_user_roles': geoserver_webservice_create_user_roles_api_action,
+    'delete_geoserver_user_roles': geoserver_webservice_delete_user_roles_api_action,
     'get_geoserver_organization_roles': geoserver_webservice_organization_roles_api_action,
     'create_geoserver_organization_role': geoserver_webservice_create_organization_role_api_action,
     'delete_geoserver_organization_role': geoserver_webservice_delete_organization_role_api_action,
+    'sync_geoserver_organization_roles': geoserver_webservice_sync_organization_roles_api_action,
     'get_geoserver_user_authkey': geoserver_webservice_get_user_authkey_api_action,
     'generate_new_user_authkey': geoserver_webservice_generate_new_user_authkey_api_action,
+    'geoserver_webservice_metrics': geoserver_webservice_metrics_api_action,
     'user_delete': user_delete,
+    'member_create': member_create,
+    'member_delete': member_delete,
+    'organization_member_create': organization_member_create,
+    'organization_member_delete': organization_member_delete,
+    'organization_create': organization_create,
+    'organization_update': organization_update,
+    'group_delete': group_delete,
+    'organization_delete': organization_delete,
+    'api_token_revoke': api_token_revoke,
     'organization_show': organization_show
 }
 
@@ -392,7 +1353,7 @@ def geoserver_organization_role_view(context, data_dict=None):
     if auth_obj and auth_obj.sysadmin:
         return {'success': True}
     if data_dict and auth_obj:
-        if USER_VIEW_ROLES.lower() == 'true':
+        if get_runtime().user_view_roles:
             org = tk.get_action('organization_show')({}, data_dict={
                 'id': data_dict.get('organization_id'),
                 'include_users': True})
@@ -431,7 +1392,7 @@ def geoserver_user_role_view(context, data_dict=None):
     """
     auth_obj = context.get('auth_user_obj')
     if data_dict and auth_obj:
-        if USER_VIEW_ROLES.lower() == 'true':
+        if get_runtime().user_view_roles:
             if data_dict.get('user_id') in [auth_obj.id, auth_obj.name]:
                 return {'success': True}
         else:
@@ -478,10 +1439,46 @@ def geoserver_user_authkey_get(context, data_dict={}):
             return {'success': True}
     return {'success': False}
 
+def geoserver_webservice_metrics(context, data_dict=None):
+    """
+    The geoserver_webservice_metrics function only lets sysadmins read the plugin metrics.
+
+    Args:
+        context: Get the user object from the context
+        data_dict: Pass in the data from the request
+
+    Returns:
+        A dictionary with a key of success and either true or false as the value
+    """
+    if context.get('auth_user_obj') is not None and context['auth_user_obj'].sysadmin:
+        return {'success': True}
+    else:
+        return {'success': False}
+
+def geoserver_webservice_batch(context, data_dict=None):
+    """
+    The geoserver_webservice_batch function lets sysadmins and the service users listed in
+    batch.users resolve authkeys in bulk.
+
+    Args:
+        context: Get the user object from the context
+        data_dict: Pass in the data from the request
+
+    Returns:
+        A dictionary with a key of success and either true or false as the value
+    """
+    auth_obj = context.get('auth_user_obj')
+    if auth_obj is not None:
+        if auth_obj.sysadmin or auth_obj.name in get_runtime().batch_users:
+            return {'success': True}
+    return {'success': False}
+
 auth_functions = {
     'geoserver_user_role_view': geoserver_user_role_view,
     'geoserver_user_role_modify': geoserver_user_role_modify,
     'geoserver_user_authkey_get':geoserver_user_authkey_get, 
     'geoserver_organization_role_view': geoserver_organization_role_view,
-    'geoserver_organization_role_modify': geoserver_organization_role_modify
+    'geoserver_organization_role_modify': geoserver_organization_role_modify,
+    'geoserver_webservice_metrics': geoserver_webservice_metrics,
+    'geoserver_webservice_batch': geoserver_webservice_batch
 }
\ No newline at end of file
@@ -0,0 +1,103 @@
+import json
+import logging
+
+from ckanext.geoserver_webservice.cache import LRUCache
+from ckanext.geoserver_webservice import metrics
+
+log = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'ckanext.geoserver_webservice:membership:'
+
+
+class MembershipIndex():
+    """
+    Cached index of user id -> ids of the organizations the user is an active member of.
+    Entries are kept in process, or in redis when a client is given so every worker
+    shares them and an invalidation in one worker is seen by all. The index is kept
+    current by the chained member and group actions, the ttl only bounds the damage of
+    membership changes made outside the action api.
+    """
+
+    def __init__(self, load, ttl=300, max_size=10000, redis=None):
+        self._load = load
+        self.ttl = int(ttl)
+        self._redis = redis
+        self._local = LRUCache(max_size=max_size, ttl=ttl)
+
+    @property
+    def shared(self):
+        return self._redis is not None
+
+    def get(self, user_id):
+        """
+        The get function returns the organization ids of a user, loading them from the
+        database on a miss.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            A list of organization ids
+        """
+        organization_ids = self._get_cached(user_id)
+        if organization_ids is not None:
+            metrics.increment('membership.hit')
+            return organization_ids
+        metrics.increment('membership.miss')
+        organization_ids = list(self._load(user_id))
+        self._set_cached(user_id, organization_ids)
+        return organization_ids
+
+    def invalidate(self, *user_ids):
+        """
+        The invalidate function drops the cached memberships of one or more users.
+
+        Args:
+            user_ids: IDs of the users
+        """
+        if not user_ids:
+            return
+        if self.shared:
+            try:
+                self._redis.delete(*[REDIS_PREFIX + user_id for user_id in user_ids])
+            except Exception as e:
+                log.error(e, exc_info=True)
+        else:
+            for user_id in user_ids:
+                self._local.invalidate(user_id)
+
+    def invalidate_local(self, user_id):
+        """
+        The invalidate_local function drops the membership of a user cached by this worker,
+        a no-op in shared mode where nothing is cached in process.
+
+        Args:
+            user_id: ID of the user
+        """
+        if not self.shared:
+            self._local.invalidate(user_id)
+
+    def clear_local(self):
+        if not self.shared:
+            self._local.clear()
+
+    def _get_cached(self, user_id):
+        if not self.shared:
+            return self._local.get(user_id)
+        try:
+            value = self._redis.get(REDIS_PREFIX + user_id)
+        except Exception as e:
+            log.error(e, exc_info=True)
+            return None
+        return None if value is None else json.loads(value)
+
+    def _set_cached(self, user_id, organization_ids):
+        if not self.shared:
+            self._local.set(user_id, organization_ids)
+            return
+        if self.ttl <= 0:
+            return
+        try:
+            self._redis.setex(REDIS_PREFIX + user_id, self.ttl, json.dumps(organization_ids))
+        except Exception as e:
+            log.error(e, exc_info=True)
@@ -0,0 +1,39 @@
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def increment(name, amount=1):
+    """
+    The increment function adds amount to the named counter.
+
+    Args:
+        name: Name of the counter
+        amount: Value added to the counter
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def get_metrics():
+    """
+    The get_metrics function returns a snapshot of the counters and gauges of this process.
+
+    Returns:
+        A dictionary with counters and gauges
+    """
+    with _lock:
+        return {'counters': dict(_counters), 'gauges': dict(_gauges)}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -0,0 +1,72 @@
+"""create geoserver tables
+
+Revision ID: aab8c2f6d0d0
+Revises: df68f373cec3
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aab8c2f6d0d0'
+down_revision = 'df68f373cec3'
+branch_labels = None
+depends_on = None
+
+
+def _existing_tables():
+    return sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # Sites set up before this migration already have the tables from init_tables.
+    tables = _existing_tables()
+    if 'geoserver_user_role' not in tables:
+        op.create_table(
+            'geoserver_user_role',
+            sa.Column('id', sa.UnicodeText, primary_key=True, nullable=False, index=True),
+            sa.Column('user_id', sa.UnicodeText, sa.ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True),
+            sa.Column('role', sa.Text, nullable=False),
+            sa.Column('state', sa.UnicodeText),
+            sa.Column('created', sa.DateTime, nullable=False),
+            sa.Column('last_modified', sa.DateTime, nullable=False),
+            sa.Column('closed', sa.DateTime, nullable=True),
+        )
+    if 'geoserver_organization_role' not in tables:
+        op.create_table(
+            'geoserver_organization_role',
+            sa.Column('id', sa.UnicodeText, primary_key=True, nullable=False, index=True),
+            sa.Column('organization_id', sa.UnicodeText, sa.ForeignKey('group.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True),
+            sa.Column('role', sa.Text, nullable=False),
+            sa.Column('state', sa.UnicodeText),
+            sa.Column('created', sa.DateTime, nullable=False),
+            sa.Column('last_modified', sa.DateTime, nullable=False),
+            sa.Column('closed', sa.DateTime, nullable=True),
+        )
+    if 'geoserver_user_authkey' not in tables:
+        op.create_table(
+            'geoserver_user_authkey',
+            sa.Column('authkey', sa.UnicodeText, primary_key=True, nullable=False, index=True),
+            sa.Column('user_id', sa.UnicodeText, sa.ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'), index=True),
+            sa.Column('state', sa.UnicodeText),
+            sa.Column('created', sa.DateTime, nullable=False),
+            sa.Column('last_access', sa.DateTime, nullable=True),
+            sa.Column('closed', sa.DateTime, nullable=True),
+        )
+    if 'geoserver_effective_role' not in tables:
+        op.create_table(
+            'geoserver_effective_role',
+            sa.Column('user_id', sa.UnicodeText, sa.ForeignKey('user.id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False, index=True),
+            sa.Column('role', sa.Text, nullable=False),
+            sa.Column('source', sa.UnicodeText, nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'role', 'source'),
+        )
+
+
+def downgrade():
+    for table in ['geoserver_effective_role', 'geoserver_user_authkey',
+                  'geoserver_organization_role', 'geoserver_user_role']:
+        if table in _existing_tables():
+            op.drop_table(table)
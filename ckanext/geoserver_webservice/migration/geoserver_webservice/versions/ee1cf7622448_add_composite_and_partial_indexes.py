@@ -0,0 +1,75 @@
+"""add composite and partial indexes
+
+Revision ID: ee1cf7622448
+Revises: aab8c2f6d0d0
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee1cf7622448'
+down_revision = 'aab8c2f6d0d0'
+branch_labels = None
+depends_on = None
+
+ACTIVE = sa.text("state = 'active'")
+DELETED = sa.text("state = 'deleted'")
+
+# (table, columns used to find duplicate active rows, indexes)
+TABLES = [
+    ('geoserver_user_role', ['user_id', 'role'], [
+        ('ix_geoserver_user_role_user_id_state', ['user_id', 'state'], {}),
+        ('ux_geoserver_user_role_active', ['user_id', 'role'], {'unique': True, 'postgresql_where': ACTIVE}),
+        ('ix_geoserver_user_role_deleted_closed', ['closed'], {'postgresql_where': DELETED}),
+    ]),
+    ('geoserver_organization_role', ['organization_id', 'role'], [
+        ('ix_geoserver_organization_role_organization_id_state', ['organization_id', 'state'], {}),
+        ('ux_geoserver_organization_role_active', ['organization_id', 'role'], {'unique': True, 'postgresql_where': ACTIVE}),
+        ('ix_geoserver_organization_role_deleted_closed', ['closed'], {'postgresql_where': DELETED}),
+    ]),
+    ('geoserver_user_authkey', ['user_id'], [
+        ('ux_geoserver_user_authkey_active_user', ['user_id'], {'unique': True, 'postgresql_where': ACTIVE}),
+        ('ix_geoserver_user_authkey_deleted_closed', ['closed'], {'postgresql_where': DELETED}),
+    ]),
+]
+
+
+def _soft_delete_duplicates(table, columns):
+    # Keep the oldest active row of every group so the unique partial indexes can be built.
+    # geoserver_user_authkey has no last_modified column.
+    key = 'authkey' if table == 'geoserver_user_authkey' else 'id'
+    partition = ', '.join(columns)
+    changes = "state = 'deleted', closed = now()"
+    if table != 'geoserver_user_authkey':
+        changes += ", last_modified = now()"
+    op.execute(f"""
+        UPDATE {table} SET {changes}
+        WHERE {key} IN (
+            SELECT {key} FROM (
+                SELECT {key}, row_number() OVER (PARTITION BY {partition} ORDER BY created, {key}) AS position
+                FROM {table} WHERE state = 'active'
+            ) ranked WHERE ranked.position > 1
+        )
+    """)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, columns, indexes in TABLES:
+        _soft_delete_duplicates(table, columns)
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        for name, index_columns, options in indexes:
+            if name not in existing:
+                op.create_index(name, table, index_columns, **options)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, columns, indexes in TABLES:
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        for name, index_columns, options in indexes:
+            if name in existing:
+                op.drop_index(name, table_name=table)
@@ -4,19 +4,113 @@ import datetime
 import logging
 
 from sqlalchemy import Table, Column, Integer, Text, MetaData, DateTime, ForeignKey, types
-from sqlalchemy.sql import select, text, func
+from sqlalchemy.sql import select, text, func, bindparam, or_, and_, union, null, cast, true, false, literal
+from sqlalchemy import PrimaryKeyConstraint, Index, tuple_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects import postgresql
 from ckan.lib.dictization import table_dictize
 from ckan.model import types as _types
 from ckan.model import meta, core, domain_object, User
+import ckan.plugins.toolkit as tk
 import ckan.model as model
 import warnings
 
+from ckanext.geoserver_webservice.export import enqueue_export
+from ckanext.geoserver_webservice.runtime import get_runtime
 from .base import Base
+from .last_access import LastAccessBuffer
 
 log = logging.getLogger(__name__)
 
+ACTIVE_ROWS = text("state = 'active'")
+
+def _insert_unless_active(obj, conflict_columns):
+    """
+    The _insert_unless_active function inserts a new row for obj with INSERT ... ON CONFLICT DO NOTHING
+    against the partial unique index on active rows, so concurrent workers can not create duplicate
+    active rows and no separate existence query is needed.
+
+    Args:
+        obj: Transient model instance to insert
+        conflict_columns: Columns of the partial unique index on active rows
+
+    Returns:
+        True when a row was inserted
+    """
+    # Pending state changes, e.g. an authkey made deleted before its replacement is
+    # added, have to reach the database before the conflict check.
+    obj.Session.flush()
+    table = obj.__table__
+    values = {
+        column.name: getattr(obj, column.name)
+        for column in table.columns if getattr(obj, column.name) is not None
+    }
+    statement = postgresql.insert(table).values(**values).on_conflict_do_nothing(
+        index_elements=conflict_columns,
+        index_where=ACTIVE_ROWS
+    ).returning(*table.primary_key.columns)
+    row = obj.Session.execute(statement).first()
+    if row is None:
+        return False
+    for column in table.primary_key.columns:
+        setattr(obj, column.name, row[column.name])
+    return True
+
+def _purge_deleted(cls, key, batch_size=1000, older_than=None, progress=None):
+    """
+    The _purge_deleted function permanently removes soft deleted rows of a table in chunks, each
+    chunk being a single DELETE committed on its own so no long running transaction is held.
+
+    Args:
+        cls: Model class of the table
+        key: Primary key column of the table
+        batch_size: Number of rows deleted per statement
+        older_than: Only purge rows closed before this datetime
+        progress: Called with the running total after every chunk
+
+    Returns:
+        The number of rows purged
+    """
+    table = cls.__table__
+    filters = [table.c.state == core.State.DELETED]
+    if older_than is not None:
+        filters.append(table.c.closed < older_than)
+    batch = select([key]).where(and_(*filters)).limit(int(batch_size))
+    statement = table.delete().where(key.in_(batch))
+    total = 0
+    while True:
+        try:
+            deleted = meta.Session.execute(statement).rowcount
+            meta.Session.commit()
+        except Exception:
+            meta.Session.rollback()
+            raise
+        total += deleted
+        if progress is not None:
+            progress(total)
+        if deleted < int(batch_size):
+            return total
+
+def get_last_access_buffer():
+    """
+    The get_last_access_buffer function returns the process wide buffer of authkey last access
+    timestamps kept by the runtime. None is returned when
+    ckanext.geoserver_webservice.last_access.flush_interval is 0 and timestamps are written straight away.
+
+    Returns:
+        LastAccessBuffer or None
+    """
+    return get_runtime().last_access_buffer
+
 class GeoserverUserRoleModel(Base, domain_object.DomainObject):
     __tablename__ = 'geoserver_user_role'
+    __table_args__ = (
+        Index('ix_geoserver_user_role_user_id_state', 'user_id', 'state'),
+        Index('ux_geoserver_user_role_active', 'user_id', 'role', unique=True,
+              postgresql_where=text("state = 'active'")),
+        Index('ix_geoserver_user_role_deleted_closed', 'closed',
+              postgresql_where=text("state = 'deleted'")),
+    )
 
     id = Column('id', types.UnicodeText, primary_key=True, nullable=False, index=True, default=_types.make_uuid)
     user_id = Column('user_id', types.UnicodeText, ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
@@ -38,6 +132,48 @@ class GeoserverUserRoleModel(Base, domain_object.DomainObject):
         query = query.filter(cls.user_id == user_id)
         return query.all()
 
+    @classmethod
+    def get_active_roles(cls, user_id):
+        """
+        The get_active_roles function returns the names of the active roles of a user
+        without loading the role history into the session.
+
+        Args:
+            user_id: Id of the user
+
+        Returns:
+            A list of role names
+        """
+        table = cls.__table__
+        query = select([table.c.role]).where(and_(
+            table.c.user_id == user_id,
+            table.c.state == core.State.ACTIVE))
+        return [row.role for row in cls.Session.execute(query)]
+
+    @classmethod
+    def get_active_role_rows(cls, user_id):
+        """
+        The get_active_role_rows function returns lightweight (id, role) rows of the active
+        roles of a user, e.g. for listing them with a delete link.
+
+        Args:
+            user_id: Id of the user
+
+        Returns:
+            A list of rows with id and role attributes
+        """
+        table = cls.__table__
+        query = select([table.c.id, table.c.role]).where(and_(
+            table.c.user_id == user_id,
+            table.c.state == core.State.ACTIVE))
+        return cls.Session.execute(query).fetchall()
+
+    @classmethod
+    def get_active_role(cls, user_id, role):
+        query = cls.Session.query(cls).autoflush(False)
+        query = query.filter(cls.user_id == user_id, cls.role == role, cls.state == core.State.ACTIVE)
+        return query.first()
+
     @classmethod
     def get(cls, role_id):
         query = cls.Session.query(cls).autoflush(False)
@@ -45,16 +181,21 @@ class GeoserverUserRoleModel(Base, domain_object.DomainObject):
         return query.first()
 
     def add(self, **kw):
-        query = self.Session.query(GeoserverUserRoleModel)
-        query = query.filter(
-            GeoserverUserRoleModel.user_id == self.user_id, 
-            GeoserverUserRoleModel.role == self.role,
-            GeoserverUserRoleModel.state == core.State.ACTIVE
-            )
-        role = query.first()
-        if role is None:
+        if sa_inspect(self).transient:
+            _insert_unless_active(self, ['user_id', 'role'])
+        else:
             super(GeoserverUserRoleModel, self).add(**kw)
 
+    def save(self):
+        # The materialised rows are written in the same transaction as the role.
+        try:
+            self.add()
+            GeoserverEffectiveRole.sync_user_role(self.user_id, self.role, commit=False)
+            self.commit()
+        except Exception:
+            self.Session.rollback()
+            raise
+
     def _change_state(self, state):
         self.last_modified=datetime.datetime.now()
         self.closed = None if state == core.State.ACTIVE else self.last_modified
@@ -76,16 +217,95 @@ class GeoserverUserRoleModel(Base, domain_object.DomainObject):
             raise Exception from(e)
     
     @classmethod
-    def purge_deleted(cls):
-        query = cls.Session.query(cls).autoflush(False)
-        query = query.filter(cls.state == core.State.DELETED)
-        purgeable_roles = query.all()
-        for purgeable_role in purgeable_roles:
-            purgeable_role.purge()
+    def purge_deleted(cls, batch_size=1000, older_than=None, progress=None):
+        return _purge_deleted(cls, cls.id, batch_size, older_than, progress)
+
+    @classmethod
+    def bulk_add(cls, pairs, chunk_size=1000):
+        """
+        The bulk_add function assigns roles to users in one transaction with multi-row
+        INSERT ... ON CONFLICT DO NOTHING statements against the partial unique index on active rows.
+
+        Args:
+            pairs: An iterable of (user_id, role) tuples
+            chunk_size: Number of rows per statement
+
+        Returns:
+            The set of (user_id, role) tuples that were added
+        """
+        pairs = list(set(pairs))
+        if not pairs:
+            return set()
+        table = cls.__table__
+        now = datetime.datetime.now()
+        added = set()
+        try:
+            for start in range(0, len(pairs), chunk_size):
+                statement = postgresql.insert(table).values([{
+                    'id': _types.make_uuid(),
+                    'user_id': user_id,
+                    'role': role,
+                    'state': core.State.ACTIVE,
+                    'created': now,
+                    'last_modified': now
+                } for user_id, role in pairs[start:start + chunk_size]]).on_conflict_do_nothing(
+                    index_elements=['user_id', 'role'],
+                    index_where=ACTIVE_ROWS
+                ).returning(table.c.user_id, table.c.role)
+                added.update((row.user_id, row.role) for row in cls.Session.execute(statement))
+            GeoserverEffectiveRole.sync_user_roles({user_id for user_id, role in added}, commit=False)
+            cls.Session.commit()
+        except Exception:
+            cls.Session.rollback()
+            raise
+        return added
+
+    @classmethod
+    def bulk_delete(cls, pairs):
+        """
+        The bulk_delete function marks the active rows of the given (user_id, role) pairs as deleted
+        with a single UPDATE.
+
+        Args:
+            pairs: An iterable of (user_id, role) tuples
+
+        Returns:
+            The set of (user_id, role) tuples that were deleted
+        """
+        pairs = set(pairs)
+        if not pairs:
+            return set()
+        table = cls.__table__
+        now = datetime.datetime.now()
+        try:
+            result = cls.Session.execute(
+                table.update().where(and_(
+                    table.c.state == core.State.ACTIVE,
+                    tuple_(table.c.user_id, table.c.role).in_(list(pairs))
+                )).values(
+                    state=core.State.DELETED,
+                    last_modified=now,
+                    closed=now
+                ).returning(table.c.user_id, table.c.role)
+            )
+            deleted = {(row.user_id, row.role) for row in result}
+            GeoserverEffectiveRole.sync_user_roles({user_id for user_id, role in deleted}, commit=False)
+            cls.Session.commit()
+        except Exception:
+            cls.Session.rollback()
+            raise
+        return deleted
 
 
 class GeoserverOrganizationRoleModel(Base, domain_object.DomainObject):
     __tablename__ = 'geoserver_organization_role'
+    __table_args__ = (
+        Index('ix_geoserver_organization_role_organization_id_state', 'organization_id', 'state'),
+        Index('ux_geoserver_organization_role_active', 'organization_id', 'role', unique=True,
+              postgresql_where=text("state = 'active'")),
+        Index('ix_geoserver_organization_role_deleted_closed', 'closed',
+              postgresql_where=text("state = 'deleted'")),
+    )
 
     id = Column('id', types.UnicodeText, primary_key=True, nullable=False, index=True, default=_types.make_uuid)
     organization_id = Column('organization_id', types.UnicodeText, ForeignKey("group.id", onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
@@ -113,6 +333,69 @@ class GeoserverOrganizationRoleModel(Base, domain_object.DomainObject):
         query = query.filter(cls.organization_id.in_(organization_ids))
         return query.all()
 
+    @classmethod
+    def get_active_roles(cls, organization_id: str):
+        """
+        The get_active_roles function returns the names of the active roles of an organization
+        without loading the role history into the session.
+
+        Args:
+            organization_id: Id of the organization
+
+        Returns:
+            A list of role names
+        """
+        table = cls.__table__
+        query = select([table.c.role]).where(and_(
+            table.c.organization_id == organization_id,
+            table.c.state == core.State.ACTIVE))
+        return [row.role for row in cls.Session.execute(query)]
+
+    @classmethod
+    def get_active_role_rows(cls, organization_id: str):
+        """
+        The get_active_role_rows function returns lightweight (id, role) rows of the active
+        roles of an organization.
+
+        Args:
+            organization_id: Id of the organization
+
+        Returns:
+            A list of rows with id and role attributes
+        """
+        table = cls.__table__
+        query = select([table.c.id, table.c.role]).where(and_(
+            table.c.organization_id == organization_id,
+            table.c.state == core.State.ACTIVE))
+        return cls.Session.execute(query).fetchall()
+
+    @classmethod
+    def get_active_organizations_roles(cls, organization_ids: list):
+        """
+        The get_active_organizations_roles function returns the distinct names of the active
+        roles of a set of organizations.
+
+        Args:
+            organization_ids: Ids of the organizations
+
+        Returns:
+            A list of role names
+        """
+        organization_ids = list(organization_ids)
+        if not organization_ids:
+            return []
+        table = cls.__table__
+        query = select([table.c.role]).distinct().where(and_(
+            table.c.organization_id.in_(organization_ids),
+            table.c.state == core.State.ACTIVE))
+        return [row.role for row in cls.Session.execute(query)]
+
+    @classmethod
+    def get_active_role(cls, organization_id: str, role: str):
+        query = cls.Session.query(cls).autoflush(False)
+        query = query.filter(cls.organization_id == organization_id, cls.role == role, cls.state == core.State.ACTIVE)
+        return query.first()
+
     @classmethod
     def get(cls, role_id):
         query = cls.Session.query(cls).autoflush(False)
@@ -120,16 +403,21 @@ class GeoserverOrganizationRoleModel(Base, domain_object.DomainObject):
         return query.first()
 
     def add(self, **kw):
-        query = self.Session.query(GeoserverOrganizationRoleModel)
-        query = query.filter(
-            GeoserverOrganizationRoleModel.organization_id == self.organization_id, 
-            GeoserverOrganizationRoleModel.role == self.role,
-            GeoserverOrganizationRoleModel.state == core.State.ACTIVE
-            )
-        role = query.first()
-        if role is None:
+        if sa_inspect(self).transient:
+            _insert_unless_active(self, ['organization_id', 'role'])
+        else:
             super(GeoserverOrganizationRoleModel, self).add(**kw)
 
+    def save(self):
+        # The materialised rows are written in the same transaction as the role.
+        try:
+            self.add()
+            GeoserverEffectiveRole.sync_organization_role(self.organization_id, self.role, commit=False)
+            self.commit()
+        except Exception:
+            self.Session.rollback()
+            raise
+
     def _change_state(self, state):
         self.last_modified=datetime.datetime.now()
         self.closed = None if state == core.State.ACTIVE else self.last_modified
@@ -151,15 +439,446 @@ class GeoserverOrganizationRoleModel(Base, domain_object.DomainObject):
             raise Exception from(e)
     
     @classmethod
-    def purge_deleted(cls):
-        query = cls.Session.query(cls).autoflush(False)
-        query = query.filter(cls.state == core.State.DELETED)
-        purgeable_roles = query.all()
-        for purgeable_role in purgeable_roles:
-            purgeable_role.purge()
-    
+    def purge_deleted(cls, batch_size=1000, older_than=None, progress=None):
+        return _purge_deleted(cls, cls.id, batch_size, older_than, progress)
+
+    @classmethod
+    def sync(cls, desired_roles: dict):
+        """
+        The sync function reconciles the active roles of the given organizations with the desired
+        roles in one transaction. The desired state is loaded into temporary tables and the adds and
+        soft-deletes are worked out by set difference in SQL. Organizations missing from
+        desired_roles are left untouched.
+
+        Args:
+            desired_roles: A dictionary of organization id to the iterable of roles it should have
+
+        Returns:
+            A tuple of the sets of (organization_id, role) tuples that were added and deleted
+        """
+        if not desired_roles:
+            return set(), set()
+        now = datetime.datetime.now()
+        session = cls.Session
+        try:
+            session.execute(text(
+                "CREATE TEMPORARY TABLE geoserver_sync_organization "
+                "(organization_id text PRIMARY KEY) ON COMMIT DROP"))
+            session.execute(text(
+                "CREATE TEMPORARY TABLE geoserver_sync_organization_role "
+                "(id text, organization_id text, role text, PRIMARY KEY (organization_id, role)) ON COMMIT DROP"))
+            session.execute(
+                text("INSERT INTO geoserver_sync_organization VALUES (:organization_id)"),
+                [{'organization_id': organization_id} for organization_id in desired_roles])
+            desired = [
+                {'id': _types.make_uuid(), 'organization_id': organization_id, 'role': role}
+                for organization_id, roles in desired_roles.items() for role in set(roles)
+            ]
+            if desired:
+                session.execute(
+                    text("INSERT INTO geoserver_sync_organization_role VALUES (:id, :organization_id, :role)"),
+                    desired)
+            deleted = session.execute(text(
+                "UPDATE geoserver_organization_role r "
+                "SET state = :deleted, last_modified = :now, closed = :now "
+                "WHERE r.state = :active "
+                "AND r.organization_id IN (SELECT organization_id FROM geoserver_sync_organization) "
+                "AND NOT EXISTS (SELECT 1 FROM geoserver_sync_organization_role d "
+                "WHERE d.organization_id = r.organization_id AND d.role = r.role) "
+                "RETURNING r.organization_id, r.role"
+            ), {'deleted': core.State.DELETED, 'active': core.State.ACTIVE, 'now': now})
+            deleted = {(row.organization_id, row.role) for row in deleted}
+            added = session.execute(text(
+                "INSERT INTO geoserver_organization_role (id, organization_id, role, state, created, last_modified) "
+                "SELECT d.id, d.organization_id, d.role, :active, :now, :now "
+                "FROM geoserver_sync_organization_role d "
+                "WHERE NOT EXISTS (SELECT 1 FROM geoserver_organization_role r "
+                "WHERE r.organization_id = d.organization_id AND r.role = d.role AND r.state = :active) "
+                "RETURNING organization_id, role"
+            ), {'active': core.State.ACTIVE, 'now': now})
+            added = {(row.organization_id, row.role) for row in added}
+            GeoserverEffectiveRole.sync_organizations({x[0] for x in added | deleted}, commit=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return added, deleted
+
+def get_member_organization_ids(user_id):
+    """
+    The get_member_organization_ids function returns the ids of the active organizations a user
+    is an active member of, in any capacity.
+
+    Args:
+        user_id: ID of the user
+
+    Returns:
+        A list of organization ids
+    """
+    member = model.member_table
+    group = model.group_table
+    query = select([member.c.group_id]).distinct().select_from(
+        member.join(group, group.c.id == member.c.group_id)
+    ).where(and_(
+        member.c.table_name == 'user',
+        member.c.table_id == user_id,
+        member.c.state == core.State.ACTIVE,
+        group.c.is_organization == True,
+        group.c.state == core.State.ACTIVE
+    ))
+    return [row.group_id for row in meta.Session.execute(query)]
+
+def _effective_roles_query(user_id=None, organization_id=None, user_ids=None, organization_ids=None):
+    """
+    The _effective_roles_query function builds the UNION of active user roles and the active roles of
+    every active organization a user is a member of.
+
+    Args:
+        user_id: Only include the roles of this user
+        organization_id: Only include roles coming from this organization
+        user_ids: Only include the roles of these users
+        organization_ids: Only include roles coming from these organizations
+
+    Returns:
+        A selectable with user_id, role and organization_id columns, organization_id is NULL for user roles
+    """
+    user_role = GeoserverUserRoleModel.__table__
+    organization_role = GeoserverOrganizationRoleModel.__table__
+    member = model.member_table
+    group = model.group_table
+    user_filters = [user_role.c.state == core.State.ACTIVE]
+    organization_filters = [
+        organization_role.c.state == core.State.ACTIVE,
+        member.c.table_name == 'user',
+        member.c.state == core.State.ACTIVE,
+        group.c.is_organization == True,
+        group.c.state == core.State.ACTIVE
+    ]
+    if user_id is not None:
+        user_filters.append(user_role.c.user_id == user_id)
+        organization_filters.append(member.c.table_id == user_id)
+    if organization_id is not None:
+        user_filters.append(false())
+        organization_filters.append(organization_role.c.organization_id == organization_id)
+    if user_ids is not None:
+        user_filters.append(user_role.c.user_id.in_(user_ids))
+        organization_filters.append(member.c.table_id.in_(user_ids))
+    if organization_ids is not None:
+        user_filters.append(false())
+        organization_filters.append(organization_role.c.organization_id.in_(organization_ids))
+    user_roles = select([
+        user_role.c.user_id,
+        user_role.c.role,
+        cast(null(), types.UnicodeText).label('organization_id')
+    ]).where(and_(*user_filters))
+    organization_roles = select([
+        member.c.table_id.label('user_id'),
+        organization_role.c.role,
+        organization_role.c.organization_id
+    ]).select_from(
+        organization_role
+        .join(member, member.c.group_id == organization_role.c.organization_id)
+        .join(group, group.c.id == organization_role.c.organization_id)
+    ).where(and_(*organization_filters))
+    return union(user_roles, organization_roles)
+
+def _indexed_effective_roles(user_ids):
+    """
+    The _indexed_effective_roles function returns the effective roles of users taking the organizations
+    they are members of from the cached membership index, so a single query over geoserver_user_role
+    and geoserver_organization_role is made without joining ckan's member table.
+
+    Args:
+        user_ids: IDs of the users
+
+    Returns:
+        A dictionary of user id to a list of (role, organization_id) tuples
+    """
+    membership_index = get_runtime().membership_index
+    memberships = {user_id: membership_index.get(user_id) for user_id in user_ids}
+    organization_ids = {x for ids in memberships.values() for x in ids}
+    user_role = GeoserverUserRoleModel.__table__
+    organization_role = GeoserverOrganizationRoleModel.__table__
+    query = select([
+        user_role.c.user_id,
+        user_role.c.role,
+        cast(null(), types.UnicodeText).label('organization_id')
+    ]).where(and_(user_role.c.state == core.State.ACTIVE, user_role.c.user_id.in_(list(memberships))))
+    if organization_ids:
+        query = union(query, select([
+            cast(null(), types.UnicodeText).label('user_id'),
+            organization_role.c.role,
+            organization_role.c.organization_id
+        ]).where(and_(
+            organization_role.c.state == core.State.ACTIVE,
+            organization_role.c.organization_id.in_(list(organization_ids)))))
+    roles = {user_id: [] for user_id in memberships}
+    organization_roles = {}
+    for row in meta.Session.execute(query):
+        if row.organization_id is None:
+            roles[row.user_id].append((row.role, None))
+        else:
+            organization_roles.setdefault(row.organization_id, []).append(row.role)
+    for user_id, ids in memberships.items():
+        for organization_id in ids:
+            roles[user_id].extend((role, organization_id) for role in organization_roles.get(organization_id, ()))
+    return roles
+
+def get_effective_roles(user_id: str):
+    """
+    The get_effective_roles function returns the active roles of a user together with the active roles
+    of every active organization the user is a member of. The organizations come from the cached
+    membership index so only the role tables are queried. When
+    ckanext.geoserver_webservice.effective_roles.materialized is enabled the roles are read from the
+    geoserver_effective_role table instead.
+
+    Args:
+        user_id: ID of the user
+
+    Returns:
+        A list of (role, organization_id) tuples, organization_id is None for roles assigned to the user
+    """
+    if GeoserverEffectiveRole.enabled():
+        return GeoserverEffectiveRole.get_user_roles(user_id)
+    return _indexed_effective_roles([user_id])[user_id]
+
+def get_effective_roles_for_users(user_ids):
+    """
+    The get_effective_roles_for_users function returns the effective roles of several users in a
+    single query, see get_effective_roles.
+
+    Args:
+        user_ids: IDs of the users
+
+    Returns:
+        A dictionary of user id to a list of (role, organization_id) tuples
+    """
+    user_ids = list(user_ids)
+    roles = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return roles
+    if not GeoserverEffectiveRole.enabled():
+        return _indexed_effective_roles(user_ids)
+    for user_id, role, organization_id in GeoserverEffectiveRole.get_users_roles(user_ids):
+        roles[user_id].append((role, organization_id))
+    return roles
+
+
+class GeoserverEffectiveRole(Base):
+    """
+    Materialised (user_id, role, source) rows holding the effective roles of every user. source is
+    GeoserverEffectiveRole.USER for roles assigned to the user and the organization id otherwise.
+    The table is kept up to date by the role models and the membership actions when
+    ckanext.geoserver_webservice.effective_roles.materialized is enabled.
+    """
+    __tablename__ = 'geoserver_effective_role'
+    __table_args__ = (PrimaryKeyConstraint('user_id', 'role', 'source'),)
+
+    USER = 'user'
+
+    user_id = Column('user_id', types.UnicodeText, ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    role = Column('role', Text, nullable=False)
+    source = Column('source', types.UnicodeText, nullable=False)
+
+    @staticmethod
+    def enabled():
+        return get_runtime().get_bool('effective_roles.materialized')
+
+    @classmethod
+    def get_user_roles(cls, user_id):
+        table = cls.__table__
+        query = select([table.c.role, table.c.source]).where(table.c.user_id == user_id)
+        return [(row.role, None if row.source == cls.USER else row.source) for row in meta.Session.execute(query)]
+
+    @classmethod
+    def get_users_roles(cls, user_ids):
+        table = cls.__table__
+        query = select([table.c.user_id, table.c.role, table.c.source]).where(table.c.user_id.in_(list(user_ids)))
+        return [
+            (row.user_id, row.role, None if row.source == cls.USER else row.source)
+            for row in meta.Session.execute(query)
+        ]
+
+    @classmethod
+    def _replace(cls, delete_filter, live_query, commit=True):
+        table = cls.__table__
+        live_query = live_query.alias('live')
+        rows = select([
+            live_query.c.user_id,
+            live_query.c.role,
+            func.coalesce(live_query.c.organization_id, cls.USER)
+        ])
+        session = model.Session
+        try:
+            # Role changes pending in the session have to be visible to the live query.
+            session.flush()
+            session.execute(table.delete().where(delete_filter))
+            session.execute(table.insert().from_select(['user_id', 'role', 'source'], rows))
+            if commit:
+                session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    @classmethod
+    def sync_user_role(cls, user_id, role, commit=True):
+        """
+        The sync_user_role function recomputes the materialised row of a role assigned directly to a user.
+
+        Args:
+            user_id: ID of the user
+            role: Name of the role
+            commit: False to leave the commit to the transaction of the caller
+        """
+        if not cls.enabled():
+            return
+        table = cls.__table__
+        live = _effective_roles_query(user_id=user_id).alias('user_live')
+        cls._replace(
+            and_(table.c.user_id == user_id, table.c.role == role, table.c.source == cls.USER),
+            select([live]).where(and_(live.c.role == role, live.c.organization_id == None)),
+            commit=commit)
+
+    @classmethod
+    def sync_user_roles(cls, user_ids, commit=True):
+        """
+        The sync_user_roles function recomputes the materialised rows of roles assigned directly to
+        the given users.
+
+        Args:
+            user_ids: IDs of the users
+            commit: False to leave the commit to the transaction of the caller
+        """
+        if not cls.enabled() or not user_ids:
+            return
+        table = cls.__table__
+        live = _effective_roles_query(user_ids=list(user_ids)).alias('users_live')
+        cls._replace(
+            and_(table.c.user_id.in_(list(user_ids)), table.c.source == cls.USER),
+            select([live]).where(live.c.organization_id == None),
+            commit=commit)
+
+    @classmethod
+    def sync_user(cls, user_id):
+        """
+        The sync_user function recomputes every materialised row of a user, the roles assigned to the
+        user and the ones coming from organizations, for instance after the user was deleted.
+
+        Args:
+            user_id: ID of the user
+        """
+        if not cls.enabled():
+            return
+        cls._replace(cls.__table__.c.user_id == user_id, _effective_roles_query(user_id=user_id))
+
+    @classmethod
+    def sync_organization_role(cls, organization_id, role, commit=True):
+        """
+        The sync_organization_role function recomputes the materialised rows of an organization role
+        for every member of the organization.
+
+        Args:
+            organization_id: ID of the organization
+            role: Name of the role
+            commit: False to leave the commit to the transaction of the caller
+        """
+        if not cls.enabled():
+            return
+        table = cls.__table__
+        live = _effective_roles_query(organization_id=organization_id).alias('organization_live')
+        cls._replace(
+            and_(table.c.source == organization_id, table.c.role == role),
+            select([live]).where(live.c.role == role),
+            commit=commit)
+
+    @classmethod
+    def sync_organizations(cls, organization_ids, commit=True):
+        """
+        The sync_organizations function recomputes every materialised row coming from the given organizations.
+
+        Args:
+            organization_ids: IDs of the organizations
+            commit: False to leave the commit to the transaction of the caller
+        """
+        if not cls.enabled() or not organization_ids:
+            return
+        table = cls.__table__
+        cls._replace(
+            table.c.source.in_(list(organization_ids)),
+            _effective_roles_query(organization_ids=list(organization_ids)),
+            commit=commit)
+
+    @classmethod
+    def sync_membership(cls, user_id, organization_id):
+        """
+        The sync_membership function recomputes the materialised rows a user gets from an organization
+        after their membership changed.
+
+        Args:
+            user_id: ID of the user
+            organization_id: ID of the organization
+        """
+        if not cls.enabled():
+            return
+        table = cls.__table__
+        cls._replace(
+            and_(table.c.user_id == user_id, table.c.source == organization_id),
+            _effective_roles_query(user_id=user_id, organization_id=organization_id))
+
+    @classmethod
+    def sync_organization(cls, organization_id):
+        """
+        The sync_organization function recomputes every materialised row coming from an organization,
+        for instance after the organization was deleted.
+
+        Args:
+            organization_id: ID of the organization
+        """
+        if not cls.enabled():
+            return
+        table = cls.__table__
+        cls._replace(
+            table.c.source == organization_id,
+            _effective_roles_query(organization_id=organization_id))
+
+    @classmethod
+    def rebuild(cls):
+        """
+        The rebuild function replaces the content of the table with the live computation.
+
+        Returns:
+            The number of rows written
+        """
+        cls._replace(true(), _effective_roles_query())
+        return meta.Session.execute(select([func.count()]).select_from(cls.__table__)).scalar()
+
+    @classmethod
+    def check(cls):
+        """
+        The check function compares the table with the live computation.
+
+        Returns:
+            A tuple of the sets of (user_id, role, source) rows missing from and unexpected in the table
+        """
+        table = cls.__table__
+        live = {
+            (row.user_id, row.role, row.organization_id or cls.USER)
+            for row in meta.Session.execute(_effective_roles_query())
+        }
+        stored = {
+            (row.user_id, row.role, row.source)
+            for row in meta.Session.execute(select([table.c.user_id, table.c.role, table.c.source]))
+        }
+        return live - stored, stored - live
+
 class GeoserverUserAuthkey(Base, domain_object.DomainObject):
     __tablename__ = 'geoserver_user_authkey'
+    __table_args__ = (
+        Index('ux_geoserver_user_authkey_active_user', 'user_id', unique=True,
+              postgresql_where=text("state = 'active'")),
+        Index('ix_geoserver_user_authkey_deleted_closed', 'closed',
+              postgresql_where=text("state = 'deleted'")),
+    )
 
     authkey = Column('authkey', types.UnicodeText, primary_key=True, nullable=False, index=True, default=_types.make_uuid)
     user_id = Column('user_id', types.UnicodeText, ForeignKey("user.id", onupdate="CASCADE", ondelete="CASCADE") , index=True)
@@ -192,6 +911,108 @@ class GeoserverUserAuthkey(Base, domain_object.DomainObject):
             else:
                 geoserver_user_authkey.make_deleted()
     
+    @classmethod
+    def get_active_user(cls, authkey):
+        """
+        The get_active_user function looks up the active user owning an active authkey with a single
+        join and records the access.
+
+        Args:
+            authkey: The authkey to look up
+
+        Returns:
+            A (user_id, user_name) tuple or None
+        """
+        table = cls.__table__
+        user = model.user_table
+        query = select([user.c.id, user.c.name]).select_from(
+            table.join(user, user.c.id == table.c.user_id)
+        ).where(and_(
+            table.c.authkey == authkey,
+            table.c.state == core.State.ACTIVE,
+            user.c.state == core.State.ACTIVE
+        ))
+        row = meta.Session.execute(query).first()
+        if row is not None:
+            cls.touch(authkey)
+            return row.id, row.name
+
+    @classmethod
+    def get_active_users(cls, authkeys):
+        """
+        The get_active_users function looks up the active users owning several active authkeys
+        with a single join and records the accesses.
+
+        Args:
+            authkeys: The authkeys to look up
+
+        Returns:
+            A dictionary of authkey to (user_id, user_name) for the authkeys that were found
+        """
+        authkeys = list(authkeys)
+        if not authkeys:
+            return {}
+        table = cls.__table__
+        user = model.user_table
+        query = select([table.c.authkey, user.c.id, user.c.name]).select_from(
+            table.join(user, user.c.id == table.c.user_id)
+        ).where(and_(
+            table.c.authkey.in_(authkeys),
+            table.c.state == core.State.ACTIVE,
+            user.c.state == core.State.ACTIVE
+        ))
+        users = {row.authkey: (row.id, row.name) for row in meta.Session.execute(query)}
+        for authkey in users:
+            cls.touch(authkey)
+        return users
+
+    @classmethod
+    def iter_active_usernames(cls, batch_size=5000):
+        """
+        The iter_active_usernames function streams the active authkeys of active users with their user
+        names through a server side cursor, so memory use does not grow with the number of keys.
+
+        Args:
+            batch_size: Number of rows fetched from the cursor at a time
+
+        Returns:
+            An iterator of (authkey, user_name) rows ordered by authkey
+        """
+        table = cls.__table__
+        user = model.user_table
+        query = select([table.c.authkey, user.c.name]).select_from(
+            table.join(user, user.c.id == table.c.user_id)
+        ).where(and_(
+            table.c.state == core.State.ACTIVE,
+            user.c.state == core.State.ACTIVE
+        )).order_by(table.c.authkey)
+        connection = meta.engine.connect()
+        try:
+            with connection.begin():
+                result = connection.execution_options(stream_results=True).execute(query)
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row.authkey, row.name
+        finally:
+            connection.close()
+
+    @classmethod
+    def touch(cls, authkey):
+        """
+        The touch function records that an authkey was used without loading its row.
+
+        Args:
+            authkey: The authkey that was used
+        """
+        buffer = get_last_access_buffer()
+        if buffer is None:
+            cls.bulk_update_last_accessed({authkey: datetime.datetime.now()})
+        else:
+            buffer.record(authkey)
+
     @classmethod
     def get_geoserver_user_authkey_for_user(cls, user_id):
         user = model.User.get(user_id)
@@ -203,6 +1024,7 @@ class GeoserverUserAuthkey(Base, domain_object.DomainObject):
                 return geoserver_user_authkey
             else:
                 GeoserverUserAuthkey(user_id=user.id).save()
+                enqueue_export()
                 return query.first()
     
     @classmethod
@@ -221,25 +1043,122 @@ class GeoserverUserAuthkey(Base, domain_object.DomainObject):
                 return query.first()
 
     def add(self, **kw):
-        query = self.Session.query(GeoserverUserAuthkey)
-        query = query.filter(
-            GeoserverUserAuthkey.user_id == self.user_id, 
-            GeoserverUserAuthkey.state == core.State.ACTIVE #uncomment to add new role each time to keep history.
-            )
-        role = query.first()
-        if role is None:
+        if sa_inspect(self).transient:
+            _insert_unless_active(self, ['user_id'])
+        else:
             super(GeoserverUserAuthkey, self).add(**kw)
     
     @classmethod
-    def add_for_all_users(cls):
-        sql = cls.Session.query(model.User).filter_by(state=core.State.ACTIVE)
-        result = cls.Session.execute(sql).fetchall()
-        for user in result:
-            GeoserverUserAuthkey(user_id=user.user_id).save()
+    def _users_without_authkey(cls):
+        table = cls.__table__
+        user = model.user_table
+        has_authkey = select([table.c.authkey]).where(and_(
+            table.c.user_id == user.c.id,
+            table.c.state == core.State.ACTIVE
+        )).exists()
+        return and_(user.c.state == core.State.ACTIVE, ~has_authkey)
+
+    @classmethod
+    def count_users_without_authkey(cls):
+        """
+        The count_users_without_authkey function counts the active users that have no active authkey.
+
+        Returns:
+            The number of users
+        """
+        user = model.user_table
+        query = select([func.count()]).select_from(user).where(cls._users_without_authkey())
+        return cls.Session.execute(query).scalar()
+
+    @classmethod
+    def add_for_all_users(cls, batch_size=5000, progress=None):
+        """
+        The add_for_all_users function creates an authkey for every active user without an active one.
+        Each batch is a single INSERT ... ON CONFLICT DO NOTHING committed on its own, so a key created
+        concurrently for the same user, e.g. lazily by a request, makes the row be skipped instead of
+        failing the batch on the unique index of active keys. Keys are generated by postgres'
+        gen_random_uuid when the server provides it, otherwise they are generated in python for the
+        user ids selected for the batch.
+
+        Args:
+            batch_size: Number of users provisioned per statement
+            progress: Called with the running total after every batch
+
+        Returns:
+            The number of authkeys created
+        """
+        table = cls.__table__
+        user = model.user_table
+        batch_size = int(batch_size)
+        server_side_keys = cls.Session.execute(text("SELECT to_regproc('gen_random_uuid') IS NOT NULL")).scalar()
+        total = 0
+        while True:
+            now = datetime.datetime.now()
+            try:
+                if server_side_keys:
+                    rows = select([
+                        cast(func.gen_random_uuid(), types.UnicodeText),
+                        user.c.id,
+                        literal(core.State.ACTIVE),
+                        literal(now)
+                    ]).where(cls._users_without_authkey()).limit(batch_size)
+                    statement = postgresql.insert(table).from_select(
+                        ['authkey', 'user_id', 'state', 'created'], rows)
+                else:
+                    user_ids = [row.id for row in cls.Session.execute(
+                        select([user.c.id]).where(cls._users_without_authkey()).limit(batch_size))]
+                    if not user_ids:
+                        return total
+                    statement = postgresql.insert(table).values([{
+                        'authkey': _types.make_uuid(),
+                        'user_id': user_id,
+                        'state': core.State.ACTIVE,
+                        'created': now
+                    } for user_id in user_ids])
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=['user_id'],
+                    index_where=ACTIVE_ROWS
+                )
+                created = cls.Session.execute(statement).rowcount
+                cls.Session.commit()
+            except Exception:
+                cls.Session.rollback()
+                raise
+            # Skipped conflicts make a batch smaller than batch_size without the users running out,
+            # users that got a key concurrently are no longer selected by the next batch.
+            if not created:
+                return total
+            total += created
+            if progress is not None:
+                progress(total)
 
     def update_last_accessed(self):
-        self.last_access = datetime.datetime.now()
-        self.save()
+        buffer = get_last_access_buffer()
+        if buffer is None:
+            self.last_access = datetime.datetime.now()
+            self.save()
+        else:
+            buffer.record(self.authkey)
+
+    @classmethod
+    def bulk_update_last_accessed(cls, last_accessed: dict):
+        """
+        The bulk_update_last_accessed function writes buffered last access times in one
+        executemany UPDATE. A row is only updated when the new time is newer than the stored one,
+        so flushes from several workers can not move last_access backwards.
+
+        Args:
+            last_accessed: A dictionary of authkey to last access datetime
+        """
+        table = cls.__table__
+        statement = table.update().where(
+            table.c.authkey == bindparam('_authkey')
+        ).where(
+            or_(table.c.last_access == None, table.c.last_access < bindparam('_last_access'))
+        ).values(last_access=bindparam('_last_access'))
+        params = [{'_authkey': k, '_last_access': v} for k, v in last_accessed.items()]
+        with meta.engine.begin() as connection:
+            connection.execute(statement, params)
 
     def _change_state(self, state):
         self.closed = None if state == core.State.ACTIVE else datetime.datetime.now()
@@ -261,9 +1180,5 @@ class GeoserverUserAuthkey(Base, domain_object.DomainObject):
             raise Exception from(e)
     
     @classmethod
-    def purge_deleted(cls):
-        query = cls.Session.query(cls).autoflush(False)
-        query = query.filter(cls.state == core.State.DELETED)
-        purgeable_roles = query.all()
-        for purgeable_role in purgeable_roles:
-            purgeable_role.purge()
+    def purge_deleted(cls, batch_size=1000, older_than=None, progress=None):
+        return _purge_deleted(cls, cls.authkey, batch_size, older_than, progress)
@@ -0,0 +1,88 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class LastAccessBuffer():
+    """
+    Collects authkey last access timestamps in memory and writes them to the
+    database in periodic bulk updates. Only the newest timestamp per authkey is
+    kept and timestamps are truncated to ``resolution`` seconds so a key used
+    many times within the same window is only written once.
+    """
+
+    def __init__(self, flush, flush_interval=30, resolution=60):
+        self._flush = flush
+        self.flush_interval = float(flush_interval)
+        self.resolution = max(int(resolution), 1)
+        self._pending = {}
+        self._flushed = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def record(self, authkey, accessed=None):
+        """
+        The record function buffers the last access time of an authkey.
+
+        Args:
+            authkey: The authkey that was used
+            accessed: Time of access, defaults to now
+        """
+        accessed = self._truncate(accessed or datetime.datetime.now())
+        with self._lock:
+            if self._pending.get(authkey, self._flushed.get(authkey)) == accessed:
+                return
+            if authkey not in self._pending or self._pending[authkey] < accessed:
+                self._pending[authkey] = accessed
+        self._ensure_thread()
+
+    def flush(self):
+        """
+        The flush function writes every buffered timestamp in a single bulk update.
+
+        Returns:
+            The number of authkeys written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self._flush(pending)
+        except Exception as e:
+            log.error(e, exc_info=True)
+            with self._lock:
+                for authkey, accessed in pending.items():
+                    if self._pending.get(authkey, accessed) <= accessed:
+                        self._pending[authkey] = accessed
+            return 0
+        with self._lock:
+            self._flushed = pending
+        return len(pending)
+
+    def _truncate(self, accessed):
+        seconds = int(accessed.timestamp())
+        return datetime.datetime.fromtimestamp(seconds - seconds % self.resolution)
+
+    def _ensure_thread(self):
+        # Worker processes forked after the first request need their own thread.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='geoserver-last-access', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
@@ -5,7 +5,9 @@ from ckan.common import config, request
 from ckan.logic import NotAuthorized
 from ckan.model import core
 import ckan.model as model
-from flask import Blueprint
+import json
+import hashlib
+from flask import Blueprint, Response
 from flask import redirect
 from flask import render_template, render_template_string
 from ckan.authz import is_authorized
@@ -13,18 +15,22 @@ from ckanext.geoserver_webservice.dbutil import init_tables
 from ckanext.geoserver_webservice.model import GeoserverUserRoleModel
 from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel
 from ckanext.geoserver_webservice.logic import auth_functions, api_actions, template_helper_functions
-from ckanext.geoserver_webservice.helpers import get_geoserver_roles
+from ckanext.geoserver_webservice.logic import invalidate_user_roles, invalidate_organization_cache
+from ckanext.geoserver_webservice.logic import resolve_authkey, get_user_organization_ids, request_source
+from ckanext.geoserver_webservice.logic import authkey_etag
+from ckanext.geoserver_webservice import metrics
+from ckanext.geoserver_webservice.helpers import get_geoserver_roles, is_geoserver_role
+from ckanext.geoserver_webservice.runtime import get_runtime
 
 log = logging.getLogger(__name__)
 
-DEFAULT_ROLES = config.get('ckanext.geoserver_webservice.default_roles').split()
-
 class GeoserverWebservicePlugin(pl.SingletonPlugin):
     pl.implements(pl.IConfigurer)
     pl.implements(pl.IBlueprint)
     pl.implements(pl.IActions)
     pl.implements(pl.IAuthFunctions)
     pl.implements(pl.ITemplateHelpers)
+    pl.implements(pl.IClick)
 
     @staticmethod
     def get_auth_functions():
@@ -38,6 +44,11 @@ class GeoserverWebservicePlugin(pl.SingletonPlugin):
     def get_actions():
         return api_actions
 
+    #IClick
+    def get_commands(self):
+        from ckanext.geoserver_webservice import cli
+        return cli.get_commands()
+
     #IConfigurer
     def update_config(self, config_):
         tk.add_template_directory(config_, 'templates')
@@ -57,6 +68,12 @@ class GeoserverWebservicePlugin(pl.SingletonPlugin):
 
         blueprint.template_folder = 'templates'
 
+        blueprint.add_url_rule(
+            '/geoserver/authkey',
+            'authkey',
+            controller.geoserver_authkey,
+            methods=['GET'])
+
         blueprint.add_url_rule(
             u'/user/<user_id>/geoserver-roles',
             'read_user_roles',
@@ -102,8 +119,85 @@ class GeoserverWebservicePlugin(pl.SingletonPlugin):
 
         return blueprint
 
+AUTHKEY_FORMATS = {
+    'json': 'application/json',
+    'username': 'text/plain',
+    'username_roles': 'text/plain',
+}
+
+def render_authkey_response(result, response_format):
+    """
+    The render_authkey_response function returns the body and etag of an authkey response. Bodies
+    are rendered once per user, roles and format and then served from a cache of preformatted bytes.
+
+    Args:
+        result: The user and roles resolved for the authkey
+        response_format: One of AUTHKEY_FORMATS
+
+    Returns:
+        A tuple of the body bytes and the etag
+    """
+    rendered = get_runtime().rendered_responses
+    key = (response_format, result['user'], result['roles'])
+    cached = rendered.get(key)
+    if cached is not None:
+        return cached
+    if response_format == 'username':
+        body = result['user']
+    elif response_format == 'username_roles':
+        roles = [role for role in result['roles'].split(', ') if role]
+        body = f"{result['user']};{','.join(roles)}"
+    else:
+        body = json.dumps({'username': result['user'], 'roles': result['roles']})
+    body = body.encode('utf-8')
+    # The etag only depends on the user name, roles and format, so it changes exactly when they do.
+    cached = (body, hashlib.sha256(body).hexdigest()[:32])
+    rendered.set(key, cached)
+    return cached
+
 class GeoserverWebServiceController():
 
+    def geoserver_authkey(self):
+        """
+        The geoserver_authkey function is the endpoint for geoserver's web service authkey mapper.
+        It resolves the authkey query parameter to a username and roles without going through the
+        ckan action api, so no action lookup, auth check, dictization or api envelope is involved.
+
+        Args:
+            self: Access the class instance
+
+        Returns:
+            A json response with the username and roles, 304 when the If-None-Match header matches
+            its ETag, or 404 when the authkey is unknown
+        """
+        runtime = get_runtime()
+        authkey = request.args.get('authkey')
+        response_format = request.args.get('format') or runtime.get('authkey.format', 'json')
+        if response_format not in AUTHKEY_FORMATS:
+            return Response('Unknown format', status=400, mimetype='text/plain')
+        max_age = int(runtime.get('authkey.max_age', 0))
+        headers = {'Cache-Control': f'max-age={max_age}' if max_age > 0 else 'no-cache'}
+        # Taken before resolving, a role change in between makes the next request miss instead of
+        # pinning the older body to the newer generations.
+        etag = authkey_etag(authkey, response_format)
+        if etag is not None and request.if_none_match.contains(etag):
+            metrics.increment('authkey.not_modified')
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+        result = resolve_authkey(authkey, source=request_source())
+        if result is None:
+            return Response('Not found', status=404, mimetype='text/plain', headers={'Cache-Control': 'no-store'})
+        body, content_etag = render_authkey_response(result, response_format)
+        # Without generations the etag is a hash of the body, compared once it is rendered.
+        etag = etag or content_etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(body, mimetype=AUTHKEY_FORMATS[response_format], headers=headers)
+        response.set_etag(etag)
+        return response
+
     def geoserver_user_roles_read(self, user_id, errors=None):
         """
         The geoserver_roles_read function is used to render the geoserver_roles_read.html template,
@@ -121,19 +215,16 @@ class GeoserverWebServiceController():
         if tk.c.userobj and tk.check_access('geoserver_user_role_view', {'user':tk.c.userobj.name}, data_dict={'user_id':user_id}):
             ROLE_OPTIONS = get_geoserver_roles()
             user = tk.get_action('user_show')({}, data_dict={'id':user_id, 'include_num_followers':True})
-            user_roles = [x for x in GeoserverUserRoleModel.get_user_roles(user.get('id')) if x.state == core.State.ACTIVE]
-            user_organization_ids = [x['id'] for x in tk.get_action('organization_list_for_user')({}, data_dict={'id':user_id})]
-            organization_roles = []
-            for org_role in GeoserverOrganizationRoleModel.get_organizations_roles(user_organization_ids):
-                if org_role.state == core.State.ACTIVE and org_role.role not in organization_roles:
-                    organization_roles.append(org_role.role)
+            user_roles = GeoserverUserRoleModel.get_active_role_rows(user.get('id'))
+            user_organization_ids = get_user_organization_ids(user.get('id'))
+            organization_roles = GeoserverOrganizationRoleModel.get_active_organizations_roles(user_organization_ids)
             role_options = [{'value':x,'text':x} for x in ROLE_OPTIONS if x not in [x.role for x in user_roles]]
             role_options = [{'value':'null', 'text':'Select Role'}, *role_options]
             return render_template('user/geoserver_role_read.html',
                 user_dict=user,
                 user_roles=user_roles,
                 organization_roles=organization_roles ,
-                default_roles=DEFAULT_ROLES,
+                default_roles=get_runtime().default_roles,
                 role_options=role_options,
                 errors=errors)
         raise NotAuthorized
@@ -156,7 +247,10 @@ class GeoserverWebServiceController():
         if request.environ['REQUEST_METHOD'] == 'POST':
             if tk.c.userobj and tk.check_access('geoserver_user_role_modify', {'user':tk.c.userobj.name}):
                 try:
-                    GeoserverUserRoleModel.get(role_id=role_id).make_deleted()
+                    role = GeoserverUserRoleModel.get(role_id=role_id)
+                    role.make_deleted()
+                    # The role may belong to another user than the one in the url.
+                    invalidate_user_roles(role.user_id)
                     log.info(f'removing role_id: {role_id} from user: {user_id}')
                 except Exception as e:
                     log.error(e)
@@ -179,13 +273,13 @@ class GeoserverWebServiceController():
             A redirect to the user's geoserver roles page
         """
         if request.environ['REQUEST_METHOD'] == 'POST':
-            ROLE_OPTIONS = get_geoserver_roles()
             if tk.c.userobj and tk.check_access('geoserver_user_role_modify', {'user':tk.c.userobj.name}):
                 user = tk.get_action('user_show')({}, data_dict={'id':user_id, 'include_num_followers':True})
                 role = request.form.get('role_name')
-                if role in ROLE_OPTIONS:
+                if is_geoserver_role(role):
                     try:
                         GeoserverUserRoleModel(user_id=user.get('id'), role=role).save()
+                        invalidate_user_roles(user.get('id'))
                         log.info(f'added role: {role} to user: {user_id}')
                     except Exception as e:
                         log.error(e)
@@ -213,7 +307,7 @@ class GeoserverWebServiceController():
         if tk.c.userobj and tk.check_access('geoserver_organization_role_view', {'user':tk.c.userobj.name}, data_dict={'organization_id':organization_id}):
             ROLE_OPTIONS = get_geoserver_roles()
             org = tk.get_action('organization_show')({}, data_dict={'id':organization_id,'include_users': True})
-            org_roles = [x for x in GeoserverOrganizationRoleModel.get_organization_roles(org.get('id')) if x.state == core.State.ACTIVE]
+            org_roles = GeoserverOrganizationRoleModel.get_active_role_rows(org.get('id'))
             role_options = [{'value':x,'text':x} for x in ROLE_OPTIONS if x not in [x.role for x in org_roles]]
             role_options = [{'value':'null', 'text':'Select Role'}, *role_options]
             return render_template('organization/geoserver_role_read.html',
@@ -237,13 +331,13 @@ class GeoserverWebServiceController():
             A redirect to the geoserver_organization_roles_read function
         """
         if request.environ['REQUEST_METHOD'] == 'POST':
-            ROLE_OPTIONS = get_geoserver_roles()
             if tk.c.userobj and tk.check_access('geoserver_organization_role_modify', {'user':tk.c.userobj.name}):
                 org = tk.get_action('organization_show')({}, data_dict={'id':organization_id,'include_users': True})
                 role = request.form.get('role_name')
-                if role in ROLE_OPTIONS:
+                if is_geoserver_role(role):
                     try:
                         GeoserverOrganizationRoleModel(organization_id=org.get('id'), role=role).save()
+                        invalidate_organization_cache(org.get('id'))
                         log.info(f'added role: {role} to organization: {organization_id}')
                     except Exception as e:
                         errors = {'error':'Failed To Add Role', 'context':'Unexpected error occurred when adding role to organization'}
@@ -272,7 +366,9 @@ class GeoserverWebServiceController():
                 org = tk.get_action('organization_show')({}, data_dict={'id':organization_id})
                 if org:
                     try:
-                        GeoserverOrganizationRoleModel.get(role_id=role_id).make_deleted()
+                        role = GeoserverOrganizationRoleModel.get(role_id=role_id)
+                        role.make_deleted()
+                        invalidate_organization_cache(role.organization_id)
                         log.info(f'removing role_id: {role_id} from organization: {org["name"]}')
                     except Exception as e:
                         log.error(e)
@@ -0,0 +1,205 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from ckanext.geoserver_webservice import metrics
+
+log = logging.getLogger(__name__)
+
+
+class RoleSync():
+    """
+    Pushes user -> role assignments into the role service of geoserver through its rest api.
+    The current roles of every user are read first and only the missing assignments are
+    added and the surplus ones removed. Roles that are not managed by ckan, e.g. ADMIN
+    assigned in geoserver itself, are never removed. Calls are spread over a small pool of
+    threads sharing the pooled http session.
+    """
+
+    def __init__(self, request, managed_roles, service=None, workers=4):
+        self._request = request
+        self.managed_roles = frozenset(managed_roles)
+        self.service = service
+        self.workers = max(int(workers), 1)
+
+    def push(self, desired):
+        """
+        The push function makes geoserver's role assignments of the given users match desired.
+
+        Args:
+            desired: A dictionary of user name to the set of geoserver role names the user should have
+
+        Returns:
+            A dictionary with the number of users checked and of roles created, added and removed
+        """
+        changes = self.diff(desired)
+        stats = {'users': len(desired), 'created': 0, 'added': 0, 'removed': 0}
+        wanted = {role for to_add, to_remove in changes.values() for role in to_add}
+        if wanted:
+            missing = wanted - set(self.get_roles())
+            self._map(self.create_role, sorted(missing))
+            stats['created'] = len(missing)
+        calls = []
+        for user, (to_add, to_remove) in changes.items():
+            calls.extend(('POST', role, user) for role in sorted(to_add))
+            calls.extend(('DELETE', role, user) for role in sorted(to_remove))
+            stats['added'] += len(to_add)
+            stats['removed'] += len(to_remove)
+        self._map(lambda call: self._assign(*call), calls)
+        metrics.increment('push.added', stats['added'])
+        metrics.increment('push.removed', stats['removed'])
+        return stats
+
+    def diff(self, desired):
+        """
+        The diff function compares desired with the role assignments currently held by geoserver.
+
+        Args:
+            desired: A dictionary of user name to the set of geoserver role names the user should have
+
+        Returns:
+            A dictionary of user name to a (roles to add, roles to remove) tuple, for users that need changes
+        """
+        users = list(desired)
+        current = dict(zip(users, self._map(self.get_user_roles, users)))
+        changes = {}
+        for user in users:
+            roles = set(desired[user])
+            to_add = roles - current[user]
+            to_remove = (current[user] & self.managed_roles) - roles
+            if to_add or to_remove:
+                changes[user] = (to_add, to_remove)
+        return changes
+
+    def get_roles(self):
+        response = self._call('GET', self._path(), headers={'Accept': 'application/json'})
+        return response.json().get('roles', [])
+
+    def get_user_roles(self, user):
+        response = self._call('GET', self._path('user', user), headers={'Accept': 'application/json'}, allow_missing=True)
+        if response.status_code == 404:
+            return set()
+        return set(response.json().get('roles', []))
+
+    def create_role(self, role):
+        self._call('POST', self._path('role', role))
+
+    def _assign(self, method, role, user):
+        self._call(method, self._path('role', role, 'user', user))
+
+    def _path(self, *parts):
+        path = '/rest/security/roles'
+        if self.service:
+            path += f'/service/{quote(self.service, safe="")}'
+        for part in parts:
+            path += '/' + quote(part, safe='')
+        return path
+
+    def _call(self, method, path, allow_missing=False, **kwargs):
+        response = self._request(method, path, **kwargs)
+        if response.status_code >= 400 and not (allow_missing and response.status_code == 404):
+            raise RoleSyncError(f'{method} {path} failed with {response.status_code}')
+        return response
+
+    def _map(self, fn, items):
+        items = list(items)
+        if len(items) <= 1 or self.workers == 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fn, items))
+
+
+class RoleSyncError(Exception):
+    pass
+
+
+def _geoserver_request(method, path, **kwargs):
+    from ckanext.geoserver_webservice.helpers import geoserver_request
+    # Role assignments are read to be compared, a cached copy would hide earlier pushes.
+    if method == 'GET':
+        kwargs.setdefault('force_refresh', True)
+    return geoserver_request(method, path, **kwargs)
+
+
+def get_role_sync():
+    """
+    The get_role_sync function returns a RoleSync for the configured geoserver. Ckan manages the
+    role options offered by geoserver and the default roles.
+
+    Returns:
+        RoleSync
+    """
+    from ckanext.geoserver_webservice.helpers import get_geoserver_roles
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    runtime = get_runtime()
+    prefix = runtime.get('push.role_prefix', 'ROLE_')
+    managed = {prefix + role for role in [*get_geoserver_roles(), *runtime.default_roles]}
+    return RoleSync(
+        _geoserver_request,
+        managed,
+        service=runtime.get('push.role_service'),
+        workers=runtime.geoserver_pool_size)
+
+
+def desired_roles(user_ids):
+    """
+    The desired_roles function returns the geoserver roles each user should hold: their effective
+    roles and the default roles, with the role prefix geoserver expects. Users that are deleted
+    should hold none.
+
+    Args:
+        user_ids: IDs of the users
+
+    Returns:
+        A dictionary of user name to the set of geoserver role names
+    """
+    import ckan.model as model
+    from ckan.model import core
+    from ckanext.geoserver_webservice.model import get_effective_roles_for_users
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    runtime = get_runtime()
+    prefix = runtime.get('push.role_prefix', 'ROLE_')
+    users = model.Session.query(model.User.id, model.User.name, model.User.state).filter(
+        model.User.id.in_(list(user_ids))).all()
+    active = [user_id for user_id, name, state in users if state == core.State.ACTIVE]
+    effective = get_effective_roles_for_users(active)
+    desired = {}
+    for user_id, name, state in users:
+        if state != core.State.ACTIVE:
+            desired[name] = set()
+            continue
+        roles = [role for role, organization_id in effective[user_id]]
+        desired[name] = {prefix + role for role in [*roles, *runtime.default_roles]}
+    return desired
+
+
+def push_user_roles(user_ids):
+    """
+    The push_user_roles function is the background job pushing the roles of users to geoserver
+    after their roles or memberships changed.
+
+    Args:
+        user_ids: IDs of the users
+    """
+    stats = get_role_sync().push(desired_roles(user_ids))
+    log.info(f'Pushed geoserver roles: {stats}')
+    return stats
+
+
+def enqueue_push(user_ids):
+    """
+    The enqueue_push function queues a push of the roles of users when push.enabled is set.
+
+    Args:
+        user_ids: IDs of the users
+    """
+    import ckan.plugins.toolkit as tk
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    user_ids = sorted(set(user_ids))
+    if not user_ids or not get_runtime().get_bool('push.enabled'):
+        return
+    try:
+        tk.enqueue_job(push_user_roles, [user_ids], title='geoserver role push')
+        metrics.increment('push.enqueued')
+    except Exception as e:
+        log.error(e, exc_info=True)
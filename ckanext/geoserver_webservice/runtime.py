@@ -0,0 +1,255 @@
+import threading
+
+from ckanext.geoserver_webservice.cache import LRUCache, RateLimiter, TwoTierCache, SingleFlight
+
+CONFIG_PREFIX = 'ckanext.geoserver_webservice.'
+
+
+class Runtime():
+    """
+    Settings, caches and clients of the plugin. Nothing is read from the ckan config
+    and no connection is set up until the runtime is first used, so importing the
+    plugin modules has no side effects. Expensive members such as the geoserver http
+    session and the role catalogue are only built when they are first accessed.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.geoserver_url = self.get('url')
+        self.geoserver_username = self.get('username')
+        self.geoserver_password = self.get('password')
+        self.default_roles = (self.get('default_roles') or '').split()
+        self.user_view_roles = self.get_bool('user_view_roles')
+        self.batch_users = (self.get('batch.users') or '').split()
+        self.redis_url = config.get('ckan.redis.url', 'redis://localhost:6379/0')
+
+        # authkey / api token -> {user, roles} payload returned by geoserver_webservice,
+        # in process (L1) and optionally shared through redis (L2)
+        self.authkey_cache = TwoTierCache(
+            LRUCache(
+                max_size=self.get('cache.max_size', 10000),
+                ttl=self.get('cache.ttl', 60),
+                name='l1'),
+            connect=_connect_to_redis,
+            ttl=self.get('cache.l2_ttl', 0))
+        # (format, user, roles) -> preformatted /geoserver/authkey body and etag
+        self.rendered_responses = LRUCache(
+            max_size=self.get('cache.max_size', 10000),
+            ttl=self.get('rendered_cache.ttl', 3600))
+        # concurrent resolutions of the same authkey / api token share one lookup, across
+        # workers as well when the responses are shared through redis
+        self.authkey_flight = SingleFlight(
+            cache=self.authkey_cache,
+            lock_timeout=self.get('cache.lock_timeout', 5),
+            wait_timeout=self.get('cache.lock_wait', 1))
+        # api token digest -> (user_id, user_name, jti) of the decoded token
+        self.api_token_cache = LRUCache(
+            max_size=self.get('api_token_cache.max_size', 10000),
+            ttl=self.get('api_token_cache.ttl', 3600))
+        # authkeys / api tokens that recently failed to resolve
+        self.failed_authkey_cache = LRUCache(
+            max_size=self.get('negative_cache.max_size', 10000),
+            ttl=self.get('negative_cache.ttl', 300))
+        throttle_window = self.get('throttle.window', 60)
+        self.key_failure_limiter = RateLimiter(self.get('throttle.max_failures_per_key', 5), window=throttle_window)
+        self.source_failure_limiter = RateLimiter(self.get('throttle.max_failures_per_source', 0), window=throttle_window)
+
+        self.geoserver_timeout = (
+            float(self.get('http.connect_timeout', 5)),
+            float(self.get('http.read_timeout', 10)))
+        self.geoserver_retries = int(self.get('http.retries', 2))
+        self.geoserver_backoff = float(self.get('http.backoff_factor', 0.5))
+        self.geoserver_pool_size = int(self.get('http.pool_size', 10))
+
+        self._session = None
+        self._role_catalogue = None
+        self._geoserver_breaker = None
+        self._membership_index = None
+        self._generations = None
+        self._last_access_buffer = None
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self.config.get(CONFIG_PREFIX + key, default)
+
+    def get_bool(self, key, default=False):
+        value = self.get(key, default)
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', 'yes', 'on', '1')
+        return bool(value)
+
+    def invalidate_local(self, tag):
+        """
+        The invalidate_local function drops every entry of this worker's caches stored with tag.
+
+        Args:
+            tag: A user, organization, api token or membership tag
+        """
+        self.authkey_cache.invalidate_tag(tag)
+        if tag.startswith('api_token:'):
+            self.api_token_cache.invalidate_tag(tag)
+        elif tag.startswith('membership:') and self._membership_index is not None:
+            self._membership_index.invalidate_local(tag.split(':', 1)[1])
+
+    def clear_local(self):
+        """
+        The clear_local function empties this worker's caches of resolved keys and memberships.
+        """
+        self.authkey_cache.clear()
+        self.api_token_cache.clear()
+        if self._membership_index is not None:
+            self._membership_index.clear_local()
+
+    @property
+    def generations(self):
+        """
+        Redis generation counters keeping the caches of all workers coherent, None unless
+        generations.enabled is set.
+        """
+        if not self.get_bool('generations.enabled'):
+            return None
+        if self._generations is None:
+            with self._lock:
+                if self._generations is None:
+                    from ckanext.geoserver_webservice.generations import GenerationCounters
+                    self._generations = GenerationCounters(
+                        _connect_to_redis(),
+                        on_invalidate=self.invalidate_local,
+                        on_resubscribe=self.clear_local)
+        self._generations.ensure_listening()
+        return self._generations
+
+    @property
+    def session(self):
+        """
+        Redis backed requests session used to talk to the geoserver rest api, with pooled
+        connections and retries with backoff on connection errors and 502/503/504 responses.
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    from requests.adapters import HTTPAdapter
+                    from requests_cache import CachedSession, RedisCache
+                    from urllib3.util.retry import Retry
+                    redis_host, redis_port = self.redis_url.split('/')[2].split(':')
+                    backend = RedisCache(host=redis_host, port=redis_port)
+                    session = CachedSession('http_cache', backend=backend)
+                    session.settings.expire_after = 300
+                    session.settings.stale_if_error = True
+                    retry = Retry(
+                        total=self.geoserver_retries,
+                        backoff_factor=self.geoserver_backoff,
+                        status_forcelist=(502, 503, 504),
+                        raise_on_status=False)
+                    adapter = HTTPAdapter(
+                        max_retries=retry,
+                        pool_connections=self.geoserver_pool_size,
+                        pool_maxsize=self.geoserver_pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def geoserver_breaker(self):
+        """
+        Circuit breaker shared by every call to the geoserver rest api.
+        """
+        if self._geoserver_breaker is None:
+            with self._lock:
+                if self._geoserver_breaker is None:
+                    from ckanext.geoserver_webservice.helpers import CircuitBreaker
+                    self._geoserver_breaker = CircuitBreaker(
+                        failure_threshold=self.get('http.breaker_failures', 5),
+                        reset_timeout=self.get('http.breaker_reset', 60))
+        return self._geoserver_breaker
+
+    @property
+    def role_catalogue(self):
+        """
+        In process catalogue of the geoserver role options.
+        """
+        if self._role_catalogue is None:
+            with self._lock:
+                if self._role_catalogue is None:
+                    from ckanext.geoserver_webservice.helpers import RoleCatalogue, fetch_geoserver_roles
+                    self._role_catalogue = RoleCatalogue(
+                        fetch_geoserver_roles,
+                        refresh_interval=float(self.get('roles.refresh_interval', 300)),
+                        fallback=(self.get('roles.fallback') or '').split(),
+                        load_timeout=float(self.get('roles.load_timeout', 10)))
+        return self._role_catalogue
+
+    @property
+    def last_access_buffer(self):
+        """
+        Buffer of authkey last access timestamps written in periodic bulk updates, None when
+        last_access.flush_interval is 0 and timestamps are written straight away.
+        """
+        flush_interval = float(self.get('last_access.flush_interval', 30))
+        if flush_interval <= 0:
+            return None
+        if self._last_access_buffer is None:
+            with self._lock:
+                if self._last_access_buffer is None:
+                    from ckanext.geoserver_webservice.model import GeoserverUserAuthkey, LastAccessBuffer
+                    self._last_access_buffer = LastAccessBuffer(
+                        GeoserverUserAuthkey.bulk_update_last_accessed,
+                        flush_interval=flush_interval,
+                        resolution=self.get('last_access.resolution', 60))
+        return self._last_access_buffer
+
+    @property
+    def membership_index(self):
+        """
+        Cached user -> organization ids index, kept in process or shared through redis.
+        """
+        if self._membership_index is None:
+            with self._lock:
+                if self._membership_index is None:
+                    from ckanext.geoserver_webservice.membership import MembershipIndex
+                    from ckanext.geoserver_webservice.model import get_member_organization_ids
+                    redis = None
+                    if self.get('membership_cache.backend', 'memory') == 'redis':
+                        redis = _connect_to_redis()
+                    self._membership_index = MembershipIndex(
+                        get_member_organization_ids,
+                        ttl=self.get('membership_cache.ttl', 300),
+                        max_size=self.get('membership_cache.max_size', 10000),
+                        redis=redis)
+        return self._membership_index
+
+
+def _connect_to_redis():
+    from ckan.lib.redis import connect_to_redis
+    return connect_to_redis()
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """
+    The get_runtime function returns the process wide runtime, creating it from the ckan
+    config on first use.
+
+    Returns:
+        Runtime
+    """
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                from ckan.common import config
+                _runtime = Runtime(config)
+    return _runtime
+
+
+def reset_runtime():
+    """
+    The reset_runtime function drops the runtime so the next use reads the ckan config again.
+    """
+    global _runtime
+    with _runtime_lock:
+        _runtime = None
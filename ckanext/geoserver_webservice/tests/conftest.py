@@ -0,0 +1,40 @@
+import pytest
+
+
+@pytest.fixture
+def geoserver_tables(clean_db):
+    """
+    Clean database with the plugin tables created and a runtime that reads the test config.
+    """
+    # Imported here so the tests of the pure python modules collect without the database stack.
+    from ckanext.geoserver_webservice.dbutil import init_tables
+    from ckanext.geoserver_webservice.runtime import reset_runtime
+    init_tables()
+    reset_runtime()
+
+
+@pytest.fixture
+def geoserver_roles(geoserver_tables, monkeypatch):
+    """
+    Role options served by geoserver, loaded without talking to a geoserver.
+    """
+    from ckanext.geoserver_webservice import helpers
+    from ckanext.geoserver_webservice.runtime import get_runtime
+    roles = ['EDITOR', 'VIEWER', 'ANALYST']
+    monkeypatch.setattr(helpers, 'fetch_geoserver_roles', lambda: list(roles))
+    # The catalogue loads in the background, tests need the roles straight away.
+    get_runtime().role_catalogue.refresh()
+    return roles
+
+
+@pytest.fixture
+def sysadmin_request(geoserver_tables, geoserver_roles, with_request_context):
+    """
+    Request context of a logged in sysadmin, the role actions check access against c.userobj.
+    """
+    from ckan import model
+    from ckan.plugins import toolkit
+    from ckan.tests import factories
+    sysadmin = factories.Sysadmin()
+    toolkit.c.userobj = model.User.get(sysadmin['name'])
+    return sysadmin
@@ -0,0 +1,102 @@
+"""
+Functional tests for the /geoserver/authkey endpoint.
+"""
+import uuid
+
+import pytest
+
+from ckan.plugins import toolkit
+from ckan.tests import factories
+
+from ckanext.geoserver_webservice import logic
+from ckanext.geoserver_webservice.model import GeoserverUserRoleModel, GeoserverUserAuthkey
+from ckanext.geoserver_webservice.runtime import get_runtime
+
+
+@pytest.fixture
+def authkey(geoserver_tables):
+    user = factories.User()
+    GeoserverUserRoleModel(user_id=user['id'], role='ROLE_A').save()
+    return GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id']).authkey
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.authkey.max_age', '30')
+@pytest.mark.usefixtures('with_plugins', 'with_request_context')
+def test_authkey_response_is_cacheable_and_revalidates(app, authkey):
+    url = toolkit.url_for('geoserver_webservice.authkey', authkey=authkey)
+    response = app.get(url)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'max-age=30'
+    etag = response.headers['ETag']
+
+    revalidated = app.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    assert not revalidated.data
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.usefixtures('with_plugins', 'with_request_context')
+def test_unknown_authkey_is_not_cached(app, authkey):
+    url = toolkit.url_for('geoserver_webservice.authkey', authkey=str(uuid.uuid4()))
+    response = app.get(url, status=404)
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.authkey.format', 'username_roles')
+@pytest.mark.usefixtures('with_plugins', 'with_request_context')
+def test_plain_text_formats(app, authkey):
+    response = app.get(toolkit.url_for('geoserver_webservice.authkey', authkey=authkey))
+    assert response.headers['Content-Type'].startswith('text/plain')
+    name, roles = response.get_data(as_text=True).split(';')
+    assert 'ROLE_A' in roles.split(',')
+
+    url = toolkit.url_for('geoserver_webservice.authkey', authkey=authkey, format='username')
+    assert app.get(url).get_data(as_text=True) == name
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.generations.enabled', 'true')
+@pytest.mark.usefixtures('with_plugins', 'with_request_context')
+def test_revalidation_reads_no_roles_until_they_change(app, geoserver_tables, monkeypatch):
+    user = factories.User()
+    authkey = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id']).authkey
+    url = toolkit.url_for('geoserver_webservice.authkey', authkey=authkey)
+    etag = app.get(url).headers['ETag']
+
+    # Without a cached response only the authkey itself is looked up.
+    get_runtime().clear_local()
+    get_effective_roles = logic.get_effective_roles
+
+    def fail(user_id):
+        raise AssertionError('roles were read')
+
+    monkeypatch.setattr(logic, 'get_effective_roles', fail)
+    revalidated = app.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    monkeypatch.setattr(logic, 'get_effective_roles', get_effective_roles)
+
+    GeoserverUserRoleModel(user_id=user['id'], role='ROLE_B').save()
+    logic.invalidate_user_cache(user['id'])
+    changed = app.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert 'ROLE_B' in changed.json['roles'].split(', ')
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.usefixtures('with_plugins', 'with_request_context')
+def test_deleting_a_role_invalidates_the_user_owning_it(app, authkey):
+    assert 'ROLE_A' in logic.resolve_authkey(authkey)['roles'].split(', ')
+    owner_id = GeoserverUserAuthkey.get(authkey).user_id
+    role_id = GeoserverUserRoleModel.get_active_role(owner_id, 'ROLE_A').id
+    sysadmin = factories.Sysadmin()
+
+    # Deleted through the sysadmin's own page rather than the page of the owner.
+    url = toolkit.url_for('geoserver_webservice.delete_user_role', user_id=sysadmin['name'], role_id=role_id)
+    app.post(url, extra_environ={'REMOTE_USER': sysadmin['name']})
+
+    assert 'ROLE_A' not in (logic.resolve_authkey(authkey)['roles'] or '').split(', ')
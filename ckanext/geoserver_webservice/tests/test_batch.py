@@ -0,0 +1,64 @@
+"""
+Tests for the geoserver_webservice_batch action.
+"""
+import uuid
+
+import pytest
+
+import ckan.model as model
+from ckan.plugins import toolkit
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice import metrics
+from ckanext.geoserver_webservice.model import GeoserverUserRoleModel, GeoserverUserAuthkey
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.usefixtures('with_plugins')
+def test_batch_resolves_authkeys_and_tokens(geoserver_tables):
+    alice = factories.User()
+    bob = factories.User()
+    GeoserverUserRoleModel(user_id=alice['id'], role='ROLE_A').save()
+    alice_key = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(alice['id']).authkey
+    bob_token = helpers.call_action('api_token_create', context={'user': bob['name']},
+                                    user=bob['name'], name='proxy')['token']
+    unknown = str(uuid.uuid4())
+
+    result = helpers.call_action('geoserver_webservice_batch',
+                                 authkeys=[alice_key, bob_token, unknown, 'not a key'])
+
+    assert [x['user'] for x in result['results']] == [alice['name'], bob['name'], None, None]
+    assert 'ROLE_A' in result['results'][0]['roles'].split(', ')
+    assert result['results'][2]['authkey'] == unknown
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.usefixtures('with_plugins')
+def test_batch_requires_a_list(geoserver_tables):
+    with pytest.raises(toolkit.ValidationError):
+        helpers.call_action('geoserver_webservice_batch', authkeys='abc')
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.batch.users', 'geoserver-proxy')
+@pytest.mark.usefixtures('with_plugins')
+def test_batch_is_limited_to_sysadmins_and_service_users(geoserver_tables):
+    sysadmin = factories.Sysadmin()
+    proxy = factories.User(name='geoserver-proxy')
+    user = factories.User()
+    with pytest.raises(toolkit.NotAuthorized):
+        helpers.call_auth('geoserver_webservice_batch', {'user': '', 'model': model})
+    with pytest.raises(toolkit.NotAuthorized):
+        helpers.call_auth('geoserver_webservice_batch', {'user': user['name'], 'model': model})
+    assert helpers.call_auth('geoserver_webservice_batch', {'user': sysadmin['name'], 'model': model})
+    assert helpers.call_auth('geoserver_webservice_batch', {'user': proxy['name'], 'model': model})
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.throttle.max_failures_per_source', '1')
+@pytest.mark.usefixtures('with_plugins')
+def test_batch_misses_are_not_counted_against_a_source(geoserver_tables):
+    metrics.reset()
+    helpers.call_action('geoserver_webservice_batch', authkeys=[str(uuid.uuid4()) for _ in range(10)])
+    assert metrics.get_metrics()['counters']['authkey.rejected.unknown'] == 10
+    assert 'authkey.rejected.throttled_source' not in metrics.get_metrics()['counters']
@@ -0,0 +1,110 @@
+"""
+Tests for the bulk user role actions and the organization role sync action.
+"""
+import pytest
+
+from ckan import model
+from ckan.plugins import toolkit
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel, GeoserverUserRoleModel
+
+pytestmark = [
+    pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice'),
+    pytest.mark.usefixtures('with_plugins'),
+]
+
+
+def _messages(result):
+    return [(item['success'], item['message']) for item in result['results']]
+
+
+def test_create_user_roles_reports_every_item(sysadmin_request):
+    alice = factories.User()
+    bob = factories.User()
+    GeoserverUserRoleModel(user_id=bob['id'], role='VIEWER').save()
+
+    result = helpers.call_action('create_geoserver_user_roles', roles=[
+        {'user_id': alice['name'], 'role': 'EDITOR'},
+        [bob['id'], 'VIEWER'],
+        {'user_id': 'nobody', 'role': 'EDITOR'},
+        {'user_id': alice['id'], 'role': 'NOT_A_ROLE'},
+        {'user_id': [alice['id']], 'role': 'EDITOR'},
+        {'user_id': alice['id'], 'role': {'name': 'EDITOR'}},
+        {'user_id': alice['id']},
+        'garbage',
+    ])
+
+    assert _messages(result) == [
+        (True, 'created'),
+        (True, 'already assigned'),
+        (False, 'User: nobody does not exist'),
+        (False, 'Role: NOT_A_ROLE is not an allowed role'),
+        (False, 'Expected user_id and role to be strings'),
+        (False, 'Expected user_id and role to be strings'),
+        (False, 'Missing user_id or role'),
+        (False, 'Missing user_id or role'),
+    ]
+    assert GeoserverUserRoleModel.get_active_roles(alice['id']) == ['EDITOR']
+
+
+def test_delete_user_roles_reports_every_item(sysadmin_request):
+    alice = factories.User()
+    GeoserverUserRoleModel(user_id=alice['id'], role='EDITOR').save()
+    GeoserverUserRoleModel(user_id=alice['id'], role='VIEWER').save()
+
+    result = helpers.call_action('delete_geoserver_user_roles', roles=[
+        {'user_id': alice['name'], 'role': 'EDITOR'},
+        {'user_id': alice['id'], 'role': 'ANALYST'},
+        {'user_id': 'nobody', 'role': 'VIEWER'},
+        {'user_id': {'id': alice['id']}, 'role': 'VIEWER'},
+    ])
+
+    assert _messages(result) == [
+        (True, 'deleted'),
+        (False, 'No role: ANALYST attached to user.'),
+        (False, 'User: nobody does not exist'),
+        (False, 'Expected user_id and role to be strings'),
+    ]
+    assert GeoserverUserRoleModel.get_active_roles(alice['id']) == ['VIEWER']
+
+
+@pytest.mark.parametrize('action', ['create_geoserver_user_roles', 'delete_geoserver_user_roles'])
+def test_bulk_user_roles_require_a_list(sysadmin_request, action):
+    with pytest.raises(toolkit.ValidationError):
+        helpers.call_action(action, roles={'user_id': 'alice', 'role': 'EDITOR'})
+
+
+@pytest.mark.parametrize('action', ['create_geoserver_user_roles', 'delete_geoserver_user_roles'])
+def test_bulk_user_roles_require_a_sysadmin(sysadmin_request, action):
+    toolkit.c.userobj = model.User.get(factories.User()['name'])
+    with pytest.raises(toolkit.NotAuthorized):
+        helpers.call_action(action, roles=[])
+
+
+def test_sync_organization_roles_validates_every_organization(sysadmin_request):
+    organization = factories.Organization()
+    other = factories.Organization()
+    GeoserverOrganizationRoleModel(organization_id=organization['id'], role='VIEWER').save()
+
+    result = helpers.call_action('sync_geoserver_organization_roles', organizations={
+        organization['id']: ['EDITOR'],
+        other['id']: 'EDITOR',
+        'missing-organization': ['EDITOR'],
+    })
+
+    assert result['added'] == {organization['id']: ['EDITOR']}
+    assert result['deleted'] == {organization['id']: ['VIEWER']}
+    assert result['errors'] == {
+        other['id']: 'Expected a list of roles',
+        'missing-organization': 'Organization: missing-organization does not exist',
+    }
+
+    result = helpers.call_action('sync_geoserver_organization_roles', organizations={
+        organization['id']: [['EDITOR'], 'NOT_A_ROLE'],
+    })
+    assert result['errors'] == {organization['id']: "Roles: [['EDITOR'], 'NOT_A_ROLE'] are not allowed roles"}
+    assert GeoserverOrganizationRoleModel.get_active_roles(organization['id']) == ['EDITOR']
+
+    with pytest.raises(toolkit.ValidationError):
+        helpers.call_action('sync_geoserver_organization_roles', organizations=['EDITOR'])
@@ -0,0 +1,247 @@
+"""
+Tests for cache.py.
+"""
+import threading
+import time
+
+from ckanext.geoserver_webservice.cache import LRUCache, RateLimiter, TwoTierCache, SingleFlight
+from ckanext.geoserver_webservice.cache import user_tag, organization_tag
+
+
+def test_get_returns_cached_value():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set('key', {'user': 'bob'})
+    assert cache.get('key') == {'user': 'bob'}
+    assert cache.get('missing') is None
+
+
+def test_entries_expire_after_ttl():
+    cache = LRUCache(max_size=10, ttl=0.01)
+    cache.set('key', 'value')
+    time.sleep(0.02)
+    assert cache.get('key') is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_invalidate_tag_removes_tagged_entries_only():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set('a', 1, tags=[user_tag('u1'), organization_tag('o1')])
+    cache.set('b', 2, tags=[user_tag('u2'), organization_tag('o1')])
+    cache.set('c', 3, tags=[user_tag('u3')])
+    cache.invalidate_tag(user_tag('u1'))
+    assert 'a' not in cache
+    assert 'b' in cache
+    cache.invalidate_tag(organization_tag('o1'))
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_disabled_cache_stores_nothing():
+    cache = LRUCache(max_size=10, ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_rate_limiter_counts_per_key():
+    limiter = RateLimiter(2, window=60)
+    limiter.hit('a')
+    assert not limiter.exceeded('a')
+    limiter.hit('a')
+    assert limiter.exceeded('a')
+    assert not limiter.exceeded('b')
+
+
+def test_rate_limiter_window_resets():
+    limiter = RateLimiter(1, window=0.01)
+    limiter.hit('a')
+    assert limiter.exceeded('a')
+    time.sleep(0.02)
+    assert not limiter.exceeded('a')
+
+
+def test_entry_ttl_can_be_shorter_than_cache_ttl():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set('short', 1, ttl=0.01)
+    cache.set('long', 2, ttl=120)
+    time.sleep(0.02)
+    assert 'short' not in cache
+    assert 'long' in cache
+
+
+class FakeRedis():
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member)
+
+    def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self):
+        redis = self
+
+        class Pipeline():
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                return lambda *args: self.calls.append((name, args))
+
+            def execute(self):
+                return [getattr(redis, name)(*args) for name, args in self.calls]
+
+        return Pipeline()
+
+
+def test_two_tier_cache_shares_entries_through_l2():
+    redis = FakeRedis()
+    first = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=lambda: redis, ttl=300)
+    second = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=lambda: redis, ttl=300)
+    first.set('key', {'user': 'bob'}, tags=[user_tag('u1')])
+    assert second.get('key') == {'user': 'bob'}
+    assert 'key' in second.l1
+    second.invalidate_shared_tags([user_tag('u1')])
+    second.invalidate_tag(user_tag('u1'))
+    assert first.get('key') == {'user': 'bob'}
+    first.invalidate_tag(user_tag('u1'))
+    assert first.get('key') is None
+
+
+def test_two_tier_cache_refills_l1_with_the_remaining_ttl():
+    redis = FakeRedis()
+    first = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=lambda: redis, ttl=300)
+    second = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=lambda: redis, ttl=300)
+    first.set('token', 'bob', ttl=1.1)
+    time.sleep(0.2)
+    assert second.get('token') == 'bob'
+    time.sleep(1)
+    # An L1 copy made with the tier ttl would still be served here.
+    assert second.l1.get('token') is None
+    assert second.get('token') is None
+
+
+def test_two_tier_cache_without_l2_uses_l1_only():
+    cache = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=None)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    cache.invalidate('key')
+    assert cache.get('key') is None
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(5)]
+    for follower in followers:
+        follower.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+    assert calls == [1]
+    assert results == ['result'] * 6
+
+
+def _shared_flight(redis, wait_timeout=5):
+    cache = TwoTierCache(LRUCache(max_size=10, ttl=60), connect=lambda: redis, ttl=300)
+    return cache, SingleFlight(cache=cache, wait_timeout=wait_timeout)
+
+
+def test_single_flight_coalesces_workers_through_l2():
+    redis = FakeRedis()
+    first_cache, first = _shared_flight(redis)
+    second_cache, second = _shared_flight(redis)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        first_cache.set('key', 'result')
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(first.do('key', work, lambda: first_cache.get('key'))))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(
+        second.do('key', lambda: calls.append(2), lambda: second_cache.get('key'))))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader, follower]:
+        thread.join()
+    assert calls == [1]
+    assert results == ['result', 'result']
+    assert not any(key.endswith(':lock') for key in redis.data)
+
+
+def test_single_flight_falls_back_when_the_other_worker_stores_nothing():
+    redis = FakeRedis()
+    cache, flight = _shared_flight(redis)
+    token = cache.acquire('key', 5)
+    threading.Timer(0.05, lambda: cache.release('key', token)).start()
+    assert flight.do('key', lambda: 'local', lambda: cache.get('key')) == 'local'
+
+
+def test_single_flight_falls_back_after_the_wait_timeout():
+    redis = FakeRedis()
+    cache, flight = _shared_flight(redis, wait_timeout=0.1)
+    assert cache.acquire('key', 5) not in (None, True)
+    started = time.monotonic()
+    assert flight.do('key', lambda: 'local', lambda: cache.get('key')) == 'local'
+    assert time.monotonic() - started < 2
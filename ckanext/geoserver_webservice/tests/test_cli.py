@@ -0,0 +1,128 @@
+"""
+Tests for the geoserver-webservice commands and the model methods behind them.
+"""
+import datetime
+
+import pytest
+
+from ckan import model
+from ckan.cli.cli import ckan
+from ckan.plugins import toolkit
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice.model import GeoserverUserAuthkey, GeoserverUserRoleModel
+
+pytestmark = [
+    pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice'),
+    pytest.mark.usefixtures('with_plugins'),
+]
+
+
+def _active_authkeys(user_id):
+    return GeoserverUserAuthkey.Session.query(GeoserverUserAuthkey).filter(
+        GeoserverUserAuthkey.user_id == user_id,
+        GeoserverUserAuthkey.state == 'active').all()
+
+
+@pytest.fixture
+def role_history(geoserver_tables):
+    """
+    Five user roles deleted 100 days ago, two deleted yesterday and two active ones.
+    """
+    user = factories.User()
+    now = datetime.datetime.now()
+    closed = [now - datetime.timedelta(days=100)] * 5 + [now - datetime.timedelta(days=1)] * 2 + [None] * 2
+    GeoserverUserRoleModel.bulk_add((user['id'], f'ROLE_{i}') for i in range(len(closed)))
+    table = GeoserverUserRoleModel.__table__
+    for i, when in enumerate(closed):
+        if when is not None:
+            model.Session.execute(table.update().where(table.c.role == f'ROLE_{i}').values(
+                state='deleted', closed=when))
+    model.Session.commit()
+    return user
+
+
+def _role_states(user_id):
+    table = GeoserverUserRoleModel.__table__
+    rows = model.Session.execute(table.select().where(table.c.user_id == user_id))
+    return sorted((row.role, row.state) for row in rows)
+
+
+def _kept_roles():
+    return [('ROLE_5', 'deleted'), ('ROLE_6', 'deleted'), ('ROLE_7', 'active'), ('ROLE_8', 'active')]
+
+
+def test_purge_deleted_only_removes_rows_older_than_the_cutoff(role_history):
+    totals = []
+    older_than = datetime.datetime.now() - datetime.timedelta(days=30)
+    purged = GeoserverUserRoleModel.purge_deleted(batch_size=2, older_than=older_than, progress=totals.append)
+    assert purged == 5
+    assert totals == [2, 4, 5]
+    assert _role_states(role_history['id']) == _kept_roles()
+
+
+def test_purge_deleted_command(cli, role_history):
+    result = cli.invoke(ckan, ['geoserver-webservice', 'purge-deleted', '--table', 'user_role',
+                               '--older-than-days', '30', '--batch-size', '2'])
+    assert not result.exit_code, result.output
+    assert 'done, 5 rows purged' in result.output
+    assert _role_states(role_history['id']) == _kept_roles()
+
+
+def test_add_for_all_users_creates_one_key_per_user_without_one(geoserver_tables):
+    users = [factories.User() for _ in range(5)]
+    existing = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(users[0]['id']).authkey
+    deleted = factories.User()
+    helpers.call_action('user_delete', id=deleted['id'])
+    missing = GeoserverUserAuthkey.count_users_without_authkey()
+    totals = []
+
+    assert GeoserverUserAuthkey.add_for_all_users(batch_size=2, progress=totals.append) == missing
+    assert totals[-1] == missing and len(totals) > 1
+    assert GeoserverUserAuthkey.count_users_without_authkey() == 0
+    for user in users:
+        assert len(_active_authkeys(user['id'])) == 1
+    assert _active_authkeys(users[0]['id'])[0].authkey == existing
+    assert _active_authkeys(deleted['id']) == []
+    assert GeoserverUserAuthkey.add_for_all_users(batch_size=2) == 0
+
+
+def test_provision_authkeys_command(cli, geoserver_tables):
+    users = [factories.User() for _ in range(3)]
+
+    result = cli.invoke(ckan, ['geoserver-webservice', 'provision-authkeys', '--dry-run'])
+    assert not result.exit_code, result.output
+    assert all(_active_authkeys(user['id']) == [] for user in users)
+
+    result = cli.invoke(ckan, ['geoserver-webservice', 'provision-authkeys', '--batch-size', '2'])
+    assert not result.exit_code, result.output
+    assert 'authkeys created' in result.output
+    assert all(len(_active_authkeys(user['id'])) == 1 for user in users)
+
+
+@pytest.fixture
+def export_jobs(tmp_path, monkeypatch):
+    jobs = []
+    monkeypatch.setitem(toolkit.config, 'ckanext.geoserver_webservice.export.path', str(tmp_path / 'authkeys.properties'))
+    monkeypatch.setattr(toolkit, 'enqueue_job', lambda fn, *args, **kwargs: jobs.append(fn.__name__))
+    return jobs
+
+
+def test_provision_authkeys_queues_one_export_per_run(cli, geoserver_tables, export_jobs):
+    for _ in range(5):
+        factories.User()
+    result = cli.invoke(ckan, ['geoserver-webservice', 'provision-authkeys', '--batch-size', '2'])
+    assert not result.exit_code, result.output
+    assert export_jobs == ['export_authkeys']
+
+    result = cli.invoke(ckan, ['geoserver-webservice', 'provision-authkeys'])
+    assert not result.exit_code, result.output
+    assert export_jobs == ['export_authkeys']
+
+
+def test_lazily_created_authkey_queues_an_export(geoserver_tables, export_jobs):
+    user = factories.User()
+    GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id'])
+    assert export_jobs == ['export_authkeys']
+    GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id'])
+    assert export_jobs == ['export_authkeys']
@@ -0,0 +1,125 @@
+"""
+Tests for the materialised geoserver_effective_role table.
+"""
+import pytest
+
+from ckan import model
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice import model as model_module
+from ckanext.geoserver_webservice.model import (
+    GeoserverEffectiveRole, GeoserverOrganizationRoleModel, GeoserverUserRoleModel,
+    get_effective_roles, get_effective_roles_for_users)
+
+pytestmark = [
+    pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice'),
+    pytest.mark.usefixtures('with_plugins'),
+]
+
+materialized = pytest.mark.ckan_config('ckanext.geoserver_webservice.effective_roles.materialized', 'true')
+
+
+def _stored(user_id):
+    return set(GeoserverEffectiveRole.get_user_roles(user_id))
+
+
+@pytest.fixture
+def member(geoserver_tables):
+    user = factories.User()
+    organization = factories.Organization()
+    GeoserverUserRoleModel(user_id=user['id'], role='EDITOR').save()
+    GeoserverOrganizationRoleModel(organization_id=organization['id'], role='VIEWER').save()
+    helpers.call_action('organization_member_create', id=organization['id'],
+                        username=user['name'], role='member')
+    return user, organization
+
+
+@materialized
+def test_role_and_membership_changes_are_synced(member):
+    user, organization = member
+    assert _stored(user['id']) == {('EDITOR', None), ('VIEWER', organization['id'])}
+
+    GeoserverUserRoleModel.get_active_role(user['id'], 'EDITOR').make_deleted()
+    helpers.call_action('organization_member_delete', id=organization['id'], username=user['name'])
+
+    assert _stored(user['id']) == set()
+    assert GeoserverEffectiveRole.check() == (set(), set())
+
+
+@materialized
+def test_organization_update_members_are_synced(member):
+    user, organization = member
+    helpers.call_action('organization_patch', id=organization['id'], users=[])
+    assert _stored(user['id']) == {('EDITOR', None)}
+
+    helpers.call_action('organization_patch', id=organization['id'],
+                        users=[{'name': user['name'], 'capacity': 'member'}])
+    assert _stored(user['id']) == {('EDITOR', None), ('VIEWER', organization['id'])}
+    assert GeoserverEffectiveRole.check() == (set(), set())
+
+
+@materialized
+def test_user_delete_drops_the_rows_from_organizations(member):
+    user, organization = member
+    helpers.call_action('user_delete', context={'ignore_auth': True}, id=user['id'])
+
+    assert _stored(user['id']) == {('EDITOR', None)}
+    assert GeoserverEffectiveRole.check() == (set(), set())
+
+
+@materialized
+def test_check_reports_drift_and_rebuild_repairs_it(member):
+    user, organization = member
+    table = GeoserverEffectiveRole.__table__
+    model.Session.execute(table.delete().where(table.c.source == GeoserverEffectiveRole.USER))
+    model.Session.execute(table.insert().values(user_id=user['id'], role='STALE', source=organization['id']))
+    model.Session.commit()
+
+    missing, unexpected = GeoserverEffectiveRole.check()
+    assert missing == {(user['id'], 'EDITOR', GeoserverEffectiveRole.USER)}
+    assert unexpected == {(user['id'], 'STALE', organization['id'])}
+
+    assert GeoserverEffectiveRole.rebuild() == 2
+    assert GeoserverEffectiveRole.check() == (set(), set())
+
+
+def test_nothing_is_written_when_disabled(geoserver_tables):
+    user = factories.User()
+    GeoserverUserRoleModel(user_id=user['id'], role='EDITOR').save()
+    GeoserverEffectiveRole.sync_user(user['id'])
+    assert _stored(user['id']) == set()
+
+
+@materialized
+def test_role_change_is_rolled_back_when_the_sync_fails(member, monkeypatch):
+    user, organization = member
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('sync failed')
+
+    monkeypatch.setattr(GeoserverEffectiveRole, '_replace', classmethod(fail))
+    with pytest.raises(RuntimeError):
+        GeoserverUserRoleModel(user_id=user['id'], role='ANALYST').save()
+    with pytest.raises(RuntimeError):
+        GeoserverUserRoleModel.bulk_delete([(user['id'], 'EDITOR')])
+    monkeypatch.undo()
+
+    assert sorted(GeoserverUserRoleModel.get_active_roles(user['id'])) == ['EDITOR']
+    assert GeoserverEffectiveRole.check() == (set(), set())
+
+
+def test_live_roles_take_organizations_from_the_membership_index(member, monkeypatch):
+    user, organization = member
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the member table should not be joined')
+
+    monkeypatch.setattr(model_module, '_effective_roles_query', fail)
+    assert set(get_effective_roles(user['id'])) == {('EDITOR', None), ('VIEWER', organization['id'])}
+    assert get_effective_roles_for_users([user['id']]) == {user['id']: get_effective_roles(user['id'])}
+
+    helpers.call_action('organization_member_delete', id=organization['id'], username=user['name'])
+    assert get_effective_roles(user['id']) == [('EDITOR', None)]
+    new = factories.Organization(users=[{'name': user['name'], 'capacity': 'member'}])
+    GeoserverOrganizationRoleModel(organization_id=new['id'], role='ANALYST').save()
+    assert set(get_effective_roles(user['id'])) == {('EDITOR', None), ('ANALYST', new['id'])}
@@ -0,0 +1,41 @@
+"""
+Tests for export.py.
+"""
+import os
+
+import pytest
+
+from ckanext.geoserver_webservice.export import write_properties, HEADER
+
+
+def test_write_properties_replaces_file_atomically(tmp_path):
+    path = tmp_path / 'authkeys.properties'
+    count, changed = write_properties(iter([('key-1', 'alice'), ('key-2', 'bob')]), str(path))
+    assert (count, changed) == (2, True)
+    assert path.read_text() == HEADER + 'key-1=alice\nkey-2=bob\n'
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+    assert os.listdir(tmp_path) == ['authkeys.properties']
+
+
+def test_write_properties_leaves_unchanged_file_alone(tmp_path):
+    path = tmp_path / 'authkeys.properties'
+    write_properties([('key-1', 'alice')], str(path))
+    mtime = os.stat(path).st_mtime_ns
+    assert write_properties([('key-1', 'alice')], str(path)) == (1, False)
+    assert os.stat(path).st_mtime_ns == mtime
+    assert write_properties([('key-1', 'carol')], str(path)) == (1, True)
+    assert os.listdir(tmp_path) == ['authkeys.properties']
+
+
+def test_write_properties_keeps_old_file_on_failure(tmp_path):
+    path = tmp_path / 'authkeys.properties'
+    write_properties([('key-1', 'alice')], str(path))
+
+    def rows():
+        yield ('key-2', 'bob')
+        raise RuntimeError('database went away')
+
+    with pytest.raises(RuntimeError):
+        write_properties(rows(), str(path))
+    assert path.read_text() == HEADER + 'key-1=alice\n'
+    assert os.listdir(tmp_path) == ['authkeys.properties']
@@ -0,0 +1,75 @@
+import time
+
+from ckanext.geoserver_webservice.generations import GenerationCounters, REDIS_PREFIX, CHANNEL
+
+
+class FakePipeline():
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, nx=False):
+        self.commands.append(lambda: self.redis.set(key, value, nx=nx))
+
+    def incr(self, key):
+        self.commands.append(lambda: self.redis.incr(key))
+
+    def publish(self, channel, message):
+        self.commands.append(lambda: self.redis.published.append((channel, message)))
+
+    def execute(self):
+        return [command() for command in self.commands]
+
+
+class FakeRedis():
+
+    def __init__(self):
+        self.data = {}
+        self.published = []
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def set(self, key, value, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = int(value)
+        return True
+
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+
+def _counters(redis):
+    counters = GenerationCounters(redis, on_invalidate=lambda tag: None)
+    # Pretend the subscriber is down so values are checked against the counters.
+    counters.ensure_listening = lambda: None
+    return counters
+
+
+def test_bump_increments_and_publishes():
+    redis = FakeRedis()
+    counters = _counters(redis)
+    started = int(time.time() * 1000)
+    counters.bump(['user:u1', 'user:u1', 'organization:o1'])
+    assert set(redis.data) == {REDIS_PREFIX + 'user:u1', REDIS_PREFIX + 'organization:o1'}
+    first = redis.data[REDIS_PREFIX + 'user:u1']
+    assert first > started
+    counters.bump(['user:u1'])
+    assert redis.data[REDIS_PREFIX + 'user:u1'] == first + 1
+    assert redis.published[0] == (CHANNEL, '["user:u1", "organization:o1"]')
+
+
+def test_is_current_detects_bumps_without_subscription():
+    counters = _counters(FakeRedis())
+    generations = counters.current(['user:u1'])
+    assert generations == (0,)
+    assert counters.is_current(['user:u1'], generations)
+    counters.bump(['user:u1'])
+    assert not counters.is_current(['user:u1'], generations)
+    assert not counters.is_current(['user:u1'], None)
@@ -0,0 +1,100 @@
+"""
+EXPLAIN based tests checking that the hot queries are served by the composite and
+partial indexes added in migration ee1cf7622448.
+"""
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from ckan import model
+from ckan.tests import factories
+
+
+USERS = 20
+ROWS_PER_USER = 500
+ACTIVE_PER_USER = 20
+
+
+@pytest.fixture
+def role_history(geoserver_tables):
+    """
+    Role and authkey history large enough for the planner to prefer the indexes over sequential
+    scans: every user has ACTIVE_PER_USER active roles and one active authkey among
+    ROWS_PER_USER rows, deleted rows were closed one day apart.
+    """
+    users = [factories.User()['id'] for _ in range(USERS)]
+    organizations = [factories.Organization()['id'] for _ in range(USERS // 2)]
+    model.Session.execute(sa.text(
+        "INSERT INTO geoserver_user_role (id, user_id, role, state, created, last_modified, closed) "
+        "SELECT u.id || '-' || i, u.id, 'ROLE_' || (i % :active), "
+        "CASE WHEN i < :active THEN 'active' ELSE 'deleted' END, now(), now(), "
+        "CASE WHEN i < :active THEN NULL ELSE now() - i * interval '1 day' END "
+        "FROM \"user\" u CROSS JOIN generate_series(0, :rows - 1) i WHERE u.id = ANY(:user_ids)"),
+        {'active': ACTIVE_PER_USER, 'rows': ROWS_PER_USER, 'user_ids': users})
+    for organization_id, user_id in zip(organizations, users):
+        model.Session.execute(sa.text(
+            "INSERT INTO geoserver_organization_role (id, organization_id, role, state, created, last_modified, closed) "
+            "SELECT id || '-org', :organization_id, role, state, created, last_modified, closed "
+            "FROM geoserver_user_role WHERE user_id = :user_id"),
+            {'organization_id': organization_id, 'user_id': user_id})
+    model.Session.execute(sa.text(
+        "INSERT INTO geoserver_user_authkey (authkey, user_id, state, created, closed) "
+        "SELECT id, user_id, CASE WHEN state = 'active' AND role = 'ROLE_1' THEN 'active' ELSE 'deleted' END, "
+        "created, CASE WHEN state = 'active' AND role = 'ROLE_1' THEN NULL ELSE coalesce(closed, now()) END "
+        "FROM geoserver_user_role WHERE user_id = ANY(:user_ids)"),
+        {'user_ids': users})
+    model.Session.commit()
+    for table in ['geoserver_user_role', 'geoserver_organization_role', 'geoserver_user_authkey']:
+        model.Session.execute(sa.text(f'ANALYZE {table}'))
+    model.Session.commit()
+    return {'user_id': users[0], 'organization_id': organizations[0], 'authkey': f'{users[0]}-1'}
+
+
+def _plan(query, params):
+    plan = model.Session.execute(sa.text(f'EXPLAIN (FORMAT JSON) {query}'), params).scalar()
+    return json.dumps(plan)
+
+
+@pytest.mark.parametrize('query, indexes', [
+    (
+        "SELECT role FROM geoserver_user_role WHERE user_id = :user_id AND state = 'active'",
+        ['ix_geoserver_user_role_user_id_state', 'ux_geoserver_user_role_active'],
+    ),
+    (
+        "SELECT id FROM geoserver_user_role WHERE user_id = :user_id AND role = 'ROLE_1' AND state = 'active'",
+        ['ux_geoserver_user_role_active'],
+    ),
+    (
+        "SELECT role FROM geoserver_organization_role WHERE organization_id IN (:organization_id) AND state = 'active'",
+        ['ix_geoserver_organization_role_organization_id_state', 'ux_geoserver_organization_role_active'],
+    ),
+    (
+        "SELECT authkey FROM geoserver_user_authkey WHERE user_id = :user_id AND state = 'active'",
+        ['ux_geoserver_user_authkey_active_user'],
+    ),
+    (
+        # Served by the primary key, the state is checked on the single row found.
+        "SELECT user_id FROM geoserver_user_authkey WHERE authkey = :authkey AND state = 'active'",
+        ['geoserver_user_authkey_pkey', 'ix_geoserver_user_authkey_authkey'],
+    ),
+    (
+        "SELECT id FROM geoserver_user_role WHERE state = 'deleted' AND closed < now() - interval '495 days'",
+        ['ix_geoserver_user_role_deleted_closed'],
+    ),
+    (
+        "SELECT authkey FROM geoserver_user_authkey WHERE state = 'deleted' AND closed < now() - interval '495 days'",
+        ['ix_geoserver_user_authkey_deleted_closed'],
+    ),
+])
+def test_hot_queries_use_indexes(role_history, query, indexes):
+    plan = _plan(query, role_history)
+    assert any(index in plan for index in indexes), plan
+
+
+def test_active_rows_are_unique(role_history):
+    with pytest.raises(sa.exc.IntegrityError):
+        model.Session.execute(sa.text(
+            "INSERT INTO geoserver_user_role (id, user_id, role, state, created, last_modified) "
+            "VALUES ('duplicate', :user_id, 'ROLE_1', 'active', now(), now())"), role_history)
+    model.Session.rollback()
@@ -0,0 +1,136 @@
+"""
+Tests for the buffered authkey last access timestamps.
+"""
+import datetime
+import threading
+
+import pytest
+
+from ckan import model
+from ckan.tests import factories
+
+from ckanext.geoserver_webservice.model import GeoserverUserAuthkey, get_last_access_buffer
+from ckanext.geoserver_webservice.model import last_access
+from ckanext.geoserver_webservice.model.last_access import LastAccessBuffer
+
+
+class FakeFlush():
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self.called = threading.Event()
+
+    def __call__(self, pending):
+        self.calls.append(dict(pending))
+        self.called.set()
+        if self.fail:
+            raise RuntimeError('database is down')
+
+
+def _at(minute, second):
+    return datetime.datetime(2024, 1, 1, 12, minute, second)
+
+
+def _last_access(authkey):
+    # The bulk update bypasses the session, so drop its stale copy of the row.
+    model.Session.expire_all()
+    return GeoserverUserAuthkey.get(authkey).last_access
+
+
+@pytest.fixture
+def no_thread(monkeypatch):
+    monkeypatch.setattr(LastAccessBuffer, '_ensure_thread', lambda self: None)
+
+
+def test_timestamps_are_truncated_to_the_resolution(no_thread):
+    flush = FakeFlush()
+    buffer = LastAccessBuffer(flush, resolution=60)
+    buffer.record('key', _at(0, 45))
+    buffer.flush()
+    assert flush.calls == [{'key': _at(0, 0)}]
+
+
+def test_flush_writes_every_key_in_one_bulk_update(no_thread):
+    flush = FakeFlush()
+    buffer = LastAccessBuffer(flush, resolution=60)
+    buffer.record('a', _at(1, 0))
+    buffer.record('a', _at(3, 0))
+    buffer.record('a', _at(2, 0))
+    buffer.record('b', _at(1, 30))
+    assert buffer.flush() == 2
+    assert flush.calls == [{'a': _at(3, 0), 'b': _at(1, 0)}]
+    assert buffer.flush() == 0
+    assert len(flush.calls) == 1
+
+
+def test_access_within_the_flushed_window_is_not_written_again(no_thread):
+    flush = FakeFlush()
+    buffer = LastAccessBuffer(flush, resolution=60)
+    buffer.record('key', _at(0, 10))
+    buffer.flush()
+    buffer.record('key', _at(0, 50))
+    assert buffer.flush() == 0
+    buffer.record('key', _at(1, 5))
+    buffer.flush()
+    assert flush.calls == [{'key': _at(0, 0)}, {'key': _at(1, 0)}]
+
+
+def test_failed_flush_keeps_timestamps_for_the_next_flush(no_thread):
+    flush = FakeFlush(fail=True)
+    buffer = LastAccessBuffer(flush, resolution=60)
+    buffer.record('key', _at(0, 0))
+    assert buffer.flush() == 0
+    flush.fail = False
+    assert buffer.flush() == 1
+    assert flush.calls[-1] == {'key': _at(0, 0)}
+
+
+def test_background_thread_flushes_periodically(monkeypatch):
+    monkeypatch.setattr(last_access.atexit, 'register', lambda fn: None)
+    flush = FakeFlush()
+    buffer = LastAccessBuffer(flush, flush_interval=0.01, resolution=60)
+    buffer.record('key', _at(0, 0))
+    assert flush.called.wait(timeout=5)
+    assert flush.calls[0] == {'key': _at(0, 0)}
+    thread = buffer._thread
+    buffer.record('other', _at(0, 0))
+    assert buffer._thread is thread
+
+
+def test_pending_timestamps_are_flushed_at_exit(monkeypatch):
+    registered = []
+    monkeypatch.setattr(last_access.atexit, 'register', registered.append)
+    flush = FakeFlush()
+    buffer = LastAccessBuffer(flush, flush_interval=3600, resolution=60)
+    buffer.record('key', _at(0, 0))
+    assert registered == [buffer.flush]
+    registered[0]()
+    assert flush.calls == [{'key': _at(0, 0)}]
+
+
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.last_access.flush_interval', '0')
+def test_unbuffered_touch_writes_straight_away(geoserver_tables):
+    user = factories.User()
+    authkey = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id'])
+    assert get_last_access_buffer() is None
+    GeoserverUserAuthkey.touch(authkey.authkey)
+    assert _last_access(authkey.authkey) is not None
+
+
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.last_access.flush_interval', '3600')
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.last_access.resolution', '1')
+def test_buffer_flushes_into_bulk_update_last_accessed(geoserver_tables, no_thread):
+    user = factories.User()
+    authkey = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id']).authkey
+    buffer = get_last_access_buffer()
+    assert buffer.flush_interval == 3600
+    GeoserverUserAuthkey.touch(authkey)
+    assert _last_access(authkey) is None
+    assert buffer.flush() == 1
+    written = _last_access(authkey)
+    assert written is not None
+
+    # An older flush from another worker never moves last_access backwards.
+    GeoserverUserAuthkey.bulk_update_last_accessed({authkey: written - datetime.timedelta(hours=1)})
+    assert _last_access(authkey) == written
@@ -0,0 +1,49 @@
+from ckanext.geoserver_webservice.membership import MembershipIndex, REDIS_PREFIX
+
+
+class FakeRedis():
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def _loader(memberships, calls):
+    def load(user_id):
+        calls.append(user_id)
+        return memberships.get(user_id, [])
+    return load
+
+
+def test_memory_index_loads_once_until_invalidated():
+    calls = []
+    index = MembershipIndex(_loader({'u1': ['o1', 'o2']}, calls))
+    assert index.get('u1') == ['o1', 'o2']
+    assert index.get('u1') == ['o1', 'o2']
+    assert calls == ['u1']
+    index.invalidate('u1')
+    index.get('u1')
+    assert calls == ['u1', 'u1']
+
+
+def test_redis_index_is_shared_between_instances():
+    redis = FakeRedis()
+    calls = []
+    first = MembershipIndex(_loader({'u1': ['o1']}, calls), redis=redis)
+    second = MembershipIndex(_loader({'u1': ['o1']}, calls), redis=redis)
+    assert first.get('u1') == ['o1']
+    assert second.get('u1') == ['o1']
+    assert calls == ['u1']
+    second.invalidate('u1')
+    assert REDIS_PREFIX + 'u1' not in redis.data
+    first.get('u1')
+    assert calls == ['u1', 'u1']
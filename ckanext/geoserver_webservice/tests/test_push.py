@@ -0,0 +1,109 @@
+"""
+Tests for push.py against a local fake of geoserver's role rest api.
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+from ckanext.geoserver_webservice.push import RoleSync
+
+
+class FakeGeoserver(BaseHTTPRequestHandler):
+    roles = set()
+    assignments = {}
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def _parts(self):
+        return [unquote(x) for x in self.path.split('/')[4:]]
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.calls.append(('GET', self.path))
+        parts = self._parts()
+        if not parts:
+            return self._reply(200, {'roles': sorted(self.roles)})
+        if parts[0] == 'user':
+            return self._reply(200, {'roles': sorted(self.assignments.get(parts[1], ()))})
+        self._reply(404)
+
+    def do_POST(self):
+        self.calls.append(('POST', self.path))
+        parts = self._parts()
+        if len(parts) == 2:
+            self.roles.add(parts[1])
+            return self._reply(201)
+        if parts[1] not in self.roles:
+            return self._reply(404)
+        self.assignments.setdefault(parts[3], set()).add(parts[1])
+        self._reply(200)
+
+    def do_DELETE(self):
+        self.calls.append(('DELETE', self.path))
+        parts = self._parts()
+        self.assignments.get(parts[3], set()).discard(parts[1])
+        self._reply(200)
+
+
+class Response():
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+@pytest.fixture
+def geoserver():
+    FakeGeoserver.roles = {'ROLE_ADMIN', 'ROLE_A'}
+    FakeGeoserver.assignments = {'alice': {'ROLE_ADMIN', 'ROLE_A'}}
+    FakeGeoserver.calls = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeoserver)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def request(method, path, headers=None):
+        req = urllib.request.Request(base + path, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req) as response:
+                return Response(response.status, response.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read())
+
+    yield request
+    server.shutdown()
+
+
+def test_push_sends_only_the_deltas(geoserver):
+    role_sync = RoleSync(geoserver, managed_roles={'ROLE_A', 'ROLE_B'})
+    stats = role_sync.push({'alice': {'ROLE_B'}, 'bob': {'ROLE_A'}})
+    assert stats == {'users': 2, 'created': 1, 'added': 2, 'removed': 1}
+    # Roles not managed by ckan are left alone.
+    assert FakeGeoserver.assignments['alice'] == {'ROLE_ADMIN', 'ROLE_B'}
+    assert FakeGeoserver.assignments['bob'] == {'ROLE_A'}
+
+    FakeGeoserver.calls = []
+    assert role_sync.push({'alice': {'ROLE_B'}, 'bob': {'ROLE_A'}})['added'] == 0
+    assert all(method == 'GET' for method, path in FakeGeoserver.calls)
+
+
+def test_push_uses_named_role_service(geoserver):
+    role_sync = RoleSync(geoserver, managed_roles={'ROLE_A'}, service='ckan roles', workers=1)
+    assert role_sync._path('user', 'a b') == '/rest/security/roles/service/ckan%20roles/user/a%20b'
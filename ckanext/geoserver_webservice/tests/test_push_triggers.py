@@ -0,0 +1,51 @@
+"""
+Tests for which changes queue a push of user roles to geoserver.
+"""
+import pytest
+
+from ckan.plugins import toolkit
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel
+
+pytestmark = [
+    pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice'),
+    pytest.mark.ckan_config('ckanext.geoserver_webservice.push.enabled', 'true'),
+    pytest.mark.usefixtures('with_plugins'),
+]
+
+
+@pytest.fixture
+def push_jobs(monkeypatch):
+    jobs = []
+
+    def record(fn, args=None, **kwargs):
+        if fn.__name__ == 'push_user_roles':
+            jobs.extend(args[0])
+
+    monkeypatch.setattr(toolkit, 'enqueue_job', record)
+    return jobs
+
+
+def test_user_role_changes_queue_a_push(sysadmin_request, push_jobs):
+    user = factories.User()
+    helpers.call_action('create_geoserver_user_role', user_id=user['id'], role='EDITOR')
+    assert push_jobs == [user['id']]
+
+    helpers.call_action('delete_geoserver_user_role', user_id=user['id'], role='EDITOR')
+    assert push_jobs == [user['id'], user['id']]
+
+
+def test_membership_changes_queue_a_push(sysadmin_request, push_jobs):
+    user = factories.User()
+    organization = factories.Organization()
+    GeoserverOrganizationRoleModel(organization_id=organization['id'], role='VIEWER').save()
+
+    helpers.call_action('organization_member_create', id=organization['id'], username=user['name'], role='member')
+    assert user['id'] in push_jobs
+
+
+def test_authkey_regeneration_does_not_queue_a_push(sysadmin_request, push_jobs):
+    user = factories.User()
+    helpers.call_action('generate_new_user_authkey', user_id=user['id'])
+    assert push_jobs == []
@@ -0,0 +1,86 @@
+"""
+Tests for the reconciliation of organization roles with a desired state.
+"""
+import pytest
+
+from ckan import model
+from ckan.tests import factories, helpers
+
+from ckanext.geoserver_webservice import logic
+from ckanext.geoserver_webservice.cache import organization_tag, user_tag
+from ckanext.geoserver_webservice.logic import resolve_authkey
+from ckanext.geoserver_webservice.model import GeoserverOrganizationRoleModel, GeoserverUserAuthkey
+
+
+def _organization(*roles, users=()):
+    organization = factories.Organization(users=[{'name': user['name'], 'capacity': 'member'} for user in users])
+    for role in roles:
+        GeoserverOrganizationRoleModel(organization_id=organization['id'], role=role).save()
+    return organization
+
+
+def test_sync_adds_missing_and_soft_deletes_surplus_roles(geoserver_tables):
+    a = _organization('EDITOR', 'VIEWER')
+    b = _organization('VIEWER')
+    c = _organization('EDITOR')
+    unchanged = GeoserverOrganizationRoleModel.get_active_role(a['id'], 'EDITOR')
+    unchanged_id, unchanged_modified = unchanged.id, unchanged.last_modified
+    surplus_id = GeoserverOrganizationRoleModel.get_active_role(a['id'], 'VIEWER').id
+
+    added, deleted = GeoserverOrganizationRoleModel.sync({a['id']: ['EDITOR', 'ANALYST'], b['id']: []})
+
+    assert added == {(a['id'], 'ANALYST')}
+    assert deleted == {(a['id'], 'VIEWER'), (b['id'], 'VIEWER')}
+    assert sorted(GeoserverOrganizationRoleModel.get_active_roles(a['id'])) == ['ANALYST', 'EDITOR']
+    assert GeoserverOrganizationRoleModel.get_active_roles(b['id']) == []
+    assert GeoserverOrganizationRoleModel.get_active_roles(c['id']) == ['EDITOR']
+
+    model.Session.expire_all()
+    row = GeoserverOrganizationRoleModel.get(unchanged_id)
+    assert (row.state, row.last_modified, row.closed) == ('active', unchanged_modified, None)
+    surplus = GeoserverOrganizationRoleModel.get(surplus_id)
+    assert surplus.state == 'deleted' and surplus.closed is not None
+
+
+def test_sync_without_changes_writes_nothing(geoserver_tables):
+    a = _organization('EDITOR')
+    assert GeoserverOrganizationRoleModel.sync({a['id']: ['EDITOR']}) == (set(), set())
+    assert GeoserverOrganizationRoleModel.sync({}) == (set(), set())
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'geoserver_webservice')
+@pytest.mark.usefixtures('with_plugins')
+def test_sync_action_reports_changes_and_invalidates_affected_organizations(sysadmin_request, monkeypatch):
+    member = factories.User()
+    other = factories.User()
+    a = _organization('EDITOR', 'VIEWER', users=[member])
+    b = _organization('VIEWER')
+    c = _organization('EDITOR', users=[other])
+    authkey = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(member['id']).authkey
+    assert 'VIEWER' in resolve_authkey(authkey)['roles'].split(', ')
+
+    invalidated = []
+    invalidate_tags = logic.invalidate_tags
+
+    def record(tags):
+        invalidated.extend(tags)
+        invalidate_tags(tags)
+
+    monkeypatch.setattr(logic, 'invalidate_tags', record)
+    result = helpers.call_action('sync_geoserver_organization_roles', organizations={
+        a['name']: ['EDITOR', 'ANALYST'],
+        b['id']: ['VIEWER'],
+        c['id']: ['NOT_A_ROLE'],
+        'missing-organization': ['EDITOR'],
+    })
+
+    assert result['added'] == {a['id']: ['ANALYST']}
+    assert result['deleted'] == {a['id']: ['VIEWER']}
+    assert set(result['errors']) == {c['id'], 'missing-organization'}
+    assert GeoserverOrganizationRoleModel.get_active_roles(c['id']) == ['EDITOR']
+
+    assert organization_tag(a['id']) in invalidated and user_tag(member['id']) in invalidated
+    assert organization_tag(b['id']) not in invalidated
+    assert organization_tag(c['id']) not in invalidated and user_tag(other['id']) not in invalidated
+    roles = resolve_authkey(authkey)['roles'].split(', ')
+    assert 'ANALYST' in roles and 'VIEWER' not in roles
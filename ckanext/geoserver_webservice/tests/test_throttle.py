@@ -0,0 +1,54 @@
+"""
+Tests for the throttling of failed authkey lookups.
+"""
+import uuid
+
+import pytest
+
+from ckan.tests import factories
+
+from ckanext.geoserver_webservice import metrics
+from ckanext.geoserver_webservice.logic import resolve_authkey
+from ckanext.geoserver_webservice.model import GeoserverUserAuthkey
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+    get_active_user = GeoserverUserAuthkey.get_active_user
+
+    def record(authkey):
+        calls.append(authkey)
+        return get_active_user(authkey)
+
+    monkeypatch.setattr(GeoserverUserAuthkey, 'get_active_user', record)
+    return calls
+
+
+@pytest.mark.ckan_config('ckanext.geoserver_webservice.throttle.max_failures_per_source', '3')
+def test_throttled_source_is_only_answered_from_the_cache(geoserver_tables, lookups):
+    cached_user = factories.User()
+    cached = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(cached_user['id']).authkey
+    uncached = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(factories.User()['id']).authkey
+    assert resolve_authkey(cached)['user'] == cached_user['name']
+    metrics.reset()
+    del lookups[:]
+
+    for _ in range(10):
+        assert resolve_authkey(str(uuid.uuid4()), source='203.0.113.7') is None
+    assert len(lookups) == 3
+    assert metrics.get_metrics()['counters']['authkey.rejected.throttled_source'] == 7
+
+    assert resolve_authkey(cached, source='203.0.113.7')['user'] == cached_user['name']
+    assert resolve_authkey(uncached, source='203.0.113.7') is None
+    assert len(lookups) == 3
+
+    assert resolve_authkey(uncached, source='198.51.100.1') is not None
+    assert len(lookups) == 4
+
+
+def test_source_throttling_is_off_by_default(geoserver_tables):
+    metrics.reset()
+    for _ in range(200):
+        resolve_authkey(str(uuid.uuid4()), source='203.0.113.7')
+    assert 'authkey.rejected.throttled_source' not in metrics.get_metrics()['counters']
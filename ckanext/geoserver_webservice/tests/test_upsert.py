@@ -0,0 +1,79 @@
+"""
+Concurrency tests for the INSERT ... ON CONFLICT DO NOTHING creation of roles and authkeys.
+"""
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+from ckan import model
+from ckan.tests import factories
+
+from ckanext.geoserver_webservice.model import (
+    GeoserverUserRoleModel, GeoserverOrganizationRoleModel, GeoserverUserAuthkey)
+
+WORKERS = 8
+
+
+def _race(create):
+    barrier = threading.Barrier(WORKERS)
+    errors = []
+
+    def worker():
+        try:
+            barrier.wait()
+            create()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            model.Session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def _active_rows(table, **filters):
+    where = ' AND '.join(f'{column} = :{column}' for column in filters)
+    return model.Session.execute(sa.text(
+        f"SELECT count(*) FROM {table} WHERE state = 'active' AND {where}"), filters).scalar()
+
+
+def test_concurrent_user_role_creation_keeps_one_active_row(geoserver_tables):
+    user = factories.User()
+    errors = _race(lambda: GeoserverUserRoleModel(user_id=user['id'], role='ROLE_EDITOR').save())
+    assert errors == []
+    assert _active_rows('geoserver_user_role', user_id=user['id'], role='ROLE_EDITOR') == 1
+
+
+def test_concurrent_organization_role_creation_keeps_one_active_row(geoserver_tables):
+    org = factories.Organization()
+    errors = _race(lambda: GeoserverOrganizationRoleModel(organization_id=org['id'], role='ROLE_EDITOR').save())
+    assert errors == []
+    assert _active_rows('geoserver_organization_role', organization_id=org['id'], role='ROLE_EDITOR') == 1
+
+
+def test_concurrent_authkey_creation_keeps_one_active_row(geoserver_tables):
+    user = factories.User()
+    errors = _race(lambda: GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id']))
+    assert errors == []
+    assert _active_rows('geoserver_user_authkey', user_id=user['id']) == 1
+
+
+def test_new_authkey_replaces_active_authkey(geoserver_tables):
+    user = factories.User()
+    first = GeoserverUserAuthkey.get_geoserver_user_authkey_for_user(user['id']).authkey
+    second = GeoserverUserAuthkey.generate_new_user_authkey(user['id']).authkey
+    assert first != second
+    assert _active_rows('geoserver_user_authkey', user_id=user['id']) == 1
+
+
+def test_bulk_add_skips_active_pairs(geoserver_tables):
+    user = factories.User()
+    GeoserverUserRoleModel(user_id=user['id'], role='ROLE_A').save()
+    added = GeoserverUserRoleModel.bulk_add([(user['id'], 'ROLE_A'), (user['id'], 'ROLE_B')])
+    assert added == {(user['id'], 'ROLE_B')}
+    assert _active_rows('geoserver_user_role', user_id=user['id'], role='ROLE_A') == 1